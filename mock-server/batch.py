@@ -0,0 +1,270 @@
+"""
+OData v2 `$batch` support for the mock server.
+
+A batch is a multipart/mixed body whose parts are either single requests or
+changesets (nested multipart/mixed bodies of modifying requests). Each part is
+dispatched in-process through the application's router. Runs of consecutive
+read parts are served concurrently; a changeset is applied inside a store
+transaction and rolled back as a whole if any of its requests fails.
+"""
+
+import asyncio
+import uuid
+from contextlib import nullcontext
+from http import HTTPStatus
+from typing import Any, AsyncContextManager, Callable, Dict, List, MutableMapping, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from store import transaction
+
+READ_METHODS = {"GET", "HEAD"}
+
+
+class BatchError(ValueError):
+    """Raised when a batch request body cannot be parsed."""
+
+
+class BatchRequest:
+    """One request inside a batch."""
+
+    def __init__(self, method: str, url: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+
+class BatchResponse:
+    """Response to one request inside a batch."""
+
+    def __init__(self, status: int, headers: List[Tuple[str, str]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+BatchPart = Union[BatchRequest, List[BatchRequest]]
+
+
+# Parsing
+
+def _boundary(content_type: str) -> str:
+    media_type, _, params = content_type.partition(";")
+    if media_type.strip().lower() != "multipart/mixed":
+        raise BatchError(f"Expected multipart/mixed content, got: {content_type or 'none'}")
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"')
+    raise BatchError("Missing multipart boundary")
+
+
+def _split_head(data: bytes) -> Tuple[List[str], bytes]:
+    """Split a header block from the body that follows the first blank line."""
+    data = data.lstrip(b"\r\n")
+    for separator in (b"\r\n\r\n", b"\n\n"):
+        head, found, body = data.partition(separator)
+        if found:
+            return head.decode("utf-8").splitlines(), body
+    return data.decode("utf-8").splitlines(), b""
+
+
+def _headers(lines: List[str]) -> Dict[str, str]:
+    headers = {}
+    for line in lines:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def _multipart(body: bytes, boundary: str) -> List[Tuple[Dict[str, str], bytes]]:
+    delimiter = b"--" + boundary.encode("utf-8")
+    chunks = body.split(delimiter)
+    if len(chunks) < 2:
+        raise BatchError("Multipart body contains no parts")
+    parts = []
+    for chunk in chunks[1:]:
+        if chunk.startswith(b"--"):
+            break
+        # The line break before a delimiter belongs to the delimiter
+        if chunk.endswith(b"\r\n"):
+            chunk = chunk[:-2]
+        elif chunk.endswith(b"\n"):
+            chunk = chunk[:-1]
+        lines, content = _split_head(chunk)
+        parts.append((_headers(lines), content))
+    return parts
+
+
+def _http_request(content: bytes) -> BatchRequest:
+    lines, body = _split_head(content)
+    if not lines:
+        raise BatchError("Batch part contains no request line")
+    request_line = lines[0].split()
+    if len(request_line) < 2:
+        raise BatchError(f"Invalid request line in batch part: {lines[0]}")
+    return BatchRequest(request_line[0].upper(), request_line[1], _headers(lines[1:]), body)
+
+
+def parse_batch(body: bytes, content_type: str) -> List[BatchPart]:
+    """Parse a batch body into requests and changesets (lists of requests)."""
+    parts: List[BatchPart] = []
+    for headers, content in _multipart(body, _boundary(content_type)):
+        part_type = headers.get("content-type", "")
+        if part_type.lower().startswith("multipart/mixed"):
+            changeset = [_http_request(inner) for _, inner in _multipart(content, _boundary(part_type))]
+            parts.append(changeset)
+        else:
+            parts.append(_http_request(content))
+    return parts
+
+
+# Execution
+
+def _target(url: str, service_root: str) -> Tuple[str, str]:
+    """Resolve a part URL, absolute or relative to the service root, to (path, query)."""
+    split = urlsplit(url)
+    path = split.path
+    if not split.scheme and not path.startswith("/"):
+        path = f"{service_root.rstrip('/')}/{path}"
+    return path, split.query
+
+
+def _error(status: int, message: str) -> BatchResponse:
+    return BatchResponse(status, [("content-type", "application/json")],
+                         ('{"error":"%s"}' % message).encode("utf-8"))
+
+
+async def dispatch(app: Callable, scope: MutableMapping[str, Any], request: BatchRequest,
+                   service_root: str) -> BatchResponse:
+    """Run one batch request through an ASGI app and capture its response."""
+    path, query = _target(request.url, service_root)
+    inner_scope = {key: value for key, value in scope.items()
+                   if key not in ("route", "endpoint", "path_params")}
+    inner_scope.update({
+        "method": request.method,
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": query.encode("utf-8"),
+        # Parts are sent back inside the multipart body, which is compressed as a whole if at all
+        "headers": [(name.encode("latin-1"), value.encode("latin-1"))
+                    for name, value in request.headers.items() if name != "accept-encoding"],
+    })
+    sent_body = False
+    status = 500
+    headers: List[Tuple[str, str]] = []
+    chunks: List[bytes] = []
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": request.body, "more_body": False}
+        # The client of an in-process request never disconnects
+        await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            headers.extend((name.decode("latin-1"), value.decode("latin-1"))
+                           for name, value in message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await app(inner_scope, receive, send)
+    except Exception:
+        return _error(500, "Internal Server Error")
+    return BatchResponse(status, headers, b"".join(chunks))
+
+
+class _ChangesetFailed(Exception):
+    def __init__(self, response: BatchResponse):
+        super().__init__(response.status)
+        self.response = response
+
+
+async def _run_changeset(app: Callable, scope: MutableMapping[str, Any], changeset: List[BatchRequest],
+                         service_root: str, writes: Callable[[], AsyncContextManager[Any]]
+                         ) -> Union[BatchResponse, List[BatchResponse]]:
+    if any(request.method in READ_METHODS for request in changeset):
+        return _error(400, "Changesets may only contain modifying requests")
+    responses = []
+    try:
+        # Held across the changeset's requests so that a rollback is written under it as well;
+        # they are dispatched in-process with their bodies in hand, so nothing waits on a client
+        async with writes():
+            with transaction():
+                for request in changeset:
+                    response = await dispatch(app, scope, request, service_root)
+                    if response.status >= 400:
+                        raise _ChangesetFailed(response)
+                    responses.append(response)
+    except _ChangesetFailed as failed:
+        return failed.response
+    return responses
+
+
+async def execute_batch(app: Callable, scope: MutableMapping[str, Any], parts: List[BatchPart], service_root: str,
+                        writes: Callable[[], AsyncContextManager[Any]] = nullcontext
+                        ) -> List[Union[BatchResponse, List[BatchResponse]]]:
+    """Execute batch parts in order, serving each run of read requests concurrently.
+
+    `writes` opens the block a changeset's writes are made in, such as a shared store's write lock.
+    """
+    results: List[Union[BatchResponse, List[BatchResponse]]] = []
+    reads: List[BatchRequest] = []
+
+    async def flush_reads() -> None:
+        if reads:
+            results.extend(await asyncio.gather(*(dispatch(app, scope, read, service_root) for read in reads)))
+            reads.clear()
+
+    for part in parts:
+        if isinstance(part, list):
+            await flush_reads()
+            results.append(await _run_changeset(app, scope, part, service_root, writes))
+        elif part.method in READ_METHODS:
+            reads.append(part)
+        else:
+            await flush_reads()
+            results.append(await dispatch(app, scope, part, service_root))
+    await flush_reads()
+    return results
+
+
+# Formatting
+
+def _http_response(response: BatchResponse) -> bytes:
+    lines = [f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in response.headers if name.lower() != "content-length")
+    lines.append(f"Content-Length: {len(response.body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + response.body
+
+
+def _application_http(response: BatchResponse) -> bytes:
+    return (b"Content-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n\r\n"
+            + _http_response(response))
+
+
+def _multipart_body(parts: List[bytes], boundary: str) -> bytes:
+    delimiter = f"--{boundary}\r\n".encode("utf-8")
+    return b"".join(delimiter + part + b"\r\n" for part in parts) + f"--{boundary}--\r\n".encode("utf-8")
+
+
+def format_batch(results: List[Union[BatchResponse, List[BatchResponse]]],
+                 boundary: Optional[str] = None) -> Tuple[bytes, str]:
+    """Encode batch results as a multipart/mixed body, returning it with its content type."""
+    boundary = boundary or f"batchresponse_{uuid.uuid4()}"
+    parts = []
+    for result in results:
+        if isinstance(result, list):
+            changeset_boundary = f"changesetresponse_{uuid.uuid4()}"
+            parts.append(f"Content-Type: multipart/mixed; boundary={changeset_boundary}\r\n\r\n".encode("utf-8")
+                         + _multipart_body([_application_http(response) for response in result], changeset_boundary))
+        else:
+            parts.append(_application_http(result))
+    return _multipart_body(parts, boundary), f"multipart/mixed; boundary={boundary}"
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Load generator and benchmark for the SAP SuccessFactors Employee Central mock server.
+
+Each workload (keyed reads, paged lists, filtered queries, creates, batched
+creates, workflow actions) is driven for a fixed time by a number of
+concurrent clients sharing one keep-alive connection pool. Throughput and
+latency percentiles are reported per endpoint, and can be saved as a baseline
+JSON file and compared against on later runs:
+
+    python benchmark.py --scale 100000 --save baseline.json
+    python benchmark.py --scale 100000 --compare baseline.json
+
+`--scale` and `--seed` should match the server's MOCK_SCALE and MOCK_SEED so
+that keyed requests hit generated rows. Requires `httpx` (`pip install httpx`).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import httpx
+
+from dataset import EMPLOYEES_PER_WORKFLOW, ID_BASE, JOBS_PER_EMPLOYEE, user_id
+
+SERVICE_ROOT = "/successfactors/odata/v2"
+
+# Entity that created rows go to, so that the seeded entities are left as they are
+SCRATCH_ENTITY = "BenchmarkRecord"
+
+# Create requests per $batch changeset in the bulk-create workload
+BATCH_SIZE = 20
+
+
+class Call:
+    """One request a workload makes, labelled with the endpoint it exercises."""
+
+    def __init__(self, endpoint: str, method: str, path: str, params: Optional[Dict[str, str]] = None,
+                 body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.params = params
+        self.body = body
+        self.headers = headers
+
+
+def _json(value: Any) -> bytes:
+    return json.dumps(value).encode("utf-8")
+
+
+# Workloads: each turns a random generator into an endless stream of calls
+
+class Tenant:
+    """Keys of the rows the server holds for a given MOCK_SCALE."""
+
+    def __init__(self, scale: int, client: int = 0, clients: int = 1):
+        self.scale = scale
+        self.client = client
+        self.clients = clients
+
+    def share(self, client: int, clients: int) -> "Tenant":
+        """The tenant as one of `clients` concurrent clients sees it, with workflow requests of its own."""
+        return Tenant(self.scale, client, clients)
+
+    def user(self, rng: random.Random) -> str:
+        if self.scale <= 0:
+            return rng.choice(["EMP001", "EMP002"])
+        return user_id(rng.randrange(self.scale))
+
+    def rows(self, entity: str) -> int:
+        if entity == "EmpJob":
+            return max(2, self.scale * JOBS_PER_EMPLOYEE)
+        return max(2, self.scale)
+
+    def workflow_request(self, rng: random.Random) -> int:
+        """A workflow request no other client acts on, unless there are fewer requests than clients."""
+        if self.scale <= 0:
+            return 1
+        requests = max(1, self.scale // EMPLOYEES_PER_WORKFLOW)
+        if requests <= self.clients:
+            return ID_BASE + self.client % requests
+        return ID_BASE + self.client + self.clients * rng.randrange((requests - self.client - 1) // self.clients + 1)
+
+
+def keyed_read(tenant: Tenant, rng: random.Random) -> Iterator[Call]:
+    while True:
+        user = tenant.user(rng)
+        yield Call("GET {entity}({key})", "GET", f"{SERVICE_ROOT}/EmpEmployment('{user}')")
+        yield Call("GET {entity}({key1},{key2})", "GET",
+                   f"{SERVICE_ROOT}/Background_Education(backgroundElementId=1,userId='{user}')")
+
+
+def paged_list(tenant: Tenant, rng: random.Random) -> Iterator[Call]:
+    while True:
+        skip = rng.randrange(tenant.rows("EmpJob"))
+        yield Call("GET {entity}?$top", "GET", f"{SERVICE_ROOT}/EmpJob", {"$top": "100", "$skip": str(skip)})
+
+
+def filtered_query(tenant: Tenant, rng: random.Random) -> Iterator[Call]:
+    while True:
+        yield Call("GET {entity}?$filter (indexed)", "GET", f"{SERVICE_ROOT}/EmpJob",
+                   {"$filter": f"userId eq '{tenant.user(rng)}'"})
+        year = rng.randrange(2000, 2024)
+        yield Call("GET {entity}?$filter (range)", "GET", f"{SERVICE_ROOT}/EmpEmployment",
+                   {"$filter": f"startDate ge datetime'{year}-01-01T00:00:00' and startDate lt datetime'{year}-02-01T00:00:00'",
+                    "$top": "50"})
+
+
+def create(tenant: Tenant, rng: random.Random) -> Iterator[Call]:
+    while True:
+        yield Call("POST {entity}", "POST", f"{SERVICE_ROOT}/{SCRATCH_ENTITY}",
+                   body=_json({"externalCode": f"BENCH{rng.getrandbits(48):012x}", "userId": tenant.user(rng)}),
+                   headers={"Content-Type": "application/json"})
+
+
+def bulk_create(tenant: Tenant, rng: random.Random) -> Iterator[Call]:
+    while True:
+        batch, changeset = f"batch_{uuid.UUID(int=rng.getrandbits(128))}", f"changeset_{rng.getrandbits(64):016x}"
+        parts = []
+        for _ in range(BATCH_SIZE):
+            body = json.dumps({"externalCode": f"BENCH{rng.getrandbits(48):012x}", "userId": tenant.user(rng)})
+            parts.append(f"--{changeset}\r\nContent-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n\r\n"
+                         f"POST {SCRATCH_ENTITY} HTTP/1.1\r\nContent-Type: application/json\r\n\r\n{body}\r\n")
+        content = (f"--{batch}\r\nContent-Type: multipart/mixed; boundary={changeset}\r\n\r\n"
+                   + "".join(parts) + f"--{changeset}--\r\n--{batch}--\r\n")
+        yield Call("POST $batch", "POST", f"{SERVICE_ROOT}/$batch", body=content.encode("utf-8"),
+                   headers={"Content-Type": f"multipart/mixed; boundary={batch}"})
+
+
+def workflow_action(tenant: Tenant, rng: random.Random) -> Iterator[Call]:
+    # Parameters go in the query string, as the clients send them. Approving a step and sending it
+    # back leaves the request pending, so the workload can run indefinitely; rejecting would close
+    # requests for the rest of the run and turn later actions on them into conflicts.
+    while True:
+        request_id = f"{tenant.workflow_request(rng)}L"
+        yield Call("POST getWorkflowPendingData", "POST", f"{SERVICE_ROOT}/getWorkflowPendingData",
+                   {"wfRequestId": request_id})
+        yield Call("POST commentWfRequest", "POST", f"{SERVICE_ROOT}/commentWfRequest",
+                   {"wfRequestId": request_id, "comment": "'benchmark'"})
+        yield Call("POST approveWfRequest", "POST", f"{SERVICE_ROOT}/approveWfRequest", {"wfRequestId": request_id})
+        yield Call("POST sendbackWfRequest", "POST", f"{SERVICE_ROOT}/sendbackWfRequest", {"wfRequestId": request_id})
+
+
+WORKLOADS: Dict[str, Callable[[Tenant, random.Random], Iterator[Call]]] = {
+    "keyed-read": keyed_read,
+    "paged-list": paged_list,
+    "filtered-query": filtered_query,
+    "create": create,
+    "bulk-create": bulk_create,
+    "workflow-action": workflow_action,
+}
+
+
+# Measurement
+
+class Recorder:
+    """Latencies, errors and response sizes per endpoint."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool, size: int) -> None:
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for endpoint, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            result[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput": round(len(ordered) / elapsed, 1),
+                "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                "mean_bytes": round(self.bytes.get(endpoint, 0) / len(ordered)),
+            }
+        return result
+
+
+def percentile(ordered: List[float], rank: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    index = math.ceil(rank / 100 * len(ordered)) - 1
+    return ordered[max(0, min(len(ordered) - 1, index))]
+
+
+async def _client_loop(client: httpx.AsyncClient, calls: Iterator[Call], recorder: Optional[Recorder],
+                       deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        call = next(calls)
+        started = time.perf_counter()
+        try:
+            response = await client.request(call.method, call.path, params=call.params, content=call.body,
+                                            headers=call.headers)
+            ok, size = response.status_code < 400, len(response.content)
+        except httpx.HTTPError:
+            ok, size = False, 0
+        if recorder is not None:
+            recorder.record(call.endpoint, time.perf_counter() - started, ok, size)
+
+
+async def run_workload(client: httpx.AsyncClient, name: str, tenant: Tenant, concurrency: int,
+                       duration: float, warmup: float, seed: int) -> Dict[str, Dict[str, float]]:
+    """Drive one workload from `concurrency` clients and summarise it per endpoint."""
+    workload = WORKLOADS[name]
+    # Each client draws from its own stream, so a given seed replays the same requests
+    streams = [workload(tenant.share(client_id, concurrency), random.Random(f"{seed}:{name}:{client_id}"))
+               for client_id in range(concurrency)]
+    if warmup > 0:
+        deadline = time.perf_counter() + warmup
+        await asyncio.gather(*(_client_loop(client, calls, None, deadline) for calls in streams))
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_client_loop(client, calls, recorder, deadline) for calls in streams))
+    return recorder.summary(time.perf_counter() - started)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    tenant = Tenant(args.scale)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        health = await client.get("/health")
+        health.raise_for_status()
+        for name in args.workloads:
+            print(f"Running {name} for {args.duration:g}s with {args.concurrency} clients...", file=sys.stderr)
+            results[name] = await run_workload(client, name, tenant, args.concurrency, args.duration,
+                                               args.warmup, args.seed)
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "base_url": args.base_url,
+            "scale": args.scale,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "python": platform.python_version(),
+        },
+        "workloads": results,
+    }
+
+
+# Reporting
+
+def print_report(report: Dict[str, Any]) -> None:
+    header = f"{'workload':<16} {'endpoint':<34} {'req':>7} {'err':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, endpoints in report["workloads"].items():
+        for endpoint, stats in endpoints.items():
+            print(f"{name:<16} {endpoint:<34} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput']:>9.1f} "
+                  f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Endpoints whose p95 latency or throughput regressed beyond `tolerance` against the baseline."""
+    regressions = []
+    for name, endpoints in report["workloads"].items():
+        for endpoint, stats in endpoints.items():
+            base = baseline.get("workloads", {}).get(name, {}).get(endpoint)
+            if base is None:
+                continue
+            if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{name} {endpoint}: p95 {base['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms")
+            if stats["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(f"{name} {endpoint}: throughput {base['throughput']:.1f} -> {stats['throughput']:.1f} req/s")
+            if stats["errors"] > base["errors"]:
+                regressions.append(f"{name} {endpoint}: errors {base['errors']} -> {stats['errors']}")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000", help="server to benchmark")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help=f"comma-separated workloads to run (default: all of {', '.join(WORKLOADS)})")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per workload")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per workload")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before each workload")
+    parser.add_argument("--scale", type=int, default=0, help="the server's MOCK_SCALE, to pick existing keys")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated requests")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON file to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression in p95 latency and throughput (default 0.25)")
+    args = parser.parse_args(argv)
+    args.workloads = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nSaved results to {args.save}")
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
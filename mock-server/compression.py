@@ -0,0 +1,100 @@
+"""
+Content-coding negotiation and compression of response bodies.
+
+The coding is picked from the request's `Accept-Encoding`: brotli when the
+`brotli` package is installed and the client accepts it, gzip otherwise.
+Streamed bodies are compressed chunk by chunk, and each chunk is flushed so
+that a streamed collection still reaches the client as it is encoded.
+"""
+
+import os
+import zlib
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as they are
+COMPRESS_MIN_BYTES = int(os.environ.get("MOCK_COMPRESS_MIN_BYTES", "1024"))
+
+GZIP_LEVEL = int(os.environ.get("MOCK_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("MOCK_BROTLI_QUALITY", "5"))
+
+# Codings the server can produce, most preferred first
+CODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The coding to compress a response with, given the request's Accept-Encoding; None to send it as is."""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.partition(";")
+        weight = 1.0
+        name, _, value = parameters.strip().partition("=")
+        if name.strip().lower() == "q":
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for coding in CODINGS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class Compressor:
+    """Incremental compressor for one response body."""
+
+    def __init__(self, coding: str):
+        self.coding = coding
+        if coding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits 16 + 15 writes the gzip container
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compress a chunk and flush it, so that it can be decoded on arrival."""
+        if self.coding == "br":
+            return self._brotli.process(chunk) + self._brotli.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.coding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def compress(body: bytes, coding: str) -> bytes:
+    """Compress a whole body."""
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_chunks(chunks: Iterable[bytes], coding: str) -> Iterator[bytes]:
+    """Compress a body as its chunks are produced."""
+    compressor = Compressor(coding)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.finish()
+
+
+async def compress_stream(chunks: AsyncIterator[bytes], coding: str) -> AsyncIterator[bytes]:
+    """Compress a body as its chunks arrive from an asynchronous source."""
+    compressor = Compressor(coding)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.finish()
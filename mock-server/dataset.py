@@ -0,0 +1,224 @@
+"""
+Deterministic synthetic datasets for the mock server.
+
+`SyntheticDataset` describes a tenant of a given number of employees. Every
+row is derived from the seed, the entity name and the row number alone, so
+any row can be produced on its own and the same configuration always yields
+the same data. Rows of an entity are only generated when the store first
+touches that entity.
+
+Employees are numbered 0..scale-1 and identified by `userId` `USR0000000`,
+`USR0000001`, ...; jobs, background elements, positions and workflow
+requests all reference existing employees.
+"""
+
+import random
+import uuid
+import zlib
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+Row = Dict[str, Any]
+
+FIRST_DATE = date(2000, 1, 1)
+DATE_SPAN_DAYS = 24 * 365
+
+# Numeric ids of generated rows start here, clear of the hand-written seed rows
+ID_BASE = 1000
+
+JOBS_PER_EMPLOYEE = 2
+EMPLOYEES_PER_MANAGER = 8
+EMPLOYEES_PER_POSITION = 5
+EMPLOYEES_PER_WORKFLOW = 10
+# Approval steps of a generated workflow request: the submitter's manager, then a second approver
+STEPS_PER_WORKFLOW = 2
+
+JOB_TITLES = ["Engineer", "Senior Engineer", "Manager", "Analyst", "Consultant", "Architect",
+              "Designer", "Accountant", "Recruiter", "Director"]
+DEPARTMENTS = ["Engineering", "Finance", "Sales", "Marketing", "Human Resources", "Operations",
+               "Legal", "Support"]
+EMPLOYMENT_STATUSES = ["Active", "Active", "Active", "Active", "Terminated", "Leave"]
+REQUEST_TYPES = ["Leave", "Hire", "Job Change", "Compensation Change", "Termination"]
+PRIORITIES = ["Low", "Normal", "High"]
+
+
+_MASK64 = (1 << 64) - 1
+
+
+class RowRandom(random.Random):
+    """Small splitmix64 generator, far cheaper to create per row than the Mersenne Twister."""
+
+    def seed(self, a: Any = None, version: int = 2) -> None:
+        self._state = (a or 0) & _MASK64
+
+    def getrandbits(self, k: int) -> int:
+        bits = 0
+        for shift in range(0, k, 64):
+            self._state = (self._state + 0x9E3779B97F4A7C15) & _MASK64
+            z = self._state
+            z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+            z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+            bits |= (z ^ (z >> 31)) << shift
+        return bits & ((1 << k) - 1)
+
+    def random(self) -> float:
+        return self.getrandbits(53) / (1 << 53)
+
+
+@lru_cache(maxsize=None)
+def stream_seed(*parts: Any) -> int:
+    """Stable 32-bit seed for a named stream of rows."""
+    return zlib.crc32(":".join(map(str, parts)).encode("utf-8"))
+
+
+def user_id(employee: int) -> str:
+    return f"USR{employee:07d}"
+
+
+def person_id(employee: int) -> str:
+    return f"PER{employee:07d}"
+
+
+def seeded_uuid(rng: random.Random) -> str:
+    """A version 4 UUID drawn from the given generator instead of the OS."""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _date(rng: random.Random, start: date = FIRST_DATE, span_days: int = DATE_SPAN_DAYS) -> str:
+    return (start + timedelta(days=rng.randrange(span_days))).isoformat()
+
+
+def _vary(template: Row, rng: random.Random) -> Row:
+    """Copy a seed row, drawing new values for its dates and numbers."""
+    row = {}
+    for field, value in template.items():
+        if isinstance(value, bool):
+            row[field] = rng.random() < 0.5
+        elif isinstance(value, int):
+            row[field] = rng.randint(max(1, value // 2), max(2, value * 2))
+        elif isinstance(value, str) and len(value) == 10 and value[4] == "-" and value[7] == "-":
+            row[field] = _date(rng)
+        else:
+            row[field] = value
+    return row
+
+
+class SyntheticDataset:
+    """Lazily generated rows for a tenant of `scale` employees."""
+
+    def __init__(self, scale: int, seed: int = 0, templates: Optional[Dict[str, List[Row]]] = None):
+        self.scale = scale
+        self.seed = seed
+        self.templates = templates or {}
+        self._generators: Dict[str, Callable[[int, random.Random], Row]] = {
+            "EmpEmployment": self._employment,
+            "EmpJob": self._job,
+            "Position": self._position,
+            "WfRequest": self._workflow_request,
+            "WfRequestParticipator": self._workflow_participator,
+        }
+        for entity in self.templates:
+            if entity.startswith("Background_"):
+                self._generators[entity] = self._background(entity)
+
+    def count(self, entity: str) -> int:
+        """Number of rows the dataset holds for an entity."""
+        if self.scale <= 0 or entity not in self._generators:
+            return 0
+        if entity == "EmpJob":
+            return self.scale * JOBS_PER_EMPLOYEE
+        if entity == "Position":
+            return max(1, self.scale // EMPLOYEES_PER_POSITION)
+        if entity == "WfRequest":
+            return max(1, self.scale // EMPLOYEES_PER_WORKFLOW)
+        if entity == "WfRequestParticipator":
+            return max(1, self.scale // EMPLOYEES_PER_WORKFLOW) * STEPS_PER_WORKFLOW
+        return self.scale
+
+    def _rng(self, stream: str, index: int) -> random.Random:
+        return RowRandom((stream_seed(self.seed, stream) << 32) | index)
+
+    def row(self, entity: str, index: int) -> Row:
+        """Generate row `index` of an entity; the result depends only on the seed, entity and index."""
+        return self._generators[entity](index, self._rng(entity, index))
+
+    def rows(self, entity: str, start: int = 0, stop: Optional[int] = None) -> Iterator[Row]:
+        """Generate rows `start` up to `stop` (all remaining rows by default) of an entity."""
+        stop = self.count(entity) if stop is None else min(stop, self.count(entity))
+        for index in range(start, stop):
+            yield self.row(entity, index)
+
+    # Generators, one per entity family
+
+    def _employee_rng(self, employee: int) -> random.Random:
+        return self._rng("employee", employee)
+
+    def _hire_date(self, employee: int) -> str:
+        return _date(self._employee_rng(employee))
+
+    def _employment(self, index: int, rng: random.Random) -> Row:
+        return {
+            "personIdExternal": person_id(index),
+            "userId": user_id(index),
+            "startDate": self._hire_date(index),
+            "employmentStatus": rng.choice(EMPLOYMENT_STATUSES),
+        }
+
+    def _job(self, index: int, rng: random.Random) -> Row:
+        employee, seq = divmod(index, JOBS_PER_EMPLOYEE)
+        hired = date.fromisoformat(self._hire_date(employee))
+        return {
+            "seqNumber": seq + 1,
+            "startDate": (hired + timedelta(days=365 * seq + rng.randrange(365) * bool(seq))).isoformat(),
+            "userId": user_id(employee),
+            "jobTitle": rng.choice(JOB_TITLES),
+            "department": rng.choice(DEPARTMENTS),
+            # Managers form a tree rooted at the first employee, who reports to themselves
+            "managerId": user_id(employee // EMPLOYEES_PER_MANAGER),
+        }
+
+    def _position(self, index: int, rng: random.Random) -> Row:
+        return {
+            "positionId": f"POS{index:07d}",
+            "positionTitle": rng.choice(JOB_TITLES),
+            "department": rng.choice(DEPARTMENTS),
+            "status": "Active",
+            "incumbent": user_id(index * EMPLOYEES_PER_POSITION),
+        }
+
+    def _workflow_request(self, index: int, rng: random.Random) -> Row:
+        return {
+            "wfRequestId": ID_BASE + index,
+            "requestType": rng.choice(REQUEST_TYPES),
+            "priority": rng.choice(PRIORITIES),
+            "status": "PENDING",
+            "currentStepNum": 1,
+            "totalSteps": STEPS_PER_WORKFLOW,
+            "createdBy": user_id(index * EMPLOYEES_PER_WORKFLOW),
+        }
+
+    def _workflow_participator(self, index: int, rng: random.Random) -> Row:
+        request, step = divmod(index, STEPS_PER_WORKFLOW)
+        # Every request starts at its first step, held by the submitter's manager
+        submitter = request * EMPLOYEES_PER_WORKFLOW
+        approver = submitter // EMPLOYEES_PER_MANAGER if step == 0 else rng.randrange(self.scale)
+        return {
+            "wfRequestParticipatorId": ID_BASE + index,
+            "wfRequestId": ID_BASE + request,
+            "ownerId": user_id(approver),
+            "participatorType": "APPROVER",
+            "actorType": "USER",
+            "processingOrder": step + 1,
+            "status": "PENDING" if step == 0 else "WAITING",
+        }
+
+    def _background(self, entity: str) -> Callable[[int, random.Random], Row]:
+        template = self.templates[entity][0]
+
+        def generate(index: int, rng: random.Random) -> Row:
+            row = _vary(template, rng)
+            row["backgroundElementId"] = 1
+            row["userId"] = user_id(index)
+            return row
+        return generate
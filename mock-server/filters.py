@@ -0,0 +1,371 @@
+"""
+OData v2 `$filter` expressions for the mock server.
+
+An expression is parsed once into a tree of nodes and cached by its text.
+Each node evaluates against a row, and comparison nodes on plain properties
+can also answer straight from an entity table's field indexes, so selective
+filters only look at the rows they could match.
+"""
+
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from odata import QueryOptionError, comparable, parse_datetime
+from records import Record
+from store import EntityTable
+
+Row = Mapping[str, Any]
+Hits = List[Tuple[int, Row]]
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<typed>(?:datetimeoffset|datetime|guid|time)'(?:[^']|'')*')
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?[LlMmDdFf]?)
+      | (?P<name>[A-Za-z_][\w.]*(?:/[A-Za-z_][\w.]*)*)
+      | (?P<punct>[(),])
+    )""", re.VERBOSE)
+
+_COMPARISONS = {"eq", "ne", "gt", "ge", "lt", "le"}
+_FLIPPED = {"eq": "eq", "ne": "ne", "gt": "lt", "ge": "le", "lt": "gt", "le": "ge"}
+
+
+def _tokenize(expression: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match or match.end() == position:
+            raise QueryOptionError(f"Invalid $filter near: {expression[position:].strip()}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def _literal(kind: str, text: str) -> Any:
+    if kind == "string":
+        return text[1:-1].replace("''", "'")
+    if kind == "number":
+        if text[-1] in "LlMmDdFf":
+            text = text[:-1]
+        return float(text) if any(c in text for c in ".eE") else int(text)
+    prefix, _, quoted = text.partition("'")
+    raw = quoted[:-1].replace("''", "'")
+    if prefix in ("datetime", "datetimeoffset"):
+        value = parse_datetime(raw)
+        if value is None:
+            raise QueryOptionError(f"Invalid {prefix} literal: {raw}")
+        return value
+    return raw
+
+
+# Expression nodes
+
+class Node(ABC):
+    @abstractmethod
+    def evaluate(self, row: Row) -> Any:
+        """Value of this node for a row."""
+
+    def candidates(self, table: EntityTable) -> Optional[Hits]:
+        """Rows that may satisfy this node, from indexes, or None if a scan is needed."""
+        return None
+
+
+class Literal(Node):
+    def __init__(self, value: Any):
+        self.value = value
+
+    def evaluate(self, row: Row) -> Any:
+        return self.value
+
+
+class Property(Node):
+    def __init__(self, path: str):
+        self.path = path
+        self.parts = path.split("/")
+
+    def evaluate(self, row: Row) -> Any:
+        value: Any = row
+        for part in self.parts:
+            if not isinstance(value, (dict, Record)):
+                return None
+            value = value.get(part)
+        return value
+
+    @property
+    def indexable(self) -> bool:
+        return len(self.parts) == 1
+
+
+def _compare(op: str, left: Any, right: Any) -> bool:
+    if left is None or right is None:
+        if op == "eq":
+            return left is None and right is None
+        if op == "ne":
+            return not (left is None and right is None)
+        return False
+    left_key, right_key = comparable(left), comparable(right)
+    if left_key[0] != right_key[0]:
+        return op == "ne"
+    if op == "eq":
+        return left_key == right_key
+    if op == "ne":
+        return left_key != right_key
+    if op == "gt":
+        return left_key > right_key
+    if op == "ge":
+        return left_key >= right_key
+    if op == "lt":
+        return left_key < right_key
+    return left_key <= right_key
+
+
+class Comparison(Node):
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def evaluate(self, row: Row) -> Any:
+        return _compare(self.op, self.left.evaluate(row), self.right.evaluate(row))
+
+    def candidates(self, table: EntityTable) -> Optional[Hits]:
+        op, prop, literal = self.op, self.left, self.right
+        if isinstance(prop, Literal):
+            op, prop, literal = _FLIPPED[op], self.right, self.left
+        if not (isinstance(prop, Property) and prop.indexable and isinstance(literal, Literal)):
+            return None
+        if literal.value is None or op == "ne":
+            return None
+        index = table.field_index(prop.path)
+        key = comparable(literal.value)
+        if op == "eq":
+            return index.range(key, key)
+        if op in ("gt", "ge"):
+            return index.range(low=key, low_inclusive=op == "ge")
+        return index.range(high=key, high_inclusive=op == "le")
+
+
+class And(Node):
+    def __init__(self, left: Node, right: Node):
+        self.left = left
+        self.right = right
+
+    def evaluate(self, row: Row) -> Any:
+        return bool(self.left.evaluate(row)) and bool(self.right.evaluate(row))
+
+    def candidates(self, table: EntityTable) -> Optional[Hits]:
+        found = [hits for hits in (self.left.candidates(table), self.right.candidates(table)) if hits is not None]
+        return min(found, key=len) if found else None
+
+
+class Or(Node):
+    def __init__(self, left: Node, right: Node):
+        self.left = left
+        self.right = right
+
+    def evaluate(self, row: Row) -> Any:
+        return bool(self.left.evaluate(row)) or bool(self.right.evaluate(row))
+
+    def candidates(self, table: EntityTable) -> Optional[Hits]:
+        left = self.left.candidates(table)
+        if left is None:
+            return None
+        right = self.right.candidates(table)
+        if right is None:
+            return None
+        merged = {seq: row for seq, row in left}
+        merged.update(right)
+        return list(merged.items())
+
+
+class Not(Node):
+    def __init__(self, operand: Node):
+        self.operand = operand
+
+    def evaluate(self, row: Row) -> Any:
+        return not self.operand.evaluate(row)
+
+
+def _text(value: Any) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+def _startswith(text: Any, prefix: Any) -> bool:
+    text, prefix = _text(text), _text(prefix)
+    return text is not None and prefix is not None and text.startswith(prefix)
+
+
+def _endswith(text: Any, suffix: Any) -> bool:
+    text, suffix = _text(text), _text(suffix)
+    return text is not None and suffix is not None and text.endswith(suffix)
+
+
+def _substringof(needle: Any, haystack: Any) -> bool:
+    needle, haystack = _text(needle), _text(haystack)
+    return needle is not None and haystack is not None and needle in haystack
+
+
+def _date_part(part: str) -> Callable[[Any], Optional[int]]:
+    def extract(value: Any) -> Optional[int]:
+        if isinstance(value, str):
+            value = parse_datetime(value)
+        return getattr(value, part) if isinstance(value, datetime) else None
+    return extract
+
+
+_FUNCTIONS: Dict[str, Tuple[int, Callable[..., Any]]] = {
+    "startswith": (2, _startswith),
+    "endswith": (2, _endswith),
+    "substringof": (2, _substringof),
+    "tolower": (1, lambda s: s.lower() if isinstance(s, str) else None),
+    "toupper": (1, lambda s: s.upper() if isinstance(s, str) else None),
+    "trim": (1, lambda s: s.strip() if isinstance(s, str) else None),
+    "length": (1, lambda s: len(s) if isinstance(s, str) else None),
+    "indexof": (2, lambda s, t: s.find(t) if isinstance(s, str) and isinstance(t, str) else None),
+    "concat": (2, lambda s, t: s + t if isinstance(s, str) and isinstance(t, str) else None),
+    "year": (1, _date_part("year")),
+    "month": (1, _date_part("month")),
+    "day": (1, _date_part("day")),
+}
+
+
+class Call(Node):
+    def __init__(self, name: str, args: List[Node]):
+        self.name = name
+        self.args = args
+        self.function = _FUNCTIONS[name][1]
+
+    def evaluate(self, row: Row) -> Any:
+        return self.function(*(arg.evaluate(row) for arg in self.args))
+
+    def candidates(self, table: EntityTable) -> Optional[Hits]:
+        if self.name != "startswith":
+            return None
+        prop, prefix = self.args
+        if not (isinstance(prop, Property) and prop.indexable and isinstance(prefix, Literal)):
+            return None
+        value = prefix.value
+        # Date-like strings sort among dates, so only prefixes that cannot start one are indexed
+        if not isinstance(value, str) or not value or value[0].isdigit() or value[0] == "/":
+            return None
+        return table.field_index(prop.path).range(
+            low=comparable(value), high=(4, value + "\U0010ffff"), high_inclusive=False)
+
+
+# Parser
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def _peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _peek_word(self) -> Optional[str]:
+        token = self._peek()
+        return token[1] if token and token[0] == "name" else None
+
+    def _next(self) -> Tuple[str, str]:
+        token = self._peek()
+        if token is None:
+            raise QueryOptionError(f"Unexpected end of $filter: {self.expression}")
+        self.position += 1
+        return token
+
+    def _expect(self, punct: str) -> None:
+        kind, text = self._next()
+        if kind != "punct" or text != punct:
+            raise QueryOptionError(f"Expected '{punct}' in $filter near: {text}")
+
+    def parse(self) -> Node:
+        node = self._or()
+        if self._peek() is not None:
+            raise QueryOptionError(f"Unexpected token in $filter: {self._peek()[1]}")
+        return node
+
+    def _or(self) -> Node:
+        node = self._and()
+        while self._peek_word() == "or":
+            self.position += 1
+            node = Or(node, self._and())
+        return node
+
+    def _and(self) -> Node:
+        node = self._not()
+        while self._peek_word() == "and":
+            self.position += 1
+            node = And(node, self._not())
+        return node
+
+    def _not(self) -> Node:
+        if self._peek_word() == "not":
+            self.position += 1
+            return Not(self._not())
+        return self._comparison()
+
+    def _comparison(self) -> Node:
+        node = self._primary()
+        op = self._peek_word()
+        if op in _COMPARISONS:
+            self.position += 1
+            node = Comparison(op, node, self._primary())
+        return node
+
+    def _primary(self) -> Node:
+        kind, text = self._next()
+        if kind == "punct":
+            if text != "(":
+                raise QueryOptionError(f"Unexpected '{text}' in $filter")
+            node = self._or()
+            self._expect(")")
+            return node
+        if kind != "name":
+            return Literal(_literal(kind, text))
+        if text in ("true", "false"):
+            return Literal(text == "true")
+        if text == "null":
+            return Literal(None)
+        token = self._peek()
+        if token == ("punct", "("):
+            return self._call(text)
+        return Property(text)
+
+    def _call(self, name: str) -> Node:
+        if name not in _FUNCTIONS:
+            raise QueryOptionError(f"Unsupported $filter function: {name}")
+        self._expect("(")
+        args = [self._or()]
+        while self._peek() == ("punct", ","):
+            self.position += 1
+            args.append(self._or())
+        self._expect(")")
+        if len(args) != _FUNCTIONS[name][0]:
+            raise QueryOptionError(f"Wrong number of arguments to {name} in $filter")
+        return Call(name, args)
+
+
+@lru_cache(maxsize=512)
+def compile_filter(expression: str) -> Node:
+    """Parse a `$filter` expression, reusing the tree for repeated expressions."""
+    return _Parser(expression).parse()
+
+
+def apply_filter(table: EntityTable, expression: str, rows: Optional[Sequence[Row]] = None) -> List[Row]:
+    """Rows of the table matching the expression, in table order.
+
+    Given `rows` already narrowed down some other way, only those are
+    evaluated instead of the rows the indexes point to.
+    """
+    node = compile_filter(expression)
+    if rows is None:
+        hits = node.candidates(table)
+        rows = table.rows if hits is None else table.in_table_order(hits)
+    return [row for row in rows if node.evaluate(row)]
@@ -0,0 +1,124 @@
+"""
+Request metrics for the mock server, exposed in the Prometheus text format.
+
+Every response is counted and timed per method, route template and entity,
+with latency and payload sizes kept as cumulative histograms. Gauges, such as
+the number of rows in each entity table, are collected when the metrics are
+scraped.
+"""
+
+import time
+from bisect import bisect_left
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the payload size buckets, in bytes
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # One count per bucket plus one for values above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Registry of the server's request counters, histograms and scrape-time gauges."""
+
+    def __init__(self) -> None:
+        self.requests: Dict[Labels, int] = {}
+        self.durations: Dict[Labels, Histogram] = {}
+        self.request_sizes: Dict[Labels, Histogram] = {}
+        self.response_sizes: Dict[Labels, Histogram] = {}
+        self._gauges: List[Tuple[str, str, Callable[[], Dict[Labels, float]]]] = []
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Dict[Labels, float]]) -> None:
+        """Register a gauge whose values are collected on every scrape."""
+        self._gauges.append((name, help_text, collect))
+
+    def observe(self, method: str, route: str, entity: str, status: int, seconds: float,
+                request_bytes: Optional[int], response_bytes: int) -> None:
+        """Record one completed request."""
+        labels = (("method", method), ("route", route), ("entity", entity))
+        counted = labels + (("status", str(status)),)
+        self.requests[counted] = self.requests.get(counted, 0) + 1
+        _histogram(self.durations, labels, LATENCY_BUCKETS).observe(seconds)
+        _histogram(self.response_sizes, labels, SIZE_BUCKETS).observe(response_bytes)
+        if request_bytes is not None:
+            _histogram(self.request_sizes, labels, SIZE_BUCKETS).observe(request_bytes)
+
+    async def measure(self, body: AsyncIterator[bytes], method: str, route: str, entity: str, status: int,
+                      started: float, request_bytes: Optional[int]) -> AsyncIterator[bytes]:
+        """Pass a response body through, recording the request once the body has been sent."""
+        size = 0
+        try:
+            async for chunk in body:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.observe(method, route, entity, status, time.perf_counter() - started, request_bytes, size)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        _family(lines, "mock_http_requests_total", "counter", "Requests served, by route, entity and status")
+        for labels, value in self.requests.items():
+            lines.append(f"mock_http_requests_total{_format(labels)} {value}")
+        for name, help_text, histograms in (
+            ("mock_http_request_duration_seconds", "Time from receiving a request to sending the last byte of its response", self.durations),
+            ("mock_http_request_size_bytes", "Request body sizes, from Content-Length", self.request_sizes),
+            ("mock_http_response_size_bytes", "Response body sizes", self.response_sizes),
+        ):
+            _family(lines, name, "histogram", help_text)
+            for labels, histogram in histograms.items():
+                cumulative = 0
+                for bound, count in zip((*histogram.bounds, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format(labels)} {histogram.count}")
+        for name, help_text, collect in self._gauges:
+            _family(lines, name, "gauge", help_text)
+            for labels, value in collect().items():
+                lines.append(f"{name}{_format(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _histogram(histograms: Dict[Labels, Histogram], labels: Labels, bounds: Sequence[float]) -> Histogram:
+    histogram = histograms.get(labels)
+    if histogram is None:
+        histogram = histograms[labels] = Histogram(bounds)
+    return histogram
+
+
+def _family(lines: List[str], name: str, kind: str, help_text: str) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
@@ -0,0 +1,114 @@
+"""
+Navigation properties and `$expand` for the mock server.
+
+A navigation property links rows of one entity to rows of another through
+properties they share, such as `userId`. `$expand` lists navigation paths,
+`jobInfoNav,empWorkPermitNav/employmentNav`, whose targets are embedded in
+the response the way OData v2 does it: a to-one navigation as the related
+entity (or null), a to-many navigation as `{"results": [...]}`.
+
+Expansion is a hash join done one level at a time: the foreign key values of
+all rows at a level are collected, each distinct value is looked up once in
+the target table's index on the joined properties, and the rows found become
+the next level for nested paths.
+"""
+
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from odata import QueryOptionError
+from records import Record, as_dict
+from store import EntityStore, KeyTuple, row_key
+
+# Navigation paths to expand, nested by path segment
+ExpandTree = Dict[str, "ExpandTree"]
+
+# Expanded navigation properties per source row, by its sequence number
+Expansions = Dict[int, Dict[str, Any]]
+
+# Deepest navigation path followed, guarding against runaway self-joins
+MAX_EXPAND_DEPTH = 5
+
+
+class Navigation:
+    """Navigation property leading to the `target` rows whose `target_fields` equal the source's `fields`."""
+
+    def __init__(self, target: str, fields: Sequence[str], target_fields: Optional[Sequence[str]] = None,
+                 many: bool = False):
+        self.target = target
+        self.fields: Tuple[str, ...] = tuple(fields)
+        self.target_fields: Tuple[str, ...] = tuple(target_fields or fields)
+        self.many = many
+
+
+def parse_expand(raw: Optional[str]) -> ExpandTree:
+    """Parse a `$expand` value into a tree of navigation paths."""
+    tree: ExpandTree = {}
+    for path in (raw or "").split(","):
+        path = path.strip()
+        if not path:
+            continue
+        segments = [segment.strip() for segment in path.split("/")]
+        if len(segments) > MAX_EXPAND_DEPTH or not all(segments):
+            raise QueryOptionError(f"Invalid $expand path: {path}")
+        level = tree
+        for segment in segments:
+            level = level.setdefault(segment, {})
+    return tree
+
+
+class Expander:
+    """Resolves `$expand` trees against the store, given the navigation properties of each entity."""
+
+    def __init__(self, store: EntityStore, navigations: Mapping[str, Mapping[str, Navigation]]):
+        self.store = store
+        self.navigations = navigations
+
+    def _resolve(self, entity: str, tree: ExpandTree) -> Iterator[Tuple[str, Navigation, ExpandTree]]:
+        """Declared navigation properties named in a tree level; `*` names all of them.
+
+        Names that are not declared for the entity are skipped, so clients
+        asking for navigations the mock does not model still get their rows.
+        """
+        declared = self.navigations.get(entity, {})
+        names = declared if "*" in tree else tree
+        for name in names:
+            navigation = declared.get(name)
+            if navigation is not None:
+                yield name, navigation, tree.get(name, {})
+
+    def entities(self, entity: str, tree: ExpandTree) -> List[str]:
+        """Entities whose rows an expansion reads, for versioning its responses."""
+        found: List[str] = []
+        for _, navigation, subtree in self._resolve(entity, tree):
+            for target in (navigation.target, *self.entities(navigation.target, subtree)):
+                if target not in found:
+                    found.append(target)
+        return found
+
+    def expand(self, entity: str, rows: Sequence[Record], tree: ExpandTree) -> Expansions:
+        """Expanded navigation properties of each of the rows."""
+        expansions: Expansions = {row.seq: {} for row in rows}
+        for name, navigation, subtree in self._resolve(entity, tree):
+            table = self.store.table(navigation.target)
+            # Build side: one lookup per distinct foreign key value on this level
+            matches: Dict[KeyTuple, List[Record]] = {}
+            for row in rows:
+                key = row_key(row, navigation.fields)
+                if key is not None and key not in matches:
+                    matches[key] = table.related(navigation.target_fields, key)
+            related = list({row.seq: row for hits in matches.values() for row in hits}.values())
+            nested = self.expand(navigation.target, related, subtree) if subtree else {}
+            rendered: Dict[int, Dict[str, Any]] = {}
+            for row in related:
+                rendered[row.seq] = as_dict(row)
+                rendered[row.seq].update(nested.get(row.seq, ()))
+            # Probe side: every row picks up the rendered rows its key matched
+            for row in rows:
+                key = row_key(row, navigation.fields)
+                hits = matches.get(key, []) if key is not None else []
+                if navigation.many:
+                    value: Any = {"results": [rendered[hit.seq] for hit in hits]}
+                else:
+                    value = rendered[hits[0].seq] if hits else None
+                expansions[row.seq][name] = value
+        return expansions
@@ -0,0 +1,434 @@
+"""
+OData v2 system query option handling for the mock server.
+"""
+
+import heapq
+import re
+from collections.abc import Sequence as SequenceABC
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from records import as_dict
+
+
+class QueryOptionError(ValueError):
+    """Raised when a system query option cannot be interpreted."""
+
+
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:Z|[+-]\d{2}:?\d{2})?$")
+_JSON_DATE = re.compile(r"^/Date\((-?\d+)(?:[+-]\d{4})?\)/$")
+
+
+def parse_datetime(raw: str) -> Optional[datetime]:
+    """Parse an ISO 8601 or `/Date(ms)/` string into a naive UTC datetime."""
+    match = _JSON_DATE.match(raw)
+    if match:
+        return datetime.fromtimestamp(int(match.group(1)) / 1000, tz=timezone.utc).replace(tzinfo=None)
+    if not _ISO_DATE.match(raw):
+        return None
+    try:
+        value = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def effective_date(value: Any) -> Optional[str]:
+    """The ISO date (`YYYY-MM-DD`) a date or datetime value falls on, None if it is not one."""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if not isinstance(value, str):
+        return None
+    if len(value) == 10 and _ISO_DATE.match(value):
+        return value
+    parsed = parse_datetime(value)
+    return None if parsed is None else parsed.date().isoformat()
+
+
+def comparable(value: Any) -> Tuple[int, Any]:
+    """Map a property value to a totally ordered sort key.
+
+    Values of different kinds never compare equal: numbers order before dates,
+    dates (including date-like strings) before other strings. Booleans, nulls
+    and structured values get ranks of their own.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value)
+    if isinstance(value, str):
+        parsed = parse_datetime(value)
+        return (3, parsed) if parsed is not None else (4, value)
+    return (5, repr(value))
+
+
+def edm_type(value: Any) -> Optional[str]:
+    """EDM type name of a property value, or None for nulls."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "Edm.Boolean"
+    if isinstance(value, int):
+        return "Edm.Int64"
+    if isinstance(value, float):
+        return "Edm.Double"
+    if isinstance(value, (datetime, str)) and comparable(value)[0] == 3:
+        return "Edm.DateTime"
+    if isinstance(value, str):
+        return "Edm.String"
+    return "Edm.ComplexType"
+
+
+# One `name=value` or bare value of a key predicate, followed by a comma or the end
+_KEY_PART = re.compile(r"""
+    \s*(?:(?P<name>[A-Za-z_][\w.]*)\s*=\s*)?
+    (?:
+        (?P<type>datetime|datetimeoffset|time|guid|binary|X)'(?P<typed>(?:[^']|'')*)'
+      | '(?P<string>(?:[^']|'')*)'
+      | (?P<number>[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)(?P<suffix>[LlMmDdFf]?)(?=\s*(?:,|$))
+      | (?P<keyword>true|false|null)(?=\s*(?:,|$))
+      | (?P<bare>[^,']+?)
+    )
+    \s*(?P<end>,|$)
+""", re.X)
+
+_KEYWORDS = {"true": True, "false": False, "null": None}
+
+
+class KeyPredicate:
+    """Parsed key predicate of a resource path, such as `seqNumber=1,startDate=datetime'2020-01-01T00:00:00',userId='EMP001'`.
+
+    `parts` holds (name, value) pairs, with None for the names of positional
+    values. Literals are typed: quoted strings, `datetime'...'` and the other
+    prefixed forms, numbers with or without their `L`/`M`/`D`/`F` suffix,
+    `true`, `false` and `null`. Unquoted values that are none of these, such
+    as dates the clients send as `startDate=2020-01-01`, are taken as strings.
+    `alternatives` holds, per part, the key strings the value may be stored
+    as: a date or datetime matches its date-only and full ISO forms.
+    """
+
+    def __init__(self, parts: Sequence[Tuple[Optional[str], Any]]):
+        self.parts: Tuple[Tuple[Optional[str], Any], ...] = tuple(parts)
+        self.names: Tuple[Optional[str], ...] = tuple(name for name, _ in self.parts)
+        self.alternatives: Tuple[Tuple[str, ...], ...] = tuple(_key_forms(value) for _, value in self.parts)
+
+    @property
+    def named(self) -> bool:
+        return all(name is not None for name in self.names)
+
+    def bind(self, key_fields: Sequence[str]) -> Optional[Dict[str, Any]]:
+        """Values by property name; positional values take the key properties in order."""
+        if self.named:
+            return dict(self.parts)
+        if any(name is not None for name in self.names) or len(self.parts) != len(key_fields):
+            return None
+        return {field: value for field, (_, value) in zip(key_fields, self.parts)}
+
+
+def _key_forms(value: Any) -> Tuple[str, ...]:
+    text = value if isinstance(value, str) else str(value)
+    parsed = parse_datetime(text) if isinstance(value, str) else None
+    if parsed is None:
+        return (text,)
+    forms = [text, parsed.isoformat(timespec="seconds")]
+    if parsed.time() == datetime.min.time():
+        forms.append(parsed.date().isoformat())
+    return tuple(dict.fromkeys(forms))
+
+
+def _key_literal(match: "re.Match[str]") -> Any:
+    if match.group("type") is not None:
+        return match.group("typed").replace("''", "'")
+    if match.group("string") is not None:
+        return match.group("string").replace("''", "'")
+    if match.group("number") is not None:
+        number = match.group("number")
+        if match.group("suffix").upper() in ("M", "D", "F") or not number.lstrip("+-").isdigit():
+            return float(number)
+        return int(number)
+    if match.group("keyword") is not None:
+        return _KEYWORDS[match.group("keyword")]
+    return match.group("bare").strip()
+
+
+@lru_cache(maxsize=4096)
+def parse_key_predicate(text: str) -> KeyPredicate:
+    """Parse the text between the parentheses of a resource path, reusing the result for repeated predicates."""
+    parts = []
+    position = 0
+    while True:
+        match = _KEY_PART.match(text, position)
+        if match is None:
+            raise QueryOptionError(f"Invalid key predicate: ({text})")
+        parts.append((match.group("name"), _key_literal(match)))
+        position = match.end()
+        if match.group("end") != ",":
+            break
+    if position != len(text):
+        raise QueryOptionError(f"Invalid key predicate: ({text})")
+    return KeyPredicate(parts)
+
+
+def _non_negative_int(params: Mapping[str, str], name: str) -> Optional[int]:
+    raw = params.get(name)
+    if raw is None or raw == "":
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        raise QueryOptionError(f"Invalid {name} value: {raw}")
+    if value < 0:
+        raise QueryOptionError(f"Invalid {name} value: {raw}")
+    return value
+
+
+class Paging:
+    """Paging window requested through $top, $skip, $skiptoken and $inlinecount/$count."""
+
+    def __init__(self, top: Optional[int] = None, skip: int = 0, skiptoken: Optional[int] = None,
+                 count: bool = False):
+        self.top = top
+        self.skip = skip
+        self.skiptoken = skiptoken
+        self.count = count
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str]) -> "Paging":
+        count = (params.get("$inlinecount", "").lower() == "allpages"
+                 or params.get("$count", "").lower() == "true")
+        return cls(
+            top=_non_negative_int(params, "$top"),
+            skip=_non_negative_int(params, "$skip") or 0,
+            skiptoken=_non_negative_int(params, "$skiptoken"),
+            count=count,
+        )
+
+    def window(self, total: int, page_size: int) -> Tuple[int, int, Optional[int]]:
+        """Return (start, end, next_offset) of the page to serve out of `total` rows.
+
+        `$top`/`$skip` bound the window the client asked for; the server never
+        returns more than `page_size` rows at once and hands out the offset of
+        the next row as a skip token while the window is not exhausted.
+        """
+        window_end = total if self.top is None else min(total, self.skip + self.top)
+        start = self.skip if self.skiptoken is None else max(self.skip, self.skiptoken)
+        start = min(start, window_end)
+        end = min(window_end, start + page_size)
+        return start, end, end if end < window_end else None
+
+
+class DeltaToken:
+    """Point in an entity's change history, handed out and read back through `!deltatoken`.
+
+    The token names the store epoch as well as the table version, so tokens
+    issued before a restart or by a different store are recognised as stale.
+    """
+
+    PARAM = "!deltatoken"
+
+    def __init__(self, epoch: str, version: int):
+        self.epoch = epoch
+        self.version = version
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str]) -> Optional["DeltaToken"]:
+        raw = params.get(cls.PARAM)
+        if raw is None:
+            return None
+        # SAP Gateway quotes the token in delta links it issues, accept it either way
+        epoch, _, version = raw.strip("'").rpartition(".")
+        if not epoch or not version.isdigit():
+            raise QueryOptionError(f"Invalid {cls.PARAM} value: {raw}")
+        return cls(epoch, int(version))
+
+    def __str__(self) -> str:
+        return f"{self.epoch}.{self.version}"
+
+
+class EffectiveDates:
+    """Time window requested through `asOfDate`, or `fromDate` and `toDate`, as inclusive ISO dates.
+
+    `asOfDate` asks for the records in effect on one day. `fromDate` and
+    `toDate` ask for every record in effect at some point between them; the
+    one left out defaults to the beginning or the end of time.
+    """
+
+    FIRST = "0001-01-01"
+    LAST = "9999-12-31"
+
+    def __init__(self, low: str, high: str):
+        self.low = low
+        self.high = high
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str]) -> Optional["EffectiveDates"]:
+        as_of, low, high = (_date_option(params, name) for name in ("asOfDate", "fromDate", "toDate"))
+        if as_of is not None:
+            if low is not None or high is not None:
+                raise QueryOptionError("asOfDate cannot be combined with fromDate or toDate")
+            return cls(as_of, as_of)
+        if low is None and high is None:
+            return None
+        window = cls(low or cls.FIRST, high or cls.LAST)
+        if window.low > window.high:
+            raise QueryOptionError(f"fromDate {window.low} is after toDate {window.high}")
+        return window
+
+
+def _date_option(params: Mapping[str, str], name: str) -> Optional[str]:
+    raw = params.get(name)
+    if raw is None:
+        return None
+    # Accept the date bare, quoted, or as a datetime literal
+    text = raw[len("datetime"):] if raw.startswith("datetime'") else raw
+    parsed = parse_datetime(text.strip("'"))
+    if parsed is None:
+        raise QueryOptionError(f"Invalid {name} value: {raw}")
+    return parsed.date().isoformat()
+
+
+def _list_option(params: Mapping[str, str], name: str) -> List[str]:
+    raw = params.get(name) or ""
+    return [item.strip() for item in raw.split(",") if item.strip()]
+
+
+_WORD = re.compile(r"\w+")
+_SEARCH_ITEM = re.compile(r'"(?P<phrase>[^"]*)"?|(?P<word>[^\s"]+)')
+
+
+@lru_cache(maxsize=65536)
+def search_words(text: str) -> Tuple[str, ...]:
+    """Lower-cased words of a text, the units `$search` matches on."""
+    return tuple(_WORD.findall(text.lower()))
+
+
+class SearchTerm:
+    """One `$search` term: words that must appear in this order within one property.
+
+    A `prefix` term matches any word starting with its last word.
+    """
+
+    def __init__(self, words: Sequence[str], prefix: bool = False, negated: bool = False):
+        self.words: Tuple[str, ...] = tuple(words)
+        self.prefix = prefix
+        self.negated = negated
+
+
+class SearchQuery:
+    """Terms requested through $search, as alternatives (OR) of terms that must all match (AND).
+
+    Terms are words, quoted phrases and `word*` prefixes. Terms next to each
+    other must all match, `OR` separates alternatives and `NOT` excludes the
+    term after it. Matching ignores case and punctuation, so a term such as
+    `O'Brien` is the phrase of the words `o` and `brien`.
+    """
+
+    def __init__(self, clauses: Sequence[Sequence[SearchTerm]]):
+        self.clauses: Tuple[Tuple[SearchTerm, ...], ...] = tuple(tuple(clause) for clause in clauses)
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str]) -> Optional["SearchQuery"]:
+        raw = params.get("$search", "").strip()
+        if not raw:
+            return None
+        clauses: List[List[SearchTerm]] = [[]]
+        negated = False
+        # Whether the last item was an operator, still waiting for its right-hand term
+        operator = False
+        for match in _SEARCH_ITEM.finditer(raw):
+            text = match.group("phrase") if match.group("phrase") is not None else match.group("word")
+            if match.group("word") in ("AND", "OR", "NOT"):
+                if negated or (text != "NOT" and (operator or not clauses[-1])):
+                    raise QueryOptionError(f"Invalid $search expression: {raw}")
+                if text == "OR":
+                    clauses.append([])
+                negated = text == "NOT"
+                operator = True
+                continue
+            words = search_words(text)
+            if words:
+                prefix = match.group("word") is not None and text.endswith("*")
+                clauses[-1].append(SearchTerm(words, prefix, negated))
+                negated = operator = False
+        if operator or not clauses[-1]:
+            raise QueryOptionError(f"Invalid $search expression: {raw}")
+        return cls(clauses)
+
+
+class Selection:
+    """Properties requested through $select; None selects every property."""
+
+    def __init__(self, fields: Optional[Sequence[str]] = None):
+        self.fields = tuple(dict.fromkeys(fields)) if fields is not None else None
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str]) -> "Selection":
+        items = _list_option(params, "$select")
+        if not items or "*" in items:
+            return cls()
+        # Navigation paths select their top-level property
+        return cls([item.split("/", 1)[0] for item in items])
+
+    def project(self, row: Mapping[str, Any]) -> Dict[str, Any]:
+        """Copy only the selected properties of a row; unselected ones are never touched."""
+        if self.fields is None:
+            return as_dict(row)
+        return {field: row[field] for field in self.fields if field in row}
+
+
+class _Descending:
+    """Sort key wrapper that reverses the order of the wrapped key."""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: Tuple[int, Any]):
+        self.key = key
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, _Descending) and self.key == other.key
+
+
+class OrderBy:
+    """Sort order requested through $orderby as (property, descending) pairs."""
+
+    def __init__(self, terms: Sequence[Tuple[str, bool]] = ()):
+        self.terms = tuple(terms)
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str]) -> "OrderBy":
+        terms = []
+        for item in _list_option(params, "$orderby"):
+            parts = item.split()
+            if len(parts) > 2 or (len(parts) == 2 and parts[1].lower() not in ("asc", "desc")):
+                raise QueryOptionError(f"Invalid $orderby value: {item}")
+            terms.append((parts[0], len(parts) == 2 and parts[1].lower() == "desc"))
+        return cls(terms)
+
+    def _key(self, row: Mapping[str, Any]) -> Tuple[Any, ...]:
+        return tuple(
+            _Descending(comparable(row.get(field))) if descending else comparable(row.get(field))
+            for field, descending in self.terms
+        )
+
+    def sort(self, rows: Iterable[Dict[str, Any]], limit: Optional[int] = None) -> Sequence[Dict[str, Any]]:
+        """Return rows in the requested order, keeping at least the first `limit` when given.
+
+        With a limit the rows go through a bounded heap instead of a full sort.
+        Ties keep their original order either way; without any terms the rows
+        are returned as they are.
+        """
+        if not self.terms:
+            return rows if isinstance(rows, SequenceABC) else list(rows)
+        if limit is None:
+            return sorted(rows, key=self._key)
+        return heapq.nsmallest(limit, rows, key=self._key)
@@ -0,0 +1,128 @@
+"""
+In-process sampling profiler for the mock server.
+
+While running, a background thread takes the Python stack of every other
+thread at a fixed interval. Each stack is tagged with the endpoint of the
+request it is serving, found from the ASGI `scope` of the innermost frame
+that has one, and counted. Threads waiting for work (the event loop in
+`select`, idle thread pool workers) are left out. The result is written as
+collapsed stacks, `endpoint;outer frame;...;inner frame count`, which
+flamegraph.pl, speedscope and similar tools read directly.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+from typing import Optional, Tuple
+
+# Innermost frames of a thread that is waiting for work rather than doing any
+_IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get")}
+
+# Tag of stacks not serving a routed request, such as middleware before routing
+UNROUTED = "(unrouted)"
+
+Stack = Tuple[str, ...]
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _endpoint(frame: FrameType) -> Optional[str]:
+    """Name of the endpoint whose ASGI scope is a local of the frame, if any."""
+    if "scope" not in frame.f_code.co_varnames:
+        return None
+    scope = frame.f_locals.get("scope")
+    endpoint = scope.get("endpoint") if isinstance(scope, dict) else None
+    return getattr(endpoint, "__name__", None)
+
+
+def sample_stack(frame: FrameType) -> Optional[Stack]:
+    """A thread's stack, outermost frame first and tagged with its endpoint, or None if it is idle."""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+        return None
+    names = []
+    tag = None
+    current: Optional[FrameType] = frame
+    while current is not None:
+        names.append(_frame_name(current))
+        if tag is None:
+            tag = _endpoint(current)
+        current = current.f_back
+    names.append(tag or UNROUTED)
+    names.reverse()
+    return tuple(names)
+
+
+class SamplingProfiler:
+    """Samples every thread's stack until stopped, or until a number of requests have been served."""
+
+    def __init__(self) -> None:
+        self.samples: Counter = Counter()
+        self.interval = 0.005
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._remaining: Optional[int] = None
+        self._done: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float, requests: Optional[int] = None) -> None:
+        """Start sampling every `interval` seconds, until stopped or `requests` requests have been served."""
+        if self.running:
+            raise RuntimeError("The profiler is already running")
+        self.samples = Counter()
+        self.interval = interval
+        self._remaining = requests
+        self._done = asyncio.Event()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = sample_stack(frame)
+                if stack is not None:
+                    self.samples[stack] += 1
+
+    def request_served(self) -> None:
+        """Count a served request towards the number the profiler is running for."""
+        if self._remaining is None or self._done is None:
+            return
+        self._remaining -= 1
+        if self._remaining <= 0:
+            self._done.set()
+
+    async def wait(self, timeout: Optional[float]) -> None:
+        """Wait until the requests have been served, or at most `timeout` seconds."""
+        assert self._done is not None
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop(self) -> Counter:
+        """Stop sampling and return the sample counts per stack."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        self._remaining = None
+        self._done = None
+        return self.samples
+
+
+def collapse(samples: Counter) -> str:
+    """Sample counts in the collapsed stack format, heaviest stacks first."""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in samples.most_common())
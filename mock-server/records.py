@@ -0,0 +1,145 @@
+"""
+Compact row storage for the mock server's entity tables.
+
+The rows of an entity share one `RowLayout`, the list of property names seen
+in that entity so far, and each `Record` holds just a tuple of its values in
+layout order. Property names are therefore stored once per entity instead of
+once per row. Short string values, such as ids, statuses and dates, are
+interned, so a value repeated across rows and across entities, like a
+`userId`, is held once. Plain dicts are only produced again when a row is
+serialised.
+"""
+
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+Row = Dict[str, Any]
+
+
+class _Absent:
+    """Marks a layout property the row does not have."""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "<absent>"
+
+
+_ABSENT = _Absent()
+
+# Strings up to this length are interned: codes, ids, dates and statuses, but not free text
+INTERN_MAX_LENGTH = 32
+
+
+def intern_value(value: Any) -> Any:
+    """The shared copy of a short string value; other values are returned as they are."""
+    if type(value) is str and len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+class RowLayout:
+    """Property positions shared by the rows of one entity."""
+
+    def __init__(self) -> None:
+        self.fields: List[str] = []
+        self.slots: Dict[str, int] = {}
+
+    def _slot(self, field: str) -> int:
+        slot = self.slots.get(field)
+        if slot is None:
+            slot = len(self.fields)
+            self.fields.append(field)
+            self.slots[field] = slot
+        return slot
+
+    def record(self, row: Mapping, seq: int) -> "Record":
+        """Pack a row into a record of this layout."""
+        slots = self.slots
+        values = [_ABSENT] * len(slots)
+        for field, value in row.items():
+            slot = slots.get(field)
+            if slot is None:
+                slot = self._slot(field)
+                values.append(_ABSENT)
+            values[slot] = intern_value(value)
+        while values and values[-1] is _ABSENT:
+            values.pop()
+        return Record(self, tuple(values), seq)
+
+    def update(self, record: "Record", changes: Mapping, removed: Iterable[str] = ()) -> None:
+        """Set properties of a record of this layout and drop the `removed` ones."""
+        values = list(record._values)
+        for field, value in changes.items():
+            slot = self._slot(field)
+            if slot >= len(values):
+                values.extend([_ABSENT] * (slot + 1 - len(values)))
+            values[slot] = intern_value(value)
+        for field in removed:
+            slot = self.slots.get(field)
+            if slot is not None and slot < len(values):
+                values[slot] = _ABSENT
+        while values and values[-1] is _ABSENT:
+            values.pop()
+        record._values = tuple(values)
+
+
+class Record(Mapping):
+    """A stored row: read-only mapping over a tuple of values laid out by its entity's RowLayout.
+
+    `seq` is the row's insertion sequence number in its table.
+    """
+
+    __slots__ = ("_layout", "_values", "seq")
+
+    def __init__(self, layout: RowLayout, values: Tuple[Any, ...], seq: int):
+        self._layout = layout
+        self._values = values
+        self.seq = seq
+
+    def __getitem__(self, field: str) -> Any:
+        slot = self._layout.slots.get(field)
+        if slot is not None and slot < len(self._values):
+            value = self._values[slot]
+            if value is not _ABSENT:
+                return value
+        raise KeyError(field)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        slot = self._layout.slots.get(field)
+        if slot is not None and slot < len(self._values):
+            value = self._values[slot]
+            if value is not _ABSENT:
+                return value
+        return default
+
+    def __contains__(self, field: object) -> bool:
+        slot = self._layout.slots.get(field)  # type: ignore[arg-type]
+        return slot is not None and slot < len(self._values) and self._values[slot] is not _ABSENT
+
+    def __iter__(self) -> Iterator[str]:
+        for field, value in zip(self._layout.fields, self._values):
+            if value is not _ABSENT:
+                yield field
+
+    def __len__(self) -> int:
+        return sum(1 for value in self._values if value is not _ABSENT)
+
+    def items(self):  # type: ignore[override]
+        return self.to_dict().items()
+
+    def values(self):  # type: ignore[override]
+        return [value for value in self._values if value is not _ABSENT]
+
+    def to_dict(self) -> Row:
+        """The row as a plain dict, for serialising."""
+        return {field: value for field, value in zip(self._layout.fields, self._values) if value is not _ABSENT}
+
+    def __repr__(self) -> str:
+        return f"Record({self.to_dict()!r})"
+
+
+def as_dict(row: Mapping) -> Row:
+    """A stored or plain row as a plain dict."""
+    return row.to_dict() if type(row) is Record else row  # type: ignore[union-attr, return-value]
@@ -0,0 +1,190 @@
+"""
+JSON encoding of OData responses for the mock server.
+
+Large collections are streamed: the `{"d": {"results": [...]}}` envelope and
+the rows are written out in chunks from a generator, so the whole body never
+has to sit in memory at once. `orjson` is used for encoding when it is
+installed and the standard library `json` module otherwise.
+
+Responses carry weak ETags built from version counters. Encoded bodies can
+be kept in a `ResponseCache` keyed by the request, the version of the data
+they were encoded from and the content coding they were compressed with
+(see compression.py), so repeated reads of unchanged data are served without
+encoding or compressing them again.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, Optional, Tuple
+
+from fastapi.responses import Response, StreamingResponse
+
+from compression import COMPRESS_MIN_BYTES, compress, compress_chunks
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Pages with at least this many rows are streamed instead of encoded in one go
+STREAM_MIN_ROWS = int(os.environ.get("MOCK_STREAM_MIN_ROWS", "200"))
+
+# Rows encoded per chunk written to the client
+STREAM_CHUNK_ROWS = int(os.environ.get("MOCK_STREAM_CHUNK_ROWS", "100"))
+
+# Memory given to cached response bodies
+RESPONSE_CACHE_BYTES = int(float(os.environ.get("MOCK_RESPONSE_CACHE_MB", "64")) * 1024 * 1024)
+
+
+def dumps(value: Any) -> bytes:
+    """Encode a value as compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def iter_collection(rows: Iterable[Dict[str, Any]], extra: Dict[str, Any],
+                    project: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                    chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[bytes]:
+    """Yield the OData collection envelope around `rows` in chunks.
+
+    `extra` holds the members written after `results`, such as `__count` and
+    `__next`. Rows are projected as they are encoded.
+    """
+    yield b'{"d":{"results":['
+    chunk = []
+    first = True
+    for row in rows:
+        chunk.append(dumps(project(row) if project else row))
+        if len(chunk) >= chunk_rows:
+            yield (b"" if first else b",") + b",".join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield (b"" if first else b",") + b",".join(chunk)
+    yield b"]"
+    for name, value in extra.items():
+        yield b"," + dumps(name) + b":" + dumps(value)
+    yield b"}}"
+
+
+def collection_response(rows: Iterable[Dict[str, Any]], extra: Dict[str, Any],
+                        project: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                        headers: Optional[Dict[str, str]] = None,
+                        cache: Optional[Tuple["ResponseCache", Hashable]] = None,
+                        coding: Optional[str] = None) -> StreamingResponse:
+    """Stream a collection page as an OData v2 JSON response, compressed with `coding` if given.
+
+    With `cache`, a (cache, key) pair, the body is also stored in the cache,
+    as it was sent, once it has been streamed in full. Streamed pages are
+    far larger than `COMPRESS_MIN_BYTES`, so they are compressed whenever a
+    coding is given.
+    """
+    chunks = iter_collection(rows, extra, project)
+    if coding is not None:
+        chunks = compress_chunks(chunks, coding)
+    if cache is not None:
+        chunks = cache[0].tee(cache[1], chunks, coding)
+    return StreamingResponse(chunks, media_type="application/json", headers=coded_headers(headers, coding))
+
+
+def coded_response(body: bytes, coding: Optional[str], headers: Optional[Dict[str, str]] = None) -> Response:
+    """A JSON response of a body already compressed with `coding`, if any."""
+    return Response(body, media_type="application/json", headers=coded_headers(headers, coding))
+
+
+def coded_headers(headers: Optional[Dict[str, str]], coding: Optional[str]) -> Dict[str, str]:
+    """Response headers declaring the content coding of a body that may be served compressed."""
+    headers = dict(headers or {}, Vary="Accept-Encoding")
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+    return headers
+
+
+def encode_body(value: Any, coding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Encode a response body in one go, returning it with the coding it was compressed with.
+
+    The body is compressed with `coding` if given, unless it is smaller than
+    `COMPRESS_MIN_BYTES`, in which case it is returned as it is with no coding.
+    """
+    body = dumps(value)
+    if coding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    return compress(body, coding), coding
+
+
+def json_response(value: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Encode a small response body in one go, bypassing FastAPI's generic encoder."""
+    return Response(dumps(value), status_code=status_code, media_type="application/json", headers=headers)
+
+
+# Conditional requests
+
+def entity_tag(*parts: Any) -> str:
+    """Weak ETag made of version counters and whatever else identifies them."""
+    return 'W/"%s"' % "-".join(map(str, parts))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag, comparing weakly."""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+class ResponseCache:
+    """Encoded response bodies, the least recently used evicted beyond a memory budget.
+
+    Keys should include the version of the data a body was encoded from, so
+    that entries for changed data are never hit again and age out. Each body
+    is stored with the content coding it was sent with, which is None for a
+    body too small to compress even though the client accepted a coding.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, Optional[str]]]" = OrderedDict()
+        # Streamed bodies are stored from the thread pool threads that encode them
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, Optional[str]]]:
+        """The body stored under a key and its content coding, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, body: bytes, coding: Optional[str] = None) -> None:
+        # A single body may take at most an eighth of the budget
+        if len(body) > self.max_bytes // 8:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = (body, coding)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def tee(self, key: Hashable, chunks: Iterable[bytes], coding: Optional[str] = None) -> Iterator[bytes]:
+        """Pass chunks through, storing them as one body if they are all consumed."""
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.put(key, b"".join(parts), coding)
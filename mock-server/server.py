@@ -1,12 +1,65 @@
 from fastapi import FastAPI, Request, Header
-from fastapi.responses import JSONResponse
-from typing import Optional, Dict, Any, List
-import uuid
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+from typing import Optional, Dict, Any, Callable, List, Mapping, Sequence, Tuple
+import asyncio
+import base64
+from contextlib import nullcontext
+import math
 import random
 from datetime import datetime, timedelta
+import os
+import time
+
+from batch import BatchError, execute_batch, format_batch, parse_batch
+from compression import COMPRESS_MIN_BYTES, compress_stream, negotiate
+from dataset import SyntheticDataset, seeded_uuid
+from filters import apply_filter, compile_filter
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from navigation import ExpandTree, Expander, Navigation, parse_expand
+from odata import (DeltaToken, EffectiveDates, KeyPredicate, OrderBy, Paging, QueryOptionError, SearchQuery, Selection,
+                   parse_key_predicate)
+from profiler import SamplingProfiler, collapse
+from records import Record, as_dict
+from responses import (STREAM_MIN_ROWS, ResponseCache, coded_response, collection_response, dumps, encode_body,
+                       entity_tag, etag_matches, json_response, not_modified)
+from shared import SharedLog
+from snapshot import Snapshot, write_snapshot
+from store import EffectiveDating, EntityStore, matches_search, row_key
+from throttling import Throttle, ThrottleError, rules_of
+from upsert import read_ndjson, upsert_record
+from workflow import WorkflowEngine, WorkflowError
 
 app = FastAPI()
 
+SERVICE_ROOT = "/successfactors/odata/v2"
+
+# Number of synthetic employees generated on top of MOCK_DATA, and the seed they derive from
+MOCK_SCALE = int(os.environ.get("MOCK_SCALE", "0"))
+MOCK_SEED = int(os.environ.get("MOCK_SEED", "0"))
+
+# Snapshot file to start from instead of MOCK_DATA and the synthetic dataset, and default checkpoint target
+SNAPSHOT_PATH = os.environ.get("MOCK_SNAPSHOT")
+
+# Directory /admin/checkpoint may also write snapshots into; unset, it only writes to MOCK_SNAPSHOT
+SNAPSHOT_DIR = os.environ.get("MOCK_SNAPSHOT_DIR")
+
+# SQLite database that worker processes share their writes through; unset keeps the store in memory
+SHARED_STORE_PATH = os.environ.get("MOCK_SHARED_STORE")
+
+# Largest page served for a collection request; clients follow `__next` for the rest
+MAX_PAGE_SIZE = int(os.environ.get("MOCK_MAX_PAGE_SIZE", "1000"))
+
+# Media type of bulk imports and their status reports, one JSON document per line
+NDJSON = "application/x-ndjson"
+
+# Longest a single profile may run, however many requests it waits for
+MAX_PROFILE_SECONDS = float(os.environ.get("MOCK_MAX_PROFILE_SECONDS", "300"))
+
+# Throttling profile to serve requests under: a built-in profile name or a JSON file; unset serves them at full speed
+THROTTLE_PROFILE = os.environ.get("MOCK_THROTTLE")
+
 # Comprehensive mock data for all SAP SuccessFactors Employee Central entities
 MOCK_DATA: Dict[str, List[Dict[str, Any]]] = {
     # Employment Information
@@ -15,7 +68,7 @@ MOCK_DATA: Dict[str, List[Dict[str, Any]]] = {
         {"personIdExternal": "jane456", "userId": "EMP002", "startDate": "2019-06-15", "employmentStatus": "Active"}
     ],
     "EmpJob": [
-        {"seqNumber": 1, "startDate": "2020-01-01", "userId": "EMP001", "jobTitle": "Engineer"},
+        {"seqNumber": 1, "startDate": "2020-01-01", "userId": "EMP001", "jobTitle": "Engineer", "managerId": "EMP002"},
         {"seqNumber": 2, "startDate": "2019-06-15", "userId": "EMP002", "jobTitle": "Manager"}
     ],
     "EmpBeneficiary": [
@@ -271,11 +324,11 @@ MOCK_DATA: Dict[str, List[Dict[str, Any]]] = {
     ],
 
     # Workflow
-    "MyPendingWorkflow": [
-        {"wfRequestId": "WF001", "requestType": "Leave Request", "status": "Pending", "submittedBy": "EMP001"}
-    ],
     "WfRequestParticipator": [
-        {"wfRequestParticipatorId": 1, "wfRequestId": "WF001", "participatorId": "EMP002", "role": "Approver"}
+        {"wfRequestParticipatorId": 1, "wfRequestId": 1, "ownerId": "EMP002", "participatorType": "APPROVER",
+         "actorType": "USER", "processingOrder": 1, "status": "PENDING"},
+        {"wfRequestParticipatorId": 2, "wfRequestId": 1, "ownerId": "EMP003", "participatorType": "APPROVER",
+         "actorType": "USER", "processingOrder": 2, "status": "WAITING"}
     ],
     "WorkflowAllowedActionList": [
         {"wfRequestId": 1, "allowedAction": "Approve", "actionCode": "APPROVE"}
@@ -284,10 +337,10 @@ MOCK_DATA: Dict[str, List[Dict[str, Any]]] = {
         {"externalCode": "ALERT001", "message": "Pending approval required", "severity": "Medium"}
     ],
     "WfRequestComments": [
-        {"wfRequestCommentId": 1, "wfRequestId": "WF001", "comment": "Please review", "commentBy": "EMP001"}
+        {"wfRequestCommentId": 1, "wfRequestId": 1, "comment": "Please review", "commentBy": "EMP001"}
     ],
     "WfRequestStep": [
-        {"wfRequestStepId": 1, "wfRequestId": "WF001", "stepNumber": 1, "stepName": "Manager Approval"}
+        {"wfRequestStepId": 1, "wfRequestId": 1, "stepNumber": 1, "stepName": "Manager Approval"}
     ],
     "AutoDelegateDetail": [
         {"AutoDelegateConfig_delegator": "EMP001", "externalCode": "AD001", "delegateTo": "EMP002"}
@@ -299,7 +352,8 @@ MOCK_DATA: Dict[str, List[Dict[str, Any]]] = {
         {"empWfRequestId": 1, "employeeId": "EMP001", "requestType": "Time Off", "status": "Submitted"}
     ],
     "WfRequest": [
-        {"wfRequestId": 1, "requestType": "Leave", "currentStep": "Manager Review", "priority": "Normal"}
+        {"wfRequestId": 1, "requestType": "Leave", "priority": "Normal", "status": "PENDING", "currentStepNum": 1,
+         "totalSteps": 2, "createdBy": "EMP001"}
     ],
 
     # Compensation Information
@@ -391,222 +445,417 @@ MOCK_DATA: Dict[str, List[Dict[str, Any]]] = {
     ]
 }
 
+# Declared key properties per entity, named after the fields used in MOCK_DATA.
+# Background_* entities are keyed by (backgroundElementId, userId); entities not
+# listed here get a key inferred from their first row.
+ENTITY_KEYS: Dict[str, Tuple[str, ...]] = {
+    # Employment Information
+    "EmpEmployment": ("userId",),
+    "EmpJob": ("seqNumber", "startDate", "userId"),
+    "EmpBeneficiary": ("userId",),
+    "EmpEmploymentTermination": ("userId",),
+    "EmpPensionPayout": ("userId",),
+    "EmpWorkPermit": ("userId",),
+    "EmpJobRelationships": ("relationshipType", "userId"),
+    "PersonEmpTerminationInfo": ("userId",),
+    "HireDateChange": ("code",),
+
+    # Alternative Cost Distribution
+    "EmpCostDistribution": ("effectiveStartDate", "usersSysId"),
+    "EmpCostDistributionItem": ("EmpCostDistribution_effectiveStartDate", "EmpCostDistribution_usersSysId", "externalCode"),
+
+    # Employee Profile
+    "UserBadges": ("badgeId", "userId"),
+    "BadgeTemplates": ("templateId",),
+    "EPPublicProfile": ("userId",),
+
+    # Skills Management
+    "CertificationContent": ("certificationId",),
+    "FamilyEntity": ("familyId",),
+    "CertificationEntity": ("certificationId",),
+    "JobResponsibilityContent": ("responsibilityId",),
+    "InterviewQuestionContent": ("questionId",),
+    "JobResponsibilityEntity": ("responsibilityId",),
+    "RatedSkillMapping": ("mappingId",),
+    "RoleCompetencyBehaviorMappingEntity": ("mappingId",),
+    "RoleEntity": ("roleId",),
+    "JobProfileLocalizedData": ("profileId", "locale"),
+    "JobCodeMappingEntity": ("mappingId",),
+    "CompetencyType": ("typeId",),
+    "EmploymentConditionContent": ("conditionId",),
+    "FamilyCompetencyMappingEntity": ("mappingId",),
+    "PhysicalReqEntity": ("reqId",),
+    "InterviewQuestionEntity": ("questionId",),
+    "BehaviorMappingEntity": ("mappingId",),
+    "SkillEntity": ("skillId",),
+    "PhysicalReqContent": ("reqId",),
+    "SkillContent": ("skillId",),
+    "RoleCompetencyMappingEntity": ("mappingId",),
+    "SelfReportSkillMapping": ("mappingId",),
+    "JobProfile": ("profileId",),
+    "FamilySkillMappingEntity": ("mappingId",),
+    "RoleSkillMappingEntity": ("mappingId",),
+    "JobDescTemplate": ("templateId",),
+    "SkillProfile": ("profileId",),
+    "CompetencyEntity": ("competencyId",),
+    "CompetencyContent": ("contentId",),
+    "RelevantIndustryEntity": ("industryId",),
+    "RoleTalentPoolMappingEntity": ("mappingId",),
+    "EmploymentConditionEntity": ("conditionId",),
+    "JobDescSection": ("sectionId",),
+    "RelevantIndustryContent": ("contentId",),
+    "PositionEntity": ("positionId",),
+    "PositionCompetencyMappingEntity": ("mappingId",),
+    "PositionSkillMappingEntity": ("mappingId",),
+    "JDTemplateFamilyMapping": ("mappingId",),
+
+    # Payroll & Timesheets
+    "EmployeeTimeSheet": ("externalCode",),
+    "ExternalAllowance": ("externalCode",),
+    "TimeCollector": ("externalCode",),
+    "ExternalTimeRecord": ("externalCode",),
+    "ExternalTimeData": ("externalCode",),
+    "DataReplicationProxy": ("externalCode",),
+    "EmployeeTimeSheetEntry": ("entryId",),
+    "EmployeeTimeValuationResult": ("resultId",),
+    "AllowanceRecording": ("recordingId",),
+    "AvailableAllowanceType": ("typeId",),
+    "ExternalTimeSegment": ("segmentId",),
+    "TimeRecording": ("recordingId",),
+    "Allowance": ("allowanceId",),
+
+    # Workflow
+    "WfRequestParticipator": ("wfRequestParticipatorId",),
+    "WorkflowAllowedActionList": ("wfRequestId",),
+    "AlertMessage": ("externalCode",),
+    "WfRequestComments": ("wfRequestCommentId",),
+    "WfRequestStep": ("wfRequestStepId",),
+    "AutoDelegateDetail": ("AutoDelegateConfig_delegator", "externalCode"),
+    "AutoDelegateConfig": ("delegator",),
+    "EmpWfRequest": ("empWfRequestId",),
+    "WfRequest": ("wfRequestId",),
+
+    # Compensation Information
+    "OneTimeDeduction": ("deductionId",),
+    "RecurringDeductionItem": ("itemId",),
+    "EmpPayCompRecurring": ("userId",),
+    "DeductionScreenId": ("screenId",),
+    "RecurringDeduction": ("deductionId",),
+    "EmpCompensation": ("userId",),
+    "EmpPayCompNonRecurring": ("payDate", "userId"),
+    "EmpCompensationGroupSumCalculated": ("userId",),
+
+    # Position Management
+    "PositionRequisitionStatus": ("requisitionId",),
+    "PositionMatrixRelationship": ("relationshipId",),
+    "Position": ("positionId",),
+    "PositionRightToReturn": ("positionId",),
+
+    # Dismissal Protection
+    "EmployeeDismissalProtectionDetail": ("detailId",),
+    "EmployeeDismissalProtection": ("protectionId",),
+
+    # Apprentice Management
+    "ApprenticeEventType": ("eventTypeId",),
+    "DepartmentApprenticeDetail": ("detailId",),
+    "ApprenticeSchool": ("schoolId",),
+    "ApprenticeGroup": ("groupId",),
+    "ApprenticeSchoolEvent": ("eventId",),
+    "ApprenticePracticalTrainingEvent": ("eventId",),
+    "ApprenticeInternalTrainingEvent": ("eventId",),
+    "Apprentice": ("apprenticeId",),
+
+    # Master Data Replication
+    "EmployeeDataReplicationConfirmationErrorMessage": ("messageId",),
+    "EmployeeDataReplicationElement": ("elementId",),
+    "EmployeeDataReplicationNotification": ("notificationId",),
+    "EmployeeDataReplicationConfirmation": ("confirmationId",),
+}
+
+# Navigation properties per entity, as the Ballerina clients name them in $expand.
+# Employee data is linked by userId; Background_* elements lead to the employment
+# of the user they belong to. Navigations not listed here are ignored by $expand.
+NAVIGATIONS: Dict[str, Dict[str, Navigation]] = {
+    # Employment Information
+    "EmpEmployment": {
+        "empBeneficiaryNav": Navigation("EmpBeneficiary", ("userId",)),
+        "empJobRelationshipNav": Navigation("EmpJobRelationships", ("userId",), many=True),
+        "empPensionPayoutNav": Navigation("EmpPensionPayout", ("userId",)),
+        "empWorkPermitNav": Navigation("EmpWorkPermit", ("userId",), many=True),
+        "jobInfoNav": Navigation("EmpJob", ("userId",), many=True),
+    },
+    "EmpJob": {
+        "employmentNav": Navigation("EmpEmployment", ("userId",)),
+        "managerEmploymentNav": Navigation("EmpEmployment", ("managerId",), ("userId",)),
+    },
+    "EmpBeneficiary": {"employmentNav": Navigation("EmpEmployment", ("userId",))},
+    "EmpPensionPayout": {"employmentNav": Navigation("EmpEmployment", ("userId",))},
+    "EmpWorkPermit": {"employmentNav": Navigation("EmpEmployment", ("userId",))},
+    "EmpEmploymentTermination": {
+        "employmentNav": Navigation("EmpEmployment", ("userId",)),
+        "jobInfoNav": Navigation("EmpJob", ("userId",)),
+    },
+    "EmpJobRelationships": {
+        "employmentNav": Navigation("EmpEmployment", ("userId",)),
+        "relEmploymentNav": Navigation("EmpEmployment", ("relatedUserId",), ("userId",)),
+    },
+
+    # Employee Profile
+    **{entity: {"userNav": Navigation("EmpEmployment", ("userId",))}
+       for entity in MOCK_DATA if entity.startswith("Background_")},
+
+    # Workflow
+    "WfRequest": {
+        "empWfRequestNav": Navigation("EmpWfRequest", ("wfRequestId",)),
+        "wfRequestCommentsNav": Navigation("WfRequestComments", ("wfRequestId",), many=True),
+        "wfRequestParticipatorNav": Navigation("WfRequestParticipator", ("wfRequestId",), many=True),
+        "wfRequestStepNav": Navigation("WfRequestStep", ("wfRequestId",), many=True),
+        "workflowAllowedActionListNav": Navigation("WorkflowAllowedActionList", ("wfRequestId",), many=True),
+    },
+    "WfRequestStep": {"wfRequestNav": Navigation("WfRequest", ("wfRequestId",))},
+
+    # Compensation Information
+    "EmpCompensation": {
+        "empCompensationGroupSumCalculatedNav": Navigation("EmpCompensationGroupSumCalculated", ("userId",), many=True),
+        "empPayCompRecurringNav": Navigation("EmpPayCompRecurring", ("userId",), many=True),
+    },
+    "EmpPayCompRecurring": {"compensationNav": Navigation("EmpCompensation", ("userId",))},
+    "RecurringDeduction": {"recurringItems": Navigation("RecurringDeductionItem", ("deductionId",), many=True)},
+}
+
+# Effective-dated entities, read as of a date or over a date range through asOfDate, fromDate and toDate
+EFFECTIVE_DATING: Dict[str, EffectiveDating] = {
+    "EmpJob": EffectiveDating("startDate", ("userId",), sequence="seqNumber", end="endDate"),
+    "EmpCostDistribution": EffectiveDating("effectiveStartDate", ("usersSysId",), end="effectiveEndDate"),
+    "EmpCostDistributionItem": EffectiveDating("EmpCostDistribution_effectiveStartDate",
+                                               ("EmpCostDistribution_usersSysId", "externalCode")),
+}
+
+DATASET = SyntheticDataset(MOCK_SCALE, MOCK_SEED, templates=MOCK_DATA)
+if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH):
+    # A snapshot already holds the seed rows and any generated tenant
+    STORE = EntityStore(Snapshot(SNAPSHOT_PATH), ENTITY_KEYS)
+else:
+    STORE = EntityStore(MOCK_DATA, ENTITY_KEYS, loader=DATASET.rows)
+SHARED_LOG = SharedLog(SHARED_STORE_PATH, STORE) if SHARED_STORE_PATH else None
+EXPANDER = Expander(STORE, NAVIGATIONS)
+CHECKPOINT_LOCK = asyncio.Lock()
+WORKFLOW = WorkflowEngine(STORE)
+
+METRICS = Metrics()
+METRICS.gauge("mock_store_rows", "Rows in each entity table built so far",
+              lambda: {(("entity", entity),): len(STORE.loaded(entity)) for entity in STORE.entities()
+                       if STORE.loaded(entity) is not None})
+
+PROFILER = SamplingProfiler()
+
+THROTTLE = Throttle.load(THROTTLE_PROFILE, MOCK_SEED)
+METRICS.gauge("mock_throttle_in_flight", "Requests being served under each throttling rule",
+              lambda: {(("rule", str(rule)), ("entity", entity)): count
+                       for (rule, entity), count in THROTTLE.in_flight().items()})
+
+# Encoded collection pages, keyed by URL and the version of the entity they were read from
+RESPONSE_CACHE = ResponseCache()
+
+# Drives generated ids and values, so a given MOCK_SEED replays the same data.
+# Workers sharing a store draw from separate streams so their ids never collide.
+RNG = random.Random(f"{MOCK_SEED}:{os.getpid()}" if SHARED_LOG else MOCK_SEED)
+
+def store_writes():
+    """Hold the shared store's write lock, if there is one, around a handler's writes (see SharedLog.writing)."""
+    return SHARED_LOG.writing() if SHARED_LOG is not None else nullcontext()
+
+
 # Helper function to generate random mock data for entities
 def generate_mock_entity(entity_name: str) -> Dict[str, Any]:
     """Generate a mock entity with basic fields."""
     base_entity = {
-        "id": str(uuid.uuid4()),
+        "id": seeded_uuid(RNG),
         "createdDate": datetime.now().isoformat(),
         "lastModifiedDate": datetime.now().isoformat(),
         "status": "Active"
     }
     
     # Add entity-specific fields based on common patterns
-    if "userId" in str(MOCK_DATA.get(entity_name, [])):
-        base_entity["userId"] = f"EMP{random.randint(100, 999)}"
+    schema = STORE.table(entity_name).schema
+    if "userId" in schema:
+        base_entity["userId"] = f"EMP{RNG.randint(100, 999)}"
     
-    if "externalCode" in str(MOCK_DATA.get(entity_name, [])):
-        base_entity["externalCode"] = f"{entity_name.upper()}{random.randint(100, 999)}"
+    if "externalCode" in schema:
+        base_entity["externalCode"] = f"{entity_name.upper()}{RNG.randint(100, 999)}"
         
     return base_entity
 
 
-@app.get("/successfactors/odata/v2/{entity}")
-async def list_entities(entity: str):
-    """List all entities of a given type."""
-    data = MOCK_DATA.get(entity, [])
-    if not data:
-        # Generate mock data if entity not found
-        data = [generate_mock_entity(entity)]
-        MOCK_DATA[entity] = data
-    return {"d": {"results": data}}
+def find_entities(entity: str, predicate: KeyPredicate) -> List[Record]:
+    """Resolve a parsed key predicate against the entity's key indexes."""
+    table = STORE.table(entity)
+    if predicate.named:
+        return table.lookup(predicate.names, predicate.alternatives)
+    if len(predicate.parts) == 1:
+        # A bare value matches any key property, or the server id
+        for value in predicate.alternatives[0]:
+            rows = table.find_by_value(value)
+            if rows:
+                return rows
+        return []
+    if len(predicate.parts) != len(table.key_fields) or any(predicate.names):
+        return []
+    return table.lookup(table.key_fields, predicate.alternatives)
 
 
-@app.post("/successfactors/odata/v2/{entity}")
-async def create_entity(entity: str, request: Request):
-    """Create a new entity."""
-    payload = await request.json()
-    
-    # Initialize entity list if it doesn't exist
-    if entity not in MOCK_DATA:
-        MOCK_DATA[entity] = []
-    
-    # Add timestamps and ID if not present
-    if "id" not in payload:
-        payload["id"] = str(uuid.uuid4())
-    if "createdDate" not in payload:
-        payload["createdDate"] = datetime.now().isoformat()
-    
-    MOCK_DATA[entity].append(payload)
-    return {"d": payload}
+def projector(entity: str, rows: Sequence[Record], selection: Selection,
+              expand: ExpandTree) -> Callable[[Record], Dict[str, Any]]:
+    """Projection of the rows of a response, joined with their expanded navigation properties."""
+    if not expand:
+        return selection.project
+    expansions = EXPANDER.expand(entity, rows, expand)
 
+    def project(row: Record) -> Dict[str, Any]:
+        projected = selection.project(row)
+        projected.update(expansions[row.seq])
+        return projected
+    return project
 
-@app.get("/successfactors/odata/v2/{entity}({key})")
-async def get_entity_by_single_key(entity: str, key: str):
-    """Get entity by a single key (handles various key formats)."""
-    data = MOCK_DATA.get(entity, [])
-    
-    # Clean the key (remove quotes if present)
-    clean_key = key.strip("'\"")
-    
-    # Try to find the entity by different possible key fields
-    possible_key_fields = ["userId", "code", "externalCode", "id", "backgroundElementId", 
-                          "wfRequestId", "positionId", "apprenticeId", "skillId", "competencyId",
-                          "roleId", "familyId", "certificationId", "profileId", "templateId"]
-    
-    for item in data:
-        for key_field in possible_key_fields:
-            if key_field in item and str(item[key_field]) == clean_key:
-                return {"d": item}
-    
-    # If not found, generate a mock entity
-    mock_entity = generate_mock_entity(entity)
-    # Try to set the key field if we can determine it
-    if entity.startswith("Background_"):
-        mock_entity["backgroundElementId"] = int(clean_key) if clean_key.isdigit() else 1
-        mock_entity["userId"] = f"EMP{random.randint(100, 999)}"
-    elif "userId" in str(data):
-        mock_entity["userId"] = clean_key
-    elif "code" in str(data):
-        mock_entity["code"] = clean_key
-    elif "externalCode" in str(data):
-        mock_entity["externalCode"] = clean_key
-    
-    return {"d": mock_entity}
 
+def row_response(entity: str, row: Record, request: Request) -> Response:
+    """A stored row, or 304 Not Modified when the client already holds this version of it."""
+    try:
+        selection = Selection.from_params(request.query_params)
+        expand = parse_expand(request.query_params.get("$expand"))
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    # Expanded rows are part of the response, so their entities' versions are part of its tag
+    expanded = [STORE.version(target) for target in EXPANDER.entities(entity, expand)]
+    etag = entity_tag(STORE.epoch, row.seq, STORE.table(entity).row_version(row), *expanded)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    return json_response({"d": projector(entity, [row], selection, expand)(row)}, headers={"ETag": etag})
 
-@app.get("/successfactors/odata/v2/{entity}({key1},{key2})")
-async def get_entity_by_two_keys(entity: str, key1: str, key2: str):
-    """Get entity by two keys (common for background entities and others)."""
-    data = MOCK_DATA.get(entity, [])
-    
-    # Clean the keys
-    clean_key1 = key1.split("=")[1].strip("'\"") if "=" in key1 else key1.strip("'\"")
-    clean_key2 = key2.split("=")[1].strip("'\"") if "=" in key2 else key2.strip("'\"")
-    
-    # For background entities, typically backgroundElementId and userId
-    for item in data:
-        if (str(item.get("backgroundElementId", "")) == clean_key1 and 
-            str(item.get("userId", "")) == clean_key2) or \
-           (str(item.get("userId", "")) == clean_key1 and 
-            str(item.get("backgroundElementId", "")) == clean_key2):
-            return {"d": item}
-    
-    # Generate mock entity if not found
-    mock_entity = generate_mock_entity(entity)
-    if entity.startswith("Background_"):
-        mock_entity["backgroundElementId"] = int(clean_key1) if clean_key1.isdigit() else int(clean_key2) if clean_key2.isdigit() else 1
-        mock_entity["userId"] = clean_key2 if not clean_key2.isdigit() else clean_key1
+
+def request_user(request: Request) -> Optional[str]:
+    """User a request authenticates as through HTTP Basic auth, without the `@companyId` suffix."""
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        decoded = base64.b64decode(credentials, validate=True).decode("utf-8")
+    except ValueError:
+        return None
+    return decoded.partition(":")[0].partition("@")[0] or None
+
+
+# Workflow function imports take their parameters in the query string
+def string_parameter(params: Mapping[str, str], name: str) -> Optional[str]:
+    """A string parameter of a function import, with or without its OData quotes."""
+    raw = params.get(name)
+    if raw is not None and len(raw) >= 2 and raw[0] == raw[-1] == "'":
+        return raw[1:-1].replace("''", "'")
+    return raw
+
+
+def workflow_request(params: Mapping[str, str], key: Optional[str] = None) -> Record:
+    """The workflow request named by a key predicate or the `wfRequestId` parameter."""
+    raw = key if key is not None else params.get("wfRequestId")
+    if not raw:
+        raise QueryOptionError("Missing wfRequestId parameter")
+    predicate = parse_key_predicate(raw)
+    if len(predicate.parts) != 1:
+        raise QueryOptionError(f"Invalid wfRequestId value: {raw}")
+    return WORKFLOW.request(predicate.alternatives[0])
+
+
+# Pending workflows are the requests waiting on the user, read from the workflow engine's queues
+@app.get("/successfactors/odata/v2/MyPendingWorkflow")
+async def list_pending_workflows(request: Request):
+    """List the workflow requests waiting on the authenticated user, or on anyone if none is."""
+    try:
+        paging = Paging.from_params(request.query_params)
+        selection = Selection.from_params(request.query_params)
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     
-    return {"d": mock_entity}
+    pending = WORKFLOW.pending(request_user(request))
+    start, end, next_offset = paging.window(len(pending), MAX_PAGE_SIZE)
+    extra: Dict[str, Any] = {}
+    if paging.count:
+        extra["__count"] = str(len(pending))
+    if next_offset is not None:
+        extra["__next"] = str(request.url.include_query_params(**{"$skiptoken": next_offset}))
+    results = [selection.project(WORKFLOW.pending_item(row)) for row in pending[start:end]]
+    return json_response({"d": {"results": results, **extra}})
 
 
-@app.get("/successfactors/odata/v2/{entity}({key1},{key2},{key3})")
-async def get_entity_by_three_keys(entity: str, key1: str, key2: str, key3: str):
-    """Get entity by three keys."""
-    data = MOCK_DATA.get(entity, [])
+@app.get("/successfactors/odata/v2/MyPendingWorkflow({key})")
+async def get_pending_workflow(key: str, request: Request):
+    """Get a workflow request by id if it is waiting on the authenticated user."""
+    try:
+        wf_request = workflow_request(request.query_params, key)
+        selection = Selection.from_params(request.query_params)
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except WorkflowError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
     
-    # Clean the keys
-    clean_key1 = key1.split("=")[1].strip("'\"") if "=" in key1 else key1.strip("'\"")
-    clean_key2 = key2.split("=")[1].strip("'\"") if "=" in key2 else key2.strip("'\"")
-    clean_key3 = key3.split("=")[1].strip("'\"") if "=" in key3 else key3.strip("'\"")
+    if not WORKFLOW.waits_on(wf_request, request_user(request)):
+        return JSONResponse(status_code=404, content={"error": "Entity not found"})
+    return json_response({"d": selection.project(WORKFLOW.pending_item(wf_request))})
+
+
+@app.get("/successfactors/odata/v2/{entity}({key})")
+async def get_entity(entity: str, key: str, request: Request):
+    """Get an entity by its key predicate, of any number of named or positional keys."""
+    try:
+        predicate = parse_key_predicate(key)
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     
-    # Try to find matching entity
-    for item in data:
-        # This is a simplified match - in practice, you'd want to parse the key names
-        if (str(item.get("EmpCostDistribution_effectiveStartDate", "")) == clean_key1 and
-            str(item.get("EmpCostDistribution_usersSysId", "")) == clean_key2 and
-            str(item.get("externalCode", "")) == clean_key3):
-            return {"d": item}
+    matches = find_entities(entity, predicate)
+    if matches:
+        return row_response(entity, matches[0], request)
     
-    # Generate mock entity
+    # If not found, generate a mock entity carrying the requested key
     mock_entity = generate_mock_entity(entity)
-    mock_entity["key1"] = clean_key1
-    mock_entity["key2"] = clean_key2  
-    mock_entity["key3"] = clean_key3
+    table = STORE.table(entity)
+    key_values = predicate.bind(table.key_fields)
+    if key_values is None and len(predicate.parts) == 1:
+        key_values = {table.key_fields[0]: predicate.parts[0][1]}
+    mock_entity.update(key_values or {})
     return {"d": mock_entity}
 
 
 @app.put("/successfactors/odata/v2/{entity}({key})")
-async def update_entity_by_single_key(entity: str, key: str, request: Request):
-    """Update entity by single key."""
+async def update_entity(entity: str, key: str, request: Request):
+    """Update an entity by its key predicate."""
     payload = await request.json()
-    data = MOCK_DATA.get(entity, [])
-    clean_key = key.strip("'\"")
-    
-    # Find and update the entity
-    possible_key_fields = ["userId", "code", "externalCode", "id", "backgroundElementId"]
-    
-    for i, item in enumerate(data):
-        for key_field in possible_key_fields:
-            if key_field in item and str(item[key_field]) == clean_key:
-                # Update the item
-                data[i].update(payload)
-                data[i]["lastModifiedDate"] = datetime.now().isoformat()
-                return {"status": "Updated"}
-    
-    return JSONResponse(status_code=404, content={"error": "Entity not found"})
-
-
-@app.put("/successfactors/odata/v2/{entity}({key1},{key2})")
-async def update_entity_by_two_keys(entity: str, key1: str, key2: str, request: Request):
-    """Update entity by two keys."""
-    payload = await request.json()
-    data = MOCK_DATA.get(entity, [])
-    
-    clean_key1 = key1.split("=")[1].strip("'\"") if "=" in key1 else key1.strip("'\"")
-    clean_key2 = key2.split("=")[1].strip("'\"") if "=" in key2 else key2.strip("'\"")
+    try:
+        predicate = parse_key_predicate(key)
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     
-    for i, item in enumerate(data):
-        if ((str(item.get("backgroundElementId", "")) == clean_key1 and 
-             str(item.get("userId", "")) == clean_key2) or
-            (str(item.get("userId", "")) == clean_key1 and 
-             str(item.get("backgroundElementId", "")) == clean_key2)):
-            data[i].update(payload)
-            data[i]["lastModifiedDate"] = datetime.now().isoformat()
+    async with store_writes():
+        matches = find_entities(entity, predicate)
+        if matches:
+            payload["lastModifiedDate"] = datetime.now().isoformat()
+            STORE.table(entity).update(matches[0], payload)
             return {"status": "Updated"}
     
     return JSONResponse(status_code=404, content={"error": "Entity not found"})
 
 
 @app.delete("/successfactors/odata/v2/{entity}({key})")
-async def delete_entity_by_single_key(entity: str, key: str):
-    """Delete entity by single key."""
-    data = MOCK_DATA.get(entity, [])
-    clean_key = key.strip("'\"")
-    initial_len = len(data)
+async def delete_entity(entity: str, key: str):
+    """Delete an entity by its key predicate."""
+    try:
+        predicate = parse_key_predicate(key)
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     
-    # Remove entities that match the key
-    possible_key_fields = ["userId", "code", "externalCode", "id", "backgroundElementId"]
-    
-    MOCK_DATA[entity] = [
-        item for item in data 
-        if not any(str(item.get(key_field, "")) == clean_key for key_field in possible_key_fields)
-    ]
-    
-    if len(MOCK_DATA[entity]) < initial_len:
-        return {"d": {"status": "Deleted"}}
-    return JSONResponse(status_code=404, content={"error": "Entity not found"})
-
-
-@app.delete("/successfactors/odata/v2/{entity}({key1},{key2})")
-async def delete_entity_by_two_keys(entity: str, key1: str, key2: str):
-    """Delete entity by two keys."""
-    data = MOCK_DATA.get(entity, [])
-    clean_key1 = key1.split("=")[1].strip("'\"") if "=" in key1 else key1.strip("'\"")
-    clean_key2 = key2.split("=")[1].strip("'\"") if "=" in key2 else key2.strip("'\"")
-    initial_len = len(data)
-    
-    MOCK_DATA[entity] = [
-        item for item in data 
-        if not ((str(item.get("backgroundElementId", "")) == clean_key1 and 
-                 str(item.get("userId", "")) == clean_key2) or
-                (str(item.get("userId", "")) == clean_key1 and 
-                 str(item.get("backgroundElementId", "")) == clean_key2))
-    ]
-    
-    if len(MOCK_DATA[entity]) < initial_len:
-        return {"d": {"status": "Deleted"}}
+    async with store_writes():
+        matches = find_entities(entity, predicate)
+        if matches:
+            STORE.table(entity).delete(matches)
+            return {"d": {"status": "Deleted"}}
     return JSONResponse(status_code=404, content={"error": "Entity not found"})
 
 
@@ -620,72 +869,458 @@ async def create_hire_date_change(request: Request):
 @app.delete("/successfactors/odata/v2/HireDateChange('{code}')")
 async def delete_hire_date_change(code: str):
     """Legacy endpoint for HireDateChange deletion."""
-    return await delete_entity_by_single_key("HireDateChange", code)
+    return await delete_entity("HireDateChange", f"'{code}'")
 
 
 # Workflow action endpoints
+async def workflow_action(action: str, request: Request) -> Response:
+    """Take an action on the workflow request a call names, answering with its new state."""
+    try:
+        async with store_writes():
+            wf_request = workflow_request(request.query_params)
+            WORKFLOW.act(action, wf_request, request_user(request), string_parameter(request.query_params, "comment"),
+                         datetime.now().isoformat())
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except WorkflowError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    return json_response({"d": {"results": [WORKFLOW.action_result(wf_request)]}})
+
+
 @app.post("/successfactors/odata/v2/approveWfRequest")
 async def approve_workflow_request(request: Request):
-    """Approve a workflow request."""
-    params = await request.json() if hasattr(request, 'json') else {}
-    return {"d": {"result": "Workflow approved", "status": "Success"}}
+    """Approve the current step of a workflow request."""
+    return await workflow_action("approve", request)
 
 
 @app.post("/successfactors/odata/v2/rejectWfRequest")
 async def reject_workflow_request(request: Request):
     """Reject a workflow request."""
-    params = await request.json() if hasattr(request, 'json') else {}
-    return {"d": {"result": "Workflow rejected", "status": "Success"}}
+    return await workflow_action("reject", request)
 
 
 @app.post("/successfactors/odata/v2/commentWfRequest")
 async def comment_workflow_request(request: Request):
     """Add comment to workflow request."""
-    params = await request.json() if hasattr(request, 'json') else {}
-    return {"d": {"result": "Comment added", "status": "Success"}}
+    return await workflow_action("comment", request)
 
 
 @app.post("/successfactors/odata/v2/sendbackWfRequest")
 async def sendback_workflow_request(request: Request):
-    """Send back a workflow request."""
-    params = await request.json() if hasattr(request, 'json') else {}
-    return {"d": {"result": "Workflow sent back", "status": "Success"}}
+    """Send a workflow request back to its previous step, or to its submitter."""
+    return await workflow_action("sendback", request)
 
 
 @app.post("/successfactors/odata/v2/withdrawWfRequest")
 async def withdraw_workflow_request(request: Request):
     """Withdraw a workflow request."""
-    params = await request.json() if hasattr(request, 'json') else {}
-    return {"d": {"result": "Workflow withdrawn", "status": "Success"}}
+    return await workflow_action("withdraw", request)
 
 
 @app.post("/successfactors/odata/v2/getWorkflowPendingData")
 async def get_workflow_pending_data(request: Request):
-    """Get pending workflow data."""
-    params = await request.json() if hasattr(request, 'json') else {}
-    return {"d": {"result": {"pendingItems": [], "totalCount": 0}, "status": "Success"}}
+    """Get the data of a workflow request awaiting approval."""
+    try:
+        wf_request = workflow_request(request.query_params)
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except WorkflowError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    return json_response({"d": {"results": [WORKFLOW.pending_data(wf_request)]}})
+
+
+# Batch endpoint: parts are dispatched in-process through the router
+@app.post("/successfactors/odata/v2/$batch")
+async def batch_requests(request: Request):
+    """Execute a multipart/mixed batch of requests and changesets."""
+    try:
+        parts = parse_batch(await request.body(), request.headers.get("content-type", ""))
+    except BatchError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    
+    results = await execute_batch(app.router, request.scope, parts, SERVICE_ROOT, store_writes)
+    body, content_type = format_batch(results)
+    return Response(content=body, media_type=content_type)
+
+
+@app.post("/successfactors/odata/v2/upsert")
+async def upsert_entities(request: Request):
+    """Insert or update records by key, each naming its entity in `__metadata`, reporting the outcome of each."""
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    records = payload if isinstance(payload, list) else [payload]
+    now = datetime.now().isoformat()
+    async with store_writes():
+        results = [upsert_record(STORE, record, index, now) for index, record in enumerate(records)]
+    return json_response({"d": results})
 
 
 # Special endpoint for Position management
 @app.get("/successfactors/odata/v2/getPositionObjectData")
 async def get_position_object_data():
     """Get position object data."""
-    return {"d": {"result": MOCK_DATA.get("Position", [])}}
+    return {"d": {"result": [as_dict(row) for row in STORE.table("Position").rows]}}
+
+
+# Collection routes are registered last: routes match in order and `{entity}`
+# would otherwise also capture keyed paths and the function imports above.
+def delta_link(request: Request, token: DeltaToken) -> str:
+    """URL of the same query, unpaged, asking for the changes after a token."""
+    url = request.url.remove_query_params(["$top", "$skip", "$skiptoken", "$inlinecount", "$count"])
+    return str(url.include_query_params(**{DeltaToken.PARAM: str(token)}))
+
+
+def delta_response(entity: str, token: DeltaToken, version: int, search: Optional[SearchQuery],
+                   filter_expression: Optional[str], window: Optional[EffectiveDates], selection: Selection,
+                   expand: ExpandTree, request: Request, etag: str, cache_key: Tuple[str, str, Optional[str]],
+                   coding: Optional[str]) -> Response:
+    """Rows added or changed since a delta token, and the keys of rows deleted since.
+
+    Changed rows that no longer match the `$search` or `$filter`, or fall
+    outside the effective-date window, have left the result set, so they are
+    reported as deleted along with the rows actually removed.
+    """
+    table = STORE.table(entity)
+    changes = table.changes_since(token.version) if token.epoch == STORE.epoch else None
+    if changes is None:
+        return JSONResponse(status_code=410, content={"error": "Delta token has expired, read the entity set again"})
+    changed, deleted = changes
+    conditions: List[Callable[[Record], bool]] = []
+    if search is not None:
+        conditions.append(lambda row: matches_search(row, search))
+    if filter_expression:
+        conditions.append(compile_filter(filter_expression).evaluate)
+    dating = EFFECTIVE_DATING.get(entity)
+    if window is not None and dating is not None:
+        timeline = table.timeline(dating)
+        conditions.append(lambda row: timeline.overlaps(row, window.low, window.high))
+        # A row's period ends where the next one in its history starts, so a change can move the other
+        # rows of its history into or out of the window; they are checked again as well
+        histories = {row_key(row, dating.history) for row in (*changed, *deleted)} - {None}
+        touched = {row.seq: row for key in histories for row in timeline.history(key)}
+        touched.update((row.seq, row) for row in changed)
+        changed = [touched[seq] for seq in sorted(touched)]
+    if conditions:
+        matching = []
+        for row in changed:
+            if all(condition(row) for condition in conditions):
+                matching.append(row)
+            else:
+                deleted.append(table.tombstone(row))
+        changed = matching
+    extra = {"__deleted": deleted, "__delta": delta_link(request, DeltaToken(STORE.epoch, version))}
+    project = projector(entity, changed, selection, expand)
+    if len(changed) >= STREAM_MIN_ROWS:
+        return collection_response(changed, extra, project, headers={"ETag": etag},
+                                   cache=(RESPONSE_CACHE, cache_key), coding=coding)
+    body, sent_coding = encode_body({"d": {"results": [project(row) for row in changed], **extra}}, coding)
+    RESPONSE_CACHE.put(cache_key, body, sent_coding)
+    return coded_response(body, sent_coding, {"ETag": etag})
+
+
+@app.get("/successfactors/odata/v2/{entity}")
+async def list_entities(entity: str, request: Request):
+    """List entities of a given type, one page at a time."""
+    rows = STORE.rows(entity)
+    if not rows:
+        # Generate mock data if entity not found
+        table = STORE.table(entity)
+        async with store_writes():
+            table.insert(generate_mock_entity(entity))
+        rows = table.rows
+    
+    try:
+        paging = Paging.from_params(request.query_params)
+        selection = Selection.from_params(request.query_params)
+        expand = parse_expand(request.query_params.get("$expand"))
+        order = OrderBy.from_params(request.query_params)
+        filter_expression = request.query_params.get("$filter")
+        if filter_expression:
+            compile_filter(filter_expression)
+        delta = DeltaToken.from_params(request.query_params)
+        window = EffectiveDates.from_params(request.query_params)
+        search = SearchQuery.from_params(request.query_params)
+    except QueryOptionError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    
+    # Pages of unchanged data are answered from the client's copy or the response cache
+    version = STORE.version(entity)
+    # Expanded rows are part of the response, so their entities' versions are part of its tag
+    expanded = [STORE.version(target) for target in EXPANDER.entities(entity, expand)]
+    etag = entity_tag(STORE.epoch, version, *expanded)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    # Bodies are cached as sent, so a repeated read skips compression as well as encoding
+    coding = negotiate(request.headers.get("accept-encoding"))
+    cache_key = (str(request.url), etag, coding)
+    cached = RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return coded_response(*cached, {"ETag": etag})
+    if delta is not None:
+        return delta_response(entity, delta, version, search, filter_expression, window, selection, expand, request,
+                              etag, cache_key, coding)
+    # Expansions are joined on row sequence numbers, which only the table's rows carry, not raw seed rows
+    if expand:
+        rows = STORE.table(entity).rows
+    # $search and $filter are answered from indexes; each later narrowing only reads the rows left
+    narrowed = None
+    if search is not None:
+        narrowed = rows = STORE.table(entity).search(search)
+    if filter_expression:
+        narrowed = rows = apply_filter(STORE.table(entity), filter_expression, narrowed)
+    dating = EFFECTIVE_DATING.get(entity)
+    if window is not None and dating is not None:
+        timeline = STORE.table(entity).timeline(dating)
+        if narrowed is not None:
+            rows = [row for row in rows if timeline.overlaps(row, window.low, window.high)]
+        else:
+            rows = timeline.between(window.low, window.high)
+    
+    # Only the rows up to the end of the page are ordered, and only the page is projected
+    start, end, next_offset = paging.window(len(rows), MAX_PAGE_SIZE)
+    ordered = order.sort(rows, limit=end)
+    page = ordered[start:end]
+    extra: Dict[str, Any] = {}
+    if paging.count:
+        extra["__count"] = str(len(rows))
+    if next_offset is not None:
+        extra["__next"] = str(request.url.include_query_params(**{"$skiptoken": next_offset}))
+    else:
+        # The last page of a read hands out the token to ask for what changes after it
+        extra["__delta"] = delta_link(request, DeltaToken(STORE.epoch, version))
+    project = projector(entity, page, selection, expand)
+    if len(page) >= STREAM_MIN_ROWS:
+        return collection_response(page, extra, project, headers={"ETag": etag},
+                                   cache=(RESPONSE_CACHE, cache_key), coding=coding)
+    body, sent_coding = encode_body({"d": {"results": [project(row) for row in page], **extra}}, coding)
+    RESPONSE_CACHE.put(cache_key, body, sent_coding)
+    return coded_response(body, sent_coding, {"ETag": etag})
+
+
+@app.post("/successfactors/odata/v2/{entity}")
+async def create_entity(entity: str, request: Request):
+    """Create a new entity."""
+    payload = await request.json()
+    
+    # Add timestamps and ID if not present
+    if "id" not in payload:
+        payload["id"] = seeded_uuid(RNG)
+    if "createdDate" not in payload:
+        payload["createdDate"] = datetime.now().isoformat()
+    
+    async with store_writes():
+        STORE.table(entity).insert(payload)
+    return {"d": payload}
+
+
+@app.middleware("http")
+async def compress_responses(request: Request, call_next):
+    """Compress the responses handlers send as they are, when the client accepts a coding and they are not tiny."""
+    response = await call_next(request)
+    if "content-encoding" in response.headers or response.status_code in (204, 304):
+        return response
+    # Batch, NDJSON and metrics bodies are text as well
+    content_type = response.headers.get("content-type", "application/json")
+    if not content_type.startswith(("application/json", "multipart/", "text/", NDJSON)):
+        return response
+    response.headers["Vary"] = "Accept-Encoding"
+    coding = negotiate(request.headers.get("accept-encoding"))
+    length = response.headers.get("content-length")
+    if coding is None or (length is not None and int(length) < COMPRESS_MIN_BYTES):
+        return response
+    del response.headers["content-length"]
+    response.headers["Content-Encoding"] = coding
+    response.body_iterator = compress_stream(response.body_iterator, coding)
+    return response
+
+
+@app.middleware("http")
+async def sync_shared_store(request: Request, call_next):
+    """Bring this worker's tables up to date with the shared store before serving a request.
+
+    Handlers that write take the store's write lock themselves, around their writes only.
+    """
+    if SHARED_LOG is not None:
+        SHARED_LOG.catch_up()
+    return await call_next(request)
+
+
+def resolve_route(scope: Mapping[str, Any]) -> Dict[str, Any]:
+    """Route and path parameters the router will dispatch a request with, found ahead of it."""
+    for route in app.router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return child_scope
+    return {}
 
 
+async def released(chunks, release: Callable[[], None]):
+    """Pass a body through, calling `release` once it has been sent or abandoned."""
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        release()
+
+
+# Registered after the shared store sync, so that simulated latency is spent outside its write lock
+@app.middleware("http")
+async def throttle_requests(request: Request, call_next):
+    """Serve OData requests under the throttling profile: rate limits, concurrency caps and added latency."""
+    throttle = THROTTLE
+    if not throttle.rules or not request.url.path.startswith(SERVICE_ROOT):
+        return await call_next(request)
+    resolved = resolve_route(request.scope)
+    route = getattr(resolved.get("route"), "path", "unmatched")
+    entity = resolved.get("path_params", {}).get("entity", "")
+    rule = throttle.select(request.method, route, entity)
+    if rule is None:
+        return await call_next(request)
+    retry_after = throttle.admit(rule, entity)
+    if retry_after is not None:
+        # Rejected before routing; label the request's metrics with the route it was meant for
+        request.scope.update(resolved)
+        return JSONResponse(status_code=429, content={"error": "Too many requests"},
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+    try:
+        delay = throttle.delay(rule)
+        if delay:
+            await asyncio.sleep(delay)
+        response = await call_next(request)
+    except BaseException:
+        throttle.release(rule, entity)
+        raise
+    # A request holds its place until its body has gone out, streamed pages included
+    response.body_iterator = released(response.body_iterator, lambda: throttle.release(rule, entity))
+    return response
+
+
+# Registered last, so it wraps the other middleware and measures throttled requests, added latency
+# and the bytes actually sent
 @app.middleware("http")
-async def add_content_type_header(request: Request, call_next):
-    """Add content type header to all responses."""
+async def instrument_requests(request: Request, call_next):
+    """Add content type header to all responses, and record request metrics."""
+    started = time.perf_counter()
     response = await call_next(request)
-    response.headers["Content-Type"] = "application/json"
+    PROFILER.request_served()
+    # Batch responses carry their multipart boundary in the content type, metrics are plain text
+    if not response.headers.get("Content-Type", "").startswith(("multipart/", "text/", NDJSON)):
+        response.headers["Content-Type"] = "application/json"
+    # The router has resolved the route by now; requests it could not match share one label
+    route = request.scope.get("route")
+    length = request.headers.get("content-length")
+    response.body_iterator = METRICS.measure(
+        response.body_iterator, request.method, getattr(route, "path", "unmatched"),
+        request.path_params.get("entity", ""), response.status_code, started,
+        int(length) if length and length.isdigit() else None)
     return response
 
 
+# Store administration
+def checkpoint_target(path: Optional[str]) -> Optional[str]:
+    """File a checkpoint may be written to: MOCK_SNAPSHOT, or a file directly in MOCK_SNAPSHOT_DIR; None if neither."""
+    if not path:
+        return SNAPSHOT_PATH
+    if SNAPSHOT_DIR:
+        directory = os.path.realpath(SNAPSHOT_DIR)
+        # Resolved first, so that neither `..` nor a symbolic link leads out of the directory
+        target = os.path.realpath(os.path.join(directory, path))
+        if os.path.dirname(target) == directory:
+            return target
+    if SNAPSHOT_PATH and os.path.realpath(path) == os.path.realpath(SNAPSHOT_PATH):
+        return SNAPSHOT_PATH
+    return None
+
+
+@app.post("/admin/checkpoint")
+async def checkpoint_store(path: Optional[str] = None):
+    """Write the current contents of the store to a snapshot file."""
+    if not path and not SNAPSHOT_PATH:
+        return JSONResponse(status_code=400, content={"error": "No snapshot path given and MOCK_SNAPSHOT is not set"})
+    target = checkpoint_target(path)
+    if target is None:
+        return JSONResponse(status_code=403,
+                            content={"error": "Snapshots may only be written to MOCK_SNAPSHOT or into MOCK_SNAPSHOT_DIR"})
+    # Each entity's current rows are taken here, on the event loop; encoding and writing them, which takes
+    # seconds for a large tenant, runs in a worker thread. Checkpoints run one at a time, since two of them
+    # could share the temporary file next to their target.
+    async with CHECKPOINT_LOCK:
+        entities = [(entity, STORE.export(entity)) for entity in STORE.entities()]
+        counts = await run_in_threadpool(write_snapshot, target, entities)
+    return {"path": target, "entities": len(counts), "rows": sum(counts.values())}
+
+
+@app.post("/admin/import/{entity}")
+async def import_entities(entity: str, request: Request):
+    """Upsert an NDJSON body of one entity's records as it arrives, reporting the outcome of each as NDJSON."""
+    now = datetime.now().isoformat()
+    statuses = []
+    index = 0
+    async for record in read_ndjson(request.stream()):
+        async with store_writes():
+            status = upsert_record(STORE, record, index, now, entity)
+        statuses.append(dumps(status) + b"\n")
+        index += 1
+    return Response(content=b"".join(statuses), media_type=NDJSON)
+
+
+@app.post("/admin/profile")
+async def profile_requests(seconds: Optional[float] = None, requests: Optional[int] = None, interval_ms: float = 5.0):
+    """Sample the server's stacks for a number of seconds or requests, returning them as collapsed stacks."""
+    if seconds is None and requests is None:
+        return JSONResponse(status_code=400, content={"error": "Give the seconds or the number of requests to profile"})
+    if (seconds is not None and seconds <= 0) or (requests is not None and requests <= 0) or interval_ms <= 0:
+        return JSONResponse(status_code=400, content={"error": "seconds, requests and interval_ms must be positive"})
+    if PROFILER.running:
+        return JSONResponse(status_code=409, content={"error": "A profile is already being taken"})
+    PROFILER.start(interval_ms / 1000, requests)
+    try:
+        await PROFILER.wait(min(seconds or MAX_PROFILE_SECONDS, MAX_PROFILE_SECONDS))
+    finally:
+        samples = PROFILER.stop()
+    return Response(content=collapse(samples), media_type="text/plain")
+
+
+@app.get("/admin/throttle")
+async def get_throttle_profile():
+    """The throttling rules in force."""
+    return {"rules": THROTTLE.spec}
+
+
+@app.post("/admin/throttle")
+async def set_throttle_profile(request: Request, profile: Optional[str] = None):
+    """Replace the throttling rules with a built-in profile or a body of rules; no rules lifts throttling.
+
+    Requests already admitted finish under the rules they were admitted by.
+    """
+    global THROTTLE
+    try:
+        if profile is not None:
+            THROTTLE = Throttle.load(profile, MOCK_SEED)
+        else:
+            body = await request.body()
+            rules = rules_of(await request.json()) if body.strip() else ()
+            THROTTLE = Throttle(rules, MOCK_SEED)
+    except ThrottleError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    return {"rules": THROTTLE.spec}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Request counts, latency and payload size histograms, and store sizes, for Prometheus."""
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "supported_entities": len(MOCK_DATA)}
+    return {"status": "healthy", "supported_entities": len(STORE.entities())}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""
+Entity store shared between server processes through a SQLite change log.
+
+When uvicorn runs several workers, each worker keeps its own in-memory entity
+tables and treats them as a replica of one change log kept in a SQLite
+database in WAL mode. Every write a table makes is appended to the log, and
+before serving a request a worker applies the entries other workers logged
+since it last looked. Writers take SQLite's write lock and catch up before
+changing anything, so all workers apply the same changes in the same order.
+Readers never take the lock and are served from memory, so reads scale with
+the number of workers.
+
+The lock is held only while a handler changes the store, after it has read
+its request body, and a worker waiting for it keeps serving other requests.
+"""
+
+import asyncio
+import json
+import sqlite3
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator
+
+from store import EntityStore, EntityTable
+
+# Shortest and longest pause between attempts to take a write lock another process holds
+_MIN_WAIT = 0.001
+_MAX_WAIT = 0.05
+
+# Whether the running task holds the write lock; nested blocks in the task join its block
+_WRITING: ContextVar[bool] = ContextVar("writing", default=False)
+
+
+class SharedLog:
+    """Change log in a SQLite database that keeps an EntityStore in step with other processes."""
+
+    def __init__(self, path: str, store: EntityStore):
+        self.path = path
+        self.store = store
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        # Writes go through a connection of their own that never waits on the lock inside SQLite
+        self.writer = sqlite3.connect(path, timeout=0, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " entity TEXT NOT NULL,"
+            " op TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " payload TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS changes_by_entity ON changes (entity, id)")
+        # Workers replaying the same log produce the same table versions, so they share one epoch
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', ?)", (store.epoch,))
+        (store.epoch,) = self.connection.execute("SELECT value FROM meta WHERE name = 'epoch'").fetchone()
+        # Id of the last log entry applied to this process's tables
+        self.position = 0
+        # Serialises writing blocks within this process; SQLite serialises them across processes
+        self.lock = asyncio.Lock()
+        store.replica = self
+        self.catch_up()
+
+    def catch_up(self) -> None:
+        """Apply entries logged since this process last looked to the tables it has built."""
+        entries = self.connection.execute(
+            "SELECT id, entity, op, seq, payload FROM changes WHERE id > ? ORDER BY id", (self.position,))
+        for entry_id, entity, op, seq, payload in entries:
+            table = self.store.loaded(entity)
+            if table is not None:
+                table.apply(op, seq, _decode(payload))
+            self.position = entry_id
+
+    def replay(self, table: EntityTable) -> None:
+        """Bring a newly built table up to the current log position."""
+        entries = self.connection.execute(
+            "SELECT op, seq, payload FROM changes WHERE entity = ? AND id <= ? ORDER BY id",
+            (table.name, self.position))
+        for op, seq, payload in entries:
+            table.apply(op, seq, _decode(payload))
+
+    @asynccontextmanager
+    async def writing(self) -> AsyncIterator[None]:
+        """Hold the log's write lock, caught up, for the writes made inside the block.
+
+        Other requests of this process that write wait for as long as the
+        block lasts, so it should only await work done in-process, as a
+        `$batch` changeset does when it dispatches its requests, and never a
+        client or the network. Blocks nested in the same task join the
+        outermost one. Logged changes are committed even when the block
+        raises, since they have already been applied in memory.
+        """
+        if _WRITING.get():
+            yield
+            return
+        async with self.lock:
+            await self._begin()
+            token = _WRITING.set(True)
+            try:
+                self.catch_up()
+                yield
+            finally:
+                _WRITING.reset(token)
+                self.writer.execute("COMMIT")
+
+    async def _begin(self) -> None:
+        """Take SQLite's write lock, pausing between attempts while another process holds it."""
+        wait = _MIN_WAIT
+        while True:
+            try:
+                self.writer.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, _MAX_WAIT)
+
+    def check_writing(self) -> None:
+        """Raise unless the running task holds the write lock."""
+        if not _WRITING.get():
+            raise RuntimeError("Shared store writes must be made inside SharedLog.writing()")
+
+    def log(self, entity: str, op: str, seq: int, payload: Any) -> None:
+        """Append a change that has just been applied to this process's table."""
+        cursor = self.writer.execute(
+            "INSERT INTO changes (entity, op, seq, payload) VALUES (?, ?, ?, ?)",
+            (entity, op, seq, None if payload is None else json.dumps(payload)))
+        self.position = cursor.lastrowid
+
+
+def _decode(payload: Any) -> Any:
+    return None if payload is None else json.loads(payload)
@@ -0,0 +1,131 @@
+"""
+On-disk snapshots of the mock server's entity store.
+
+A snapshot file holds, per entity, its rows as length-prefixed JSON records
+followed by an array of record offsets, and ends with a JSON directory of the
+entities. The file is memory-mapped when opened: opening costs the same for
+any size, and a row is only decoded when it is read.
+
+Layout (integers little-endian):
+
+    magic        8 bytes  b"ECSNAP01"
+    directory    u64 offset, u64 length of the JSON directory
+    records      per row: u32 length, JSON bytes
+    offsets      per entity: u64 offset of each of its records
+    directory    {"entities": {name: {"count": n, "offsets": position}}}
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, Mapping, Sequence, Tuple, Union
+
+from responses import dumps, orjson
+
+MAGIC = b"ECSNAP01"
+_HEADER = struct.Struct("<8sQQ")
+_LENGTH = struct.Struct("<I")
+_OFFSET = struct.Struct("<Q")
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+Row = Dict[str, Any]
+
+
+class SnapshotError(ValueError):
+    """Raised when a file is not a readable snapshot."""
+
+
+class SnapshotRows(Sequence):
+    """Rows of one entity in a snapshot, decoded as they are accessed."""
+
+    def __init__(self, buffer: mmap.mmap, offsets: int, count: int):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _row(self, index: int) -> Row:
+        (position,) = _OFFSET.unpack_from(self._buffer, self._offsets + index * _OFFSET.size)
+        (length,) = _LENGTH.unpack_from(self._buffer, position)
+        start = position + _LENGTH.size
+        return _loads(self._buffer[start:start + length])
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._row(index)
+
+    def __iter__(self) -> Iterator[Row]:
+        for index in range(self._count):
+            yield self._row(index)
+
+
+class Snapshot(Mapping):
+    """A memory-mapped snapshot file, read as a mapping of entity name to rows."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            try:
+                self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"Empty snapshot file: {path}")
+        if len(self._buffer) < _HEADER.size:
+            raise SnapshotError(f"Not a snapshot file: {path}")
+        magic, directory_offset, directory_length = _HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"Not a snapshot file: {path}")
+        directory = json.loads(self._buffer[directory_offset:directory_offset + directory_length])
+        self._entities: Dict[str, SnapshotRows] = {
+            name: SnapshotRows(self._buffer, entry["offsets"], entry["count"])
+            for name, entry in directory["entities"].items()
+        }
+
+    def __getitem__(self, entity: str) -> SnapshotRows:
+        return self._entities[entity]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entities)
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+
+def write_snapshot(path: str, entities: Iterable[Tuple[str, Iterable[Row]]]) -> Dict[str, int]:
+    """Write entities and their rows to a snapshot file, returning the row count per entity.
+
+    The file is written next to `path` and moved into place once complete, so
+    a snapshot that is being read or replaced is never seen half-written.
+    """
+    temporary = f"{path}.tmp"
+    directory: Dict[str, Dict[str, int]] = {}
+    with open(temporary, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, 0, 0))
+        for name, rows in entities:
+            offsets = array("Q")
+            for row in rows:
+                encoded = dumps(row)
+                offsets.append(file.tell())
+                file.write(_LENGTH.pack(len(encoded)))
+                file.write(encoded)
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            directory[name] = {"count": len(offsets), "offsets": file.tell()}
+            file.write(offsets.tobytes())
+        encoded_directory = json.dumps({"entities": directory}).encode("utf-8")
+        directory_offset = file.tell()
+        file.write(encoded_directory)
+        file.seek(0)
+        file.write(_HEADER.pack(MAGIC, directory_offset, len(encoded_directory)))
+    os.replace(temporary, path)
+    return {name: entry["count"] for name, entry in directory.items()}
@@ -0,0 +1,843 @@
+"""
+Entity storage for the SAP SuccessFactors Employee Central mock server.
+
+Every entity table is built from the seed data dictionary and maintains hash
+indexes over its key properties, so keyed reads and writes, deletes
+included, do not have to scan the table.
+"""
+
+import uuid
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from itertools import chain, product
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+from odata import SearchQuery, SearchTerm, comparable, edm_type, effective_date, search_words
+from records import Record, RowLayout, as_dict, intern_value
+
+KeyTuple = Tuple[str, ...]
+Bucket = Union[Record, Dict[int, Record]]
+
+# Fields tried, in order, to pick a key for entities without a declared one
+FALLBACK_KEY_FIELDS = ["userId", "code", "externalCode", "id", "backgroundElementId",
+                       "wfRequestId", "positionId", "apprenticeId", "skillId", "competencyId",
+                       "roleId", "familyId", "certificationId", "profileId", "templateId"]
+
+# Stands in for a property a row does not have
+_UNSET = object()
+
+# Server-assigned identifier, indexed for every entity so created rows can be read back
+ID_FIELD = "id"
+
+
+class Transaction:
+    """Undo log of the writes made while it is active."""
+
+    def __init__(self) -> None:
+        self._undo: List[Callable[[], None]] = []
+
+    def record(self, undo: Callable[[], None]) -> None:
+        self._undo.append(undo)
+
+    def rollback(self) -> None:
+        """Undo the recorded writes, most recent first."""
+        while self._undo:
+            self._undo.pop()()
+
+    def merge(self, inner: "Transaction") -> None:
+        """Take over the undo log of a transaction committed inside this one."""
+        self._undo.extend(inner._undo)
+
+
+# Transaction of the running task; requests served concurrently each see their own
+_TRANSACTION: ContextVar[Optional[Transaction]] = ContextVar("transaction", default=None)
+
+
+@contextmanager
+def transaction() -> Iterator[Transaction]:
+    """Apply the writes made inside the block atomically: any exception rolls them all back.
+
+    A transaction nested in another commits into it, so its writes are still
+    undone if the outer block fails.
+    """
+    outer = _TRANSACTION.get()
+    txn = Transaction()
+    token = _TRANSACTION.set(txn)
+    try:
+        yield txn
+    except BaseException:
+        _TRANSACTION.reset(token)
+        txn.rollback()
+        raise
+    else:
+        _TRANSACTION.reset(token)
+        if outer is not None:
+            outer.merge(txn)
+
+
+def _record(undo: Callable[[], None]) -> None:
+    txn = _TRANSACTION.get()
+    if txn is not None:
+        txn.record(undo)
+
+
+def key_value(value: Any) -> str:
+    """Normalise a property value to the string form used in key predicates."""
+    return value if type(value) is str else intern_value(str(value))
+
+
+def row_key(row: Mapping[str, Any], fields: Sequence[str]) -> Optional[KeyTuple]:
+    """Normalised values of the given properties of a row, None if it lacks any of them."""
+    try:
+        return tuple(key_value(row[field]) for field in fields)
+    except KeyError:
+        return None
+
+
+class FieldIndex:
+    """Sorted index over one property, answering equality and range lookups."""
+
+    def __init__(self, field: str, rows: Iterable[Dict[str, Any]]):
+        self.field = field
+        entries = sorted(
+            ((comparable(row[field]), seq, row) for seq, row in rows if field in row),
+            key=lambda entry: entry[:2],
+        )
+        self._keys: List[Tuple[Tuple[int, Any], int]] = [entry[:2] for entry in entries]
+        self._rows: List[Dict[str, Any]] = [entry[2] for entry in entries]
+
+    def add(self, seq: int, row: Dict[str, Any]) -> None:
+        if self.field in row:
+            entry = (comparable(row[self.field]), seq)
+            position = bisect_right(self._keys, entry)
+            self._keys.insert(position, entry)
+            self._rows.insert(position, row)
+
+    def remove(self, seq: int, row: Dict[str, Any]) -> None:
+        if self.field in row:
+            entry = (comparable(row[self.field]), seq)
+            position = bisect_left(self._keys, entry)
+            if position < len(self._keys) and self._keys[position] == entry:
+                del self._keys[position]
+                del self._rows[position]
+
+    def range(self, low: Optional[Any] = None, high: Optional[Any] = None,
+              low_inclusive: bool = True, high_inclusive: bool = True) -> List[Tuple[int, Dict[str, Any]]]:
+        """Return (insertion sequence, row) pairs whose value lies within the bounds.
+
+        Bounds are sort keys produced by `comparable`; a range never crosses
+        into values of a different kind.
+        """
+        if low is not None:
+            start = bisect_left(self._keys, (low, -1) if low_inclusive else (low, _AFTER))
+        elif high is not None:
+            start = bisect_left(self._keys, ((high[0], _BEFORE), -1))
+        else:
+            start = 0
+        if high is not None:
+            end = bisect_left(self._keys, (high, _AFTER) if high_inclusive else (high, -1))
+        elif low is not None:
+            end = bisect_left(self._keys, ((low[0], _AFTER), -1))
+        else:
+            end = len(self._keys)
+        return [(self._keys[i][1], self._rows[i]) for i in range(start, end)]
+
+
+class _Extreme:
+    """Sentinel ordering before or after every other value."""
+
+    def __init__(self, sign: int):
+        self.sign = sign
+
+    def __lt__(self, other: Any) -> bool:
+        return self.sign < 0 and other is not self
+
+    def __gt__(self, other: Any) -> bool:
+        return self.sign > 0 and other is not self
+
+    def __eq__(self, other: Any) -> bool:
+        return other is self
+
+    def __hash__(self) -> int:
+        return self.sign
+
+
+_BEFORE = _Extreme(-1)
+_AFTER = _Extreme(1)
+
+
+class EffectiveDating:
+    """How the rows of an effective-dated entity are sliced in time.
+
+    Rows sharing the `history` properties, such as one employee's job
+    records, form one history. Each row takes effect on its `start` date and
+    stays in effect until the next row of its history starts, or until its
+    `end` date if it has one. Rows of a history starting on the same date are
+    ordered by `sequence`, and the last of them is the one in effect.
+    """
+
+    def __init__(self, start: str, history: Sequence[str], sequence: Optional[str] = None,
+                 end: Optional[str] = None):
+        self.start = start
+        self.history: Tuple[str, ...] = tuple(history)
+        self.sequence = sequence
+        self.end = end
+
+
+# A row in its history: (start date, sequence sort key, insertion sequence, row)
+_Slice = Tuple[str, Tuple[int, Any], int, Record]
+
+
+class Timeline:
+    """Interval index over an effective-dated entity: each history's rows in start order.
+
+    The row in effect on a date is found by bisecting its history, so a
+    point-in-time or date-range read costs the logarithm of the history's
+    length per history instead of a comparison of every row.
+    """
+
+    def __init__(self, dating: EffectiveDating, rows: Iterable[Record]):
+        self.dating = dating
+        self._histories: Dict[KeyTuple, List[_Slice]] = {}
+        for row in rows:
+            key = row_key(row, dating.history)
+            if key is not None:
+                self._histories.setdefault(key, []).append(self._slice(row))
+        # Insertion sequences are unique, so sorting never gets as far as comparing rows
+        for history in self._histories.values():
+            history.sort()
+
+    def _slice(self, row: Record) -> _Slice:
+        dating = self.dating
+        # Rows without a start date have been in effect from the beginning
+        start = effective_date(row.get(dating.start)) or ""
+        order = comparable(row.get(dating.sequence)) if dating.sequence else (0, 0)
+        return (start, order, row.seq, row)
+
+    def add(self, row: Record) -> None:
+        key = row_key(row, self.dating.history)
+        if key is not None:
+            history = self._histories.setdefault(key, [])
+            entry = self._slice(row)
+            history.insert(bisect_right(history, entry[:3]), entry)
+
+    def remove(self, row: Record) -> None:
+        key = row_key(row, self.dating.history)
+        history = self._histories.get(key) if key is not None else None
+        if history:
+            position = bisect_left(history, self._slice(row)[:3])
+            if position < len(history) and history[position][2] == row.seq:
+                del history[position]
+                if not history:
+                    del self._histories[key]
+
+    def _overlaps(self, history: List[_Slice], position: int, low: str, high: str) -> bool:
+        """Whether the row at a position of its history is in effect at some point from `low` to `high`."""
+        start, _, _, row = history[position]
+        # In effect up to, not including, the start of the next row
+        following = history[position + 1][0] if position + 1 < len(history) else None
+        if start > high or (following is not None and (following <= low or following == start)):
+            return False
+        if self.dating.end is not None:
+            end = effective_date(row.get(self.dating.end))
+            if end is not None and end < low:
+                return False
+        return True
+
+    def _effective(self, history: List[_Slice], low: str, high: str) -> Iterator[Record]:
+        # From the row in effect on `low` up to the last row starting by `high`
+        first = max(bisect_right(history, (low, _AFTER)) - 1, 0)
+        last = bisect_right(history, (high, _AFTER))
+        for position in range(first, last):
+            if self._overlaps(history, position, low, high):
+                yield history[position][3]
+
+    def between(self, low: str, high: str) -> List[Record]:
+        """Rows, in table order, in effect at some point from `low` to `high` (ISO dates, inclusive)."""
+        found = [row for history in self._histories.values() for row in self._effective(history, low, high)]
+        found.sort(key=lambda row: row.seq)
+        return found
+
+    def history(self, key: KeyTuple) -> List[Record]:
+        """Rows of one history, given its normalised key, in start order."""
+        return [entry[3] for entry in self._histories.get(key, ())]
+
+    def overlaps(self, row: Record, low: str, high: str) -> bool:
+        """Whether a stored row is in effect at some point from `low` to `high`."""
+        key = row_key(row, self.dating.history)
+        history = self._histories.get(key) if key is not None else None
+        if not history:
+            return False
+        position = bisect_left(history, self._slice(row)[:3])
+        return position < len(history) and history[position][2] == row.seq and self._overlaps(
+            history, position, low, high)
+
+
+class SearchIndex:
+    """Inverted index from the words of a table's string properties to the rows holding them.
+
+    Date-like strings are left out. A `$search` term is answered from the
+    postings of its words, intersected starting with the shortest, and only
+    the rows found are read, to check the order of a phrase's words.
+    """
+
+    def __init__(self, rows: Iterable[Record]):
+        self._postings: Dict[str, Bucket] = {}
+        # Sorted words for prefix terms, rebuilt on first use after a word comes or goes
+        self._vocabulary: Optional[List[str]] = None
+        for row in rows:
+            self.add(row)
+
+    @staticmethod
+    def _words(row: Record) -> Set[str]:
+        found: Set[str] = set()
+        for value in row.values():
+            if type(value) is str:
+                found.update(_indexed_words(value))
+        return found
+
+    def add(self, row: Record) -> None:
+        postings = self._postings
+        for word in self._words(row):
+            if word not in postings:
+                self._vocabulary = None
+            _bucket_add(postings, word, row)
+
+    def remove(self, row: Record) -> None:
+        postings = self._postings
+        for word in self._words(row):
+            _bucket_remove(postings, word, row)
+            if word not in postings:
+                self._vocabulary = None
+
+    def _posting(self, word: str) -> Mapping[int, Record]:
+        held = self._postings.get(word)
+        if held is None:
+            return {}
+        return held if type(held) is dict else {held.seq: held}
+
+    def _prefixed(self, prefix: str) -> Mapping[int, Record]:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        vocabulary = self._vocabulary
+        found: Dict[int, Record] = {}
+        for position in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[position].startswith(prefix):
+                break
+            found.update(self._posting(vocabulary[position]))
+        return found
+
+    def _postings_of(self, term: SearchTerm) -> List[Mapping[int, Record]]:
+        """Postings of a term's words; they are the index's own and must not be modified."""
+        postings = [self._posting(word) for word in term.words[:-1]]
+        last = term.words[-1]
+        postings.append(self._prefixed(last) if term.prefix else self._posting(last))
+        return postings
+
+    def _matching(self, term: SearchTerm) -> Mapping[int, Record]:
+        hits = _intersect(self._postings_of(term))
+        if len(term.words) == 1:
+            return hits
+        return {seq: row for seq, row in hits.items() if _has_phrase(row, term)}
+
+    def search(self, query: SearchQuery, rows: Iterable[Record]) -> List[Record]:
+        """Rows, in table order, matching a query.
+
+        The postings of all the words an alternative requires are intersected
+        first, so the order of a phrase's words is only checked on the rows
+        that hold every word. `rows` are all the table's rows; they are only
+        read for an alternative made of nothing but excluded terms.
+        """
+        found: Dict[int, Record] = {}
+        for clause in query.clauses:
+            included = [term for term in clause if not term.negated]
+            excluded = [self._matching(term) for term in clause if term.negated]
+            if included:
+                hits = _intersect([posting for term in included for posting in self._postings_of(term)])
+            else:
+                hits = {row.seq: row for row in rows}
+            phrases = [term for term in included if len(term.words) > 1]
+            if excluded or phrases:
+                hits = {seq: row for seq, row in hits.items()
+                        if not any(seq in matches for matches in excluded)
+                        and all(_has_phrase(row, term) for term in phrases)}
+            found.update(hits)
+        return [found[seq] for seq in sorted(found)]
+
+
+@lru_cache(maxsize=65536)
+def _indexed_words(value: str) -> Tuple[str, ...]:
+    """Words a string property contributes to the search index; date-like strings contribute none."""
+    return () if effective_date(value) is not None else search_words(value)
+
+
+def _intersect(postings: Sequence[Mapping[int, Record]]) -> Mapping[int, Record]:
+    """Rows present in every posting, probing the others with the shortest."""
+    ordered = sorted(postings, key=len)
+    if len(ordered) == 1:
+        return ordered[0]
+    shortest = ordered[0]
+    common = shortest.keys() & ordered[1].keys()
+    for posting in ordered[2:]:
+        common &= posting.keys()
+    return {seq: shortest[seq] for seq in common}
+
+
+def matches_search(row: Record, query: SearchQuery) -> bool:
+    """Whether a row matches a query, read from the row itself; agrees with the search index."""
+    return any(all(_has_phrase(row, term) != term.negated for term in clause) for clause in query.clauses)
+
+
+def _has_phrase(row: Record, term: SearchTerm) -> bool:
+    """Whether one of a row's string properties holds the term's words in order."""
+    words = term.words
+    size = len(words)
+    for value in row.values():
+        if type(value) is not str:
+            continue
+        found = _indexed_words(value)
+        for start in range(len(found) - size + 1):
+            if found[start:start + size - 1] == words[:-1] and (
+                    found[start + size - 1].startswith(words[-1]) if term.prefix
+                    else found[start + size - 1] == words[-1]):
+                return True
+    return False
+
+
+class EntitySchema:
+    """Property names and EDM types of an entity, learned from the rows stored in it."""
+
+    def __init__(self, name: str, key_fields: Sequence[str]):
+        self.name = name
+        self.key_fields: Tuple[str, ...] = tuple(key_fields)
+        self.fields: Dict[str, Optional[str]] = {field: None for field in self.key_fields}
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.fields
+
+    def observe(self, row: Dict[str, Any]) -> None:
+        """Record properties of a row not seen before, and types not known yet."""
+        fields = self.fields
+        for field, value in row.items():
+            if fields.get(field) is None:
+                fields[field] = edm_type(value)
+
+
+class EntityTable:
+    """Rows of a single entity type with hash indexes over its key properties.
+
+    Rows are stored as compact records (see records.py) in a dict keyed by
+    their insertion sequence, so a delete removes one entry instead of
+    rebuilding the table; the dict keeps the rows in table order. An index
+    bucket holding a single row is the row itself, and only becomes a dict
+    keyed by sequence once a second row shares the key. `rows` is a list
+    snapshot of the live rows, rebuilt on first read after a delete.
+    """
+
+    # Purges larger than this share of the table drop the field indexes instead of editing them
+    BULK_DELETE_RATIO = 0.125
+
+    # Changes kept for delta reads; older versions can no longer be read from
+    CHANGE_LOG_SIZE = 100_000
+
+    def __init__(self, name: str, rows: Iterable[Mapping[str, Any]], key_fields: Sequence[str]):
+        self.name = name
+        self.key_fields: Tuple[str, ...] = tuple(key_fields)
+        self.schema = EntitySchema(name, self.key_fields)
+        self.layout = RowLayout()
+        # Composite keys only; a single key property is looked up in its field bucket
+        self._primary: Optional[Dict[KeyTuple, Bucket]] = {} if len(self.key_fields) > 1 else None
+        self._by_field: Dict[str, Dict[str, Bucket]] = {
+            field: {} for field in (*self.key_fields, ID_FIELD)
+        }
+        self._rows: Dict[int, Record] = {}
+        self._last_seq = -1
+        self._field_indexes: Dict[str, FieldIndex] = {}
+        # Hash indexes over properties other entities join on (see `related`)
+        self._join_indexes: Dict[Tuple[str, ...], Dict[KeyTuple, Bucket]] = {}
+        # Interval indexes of effective-dated entities (see `timeline`)
+        self._timelines: Dict[EffectiveDating, Timeline] = {}
+        # Word index for $search, built on first use (see `search`)
+        self._search_index: Optional[SearchIndex] = None
+        self._snapshot: Optional[List[Record]] = None
+        # Set when a row is put back under an earlier sequence and the dict order no longer matches
+        self._reordered = False
+        # Shared change log this table's writes go through, if any (see shared.py)
+        self.replica: Optional[Any] = None
+        # Bumped by every change; rows changed since the table was built remember the version they were changed at
+        self.version = 0
+        self._row_versions: Dict[int, int] = {}
+        # Recent changes as (sequence, tombstone) pairs, one per version after `_changes_base`;
+        # the tombstone holds the key values of a removed row and is None otherwise
+        self._changes: List[Tuple[int, Optional[Dict[str, Any]]]] = []
+        self._changes_base = 0
+        for row in rows:
+            self.schema.observe(row)
+            self._add(self.layout.record(row, self._last_seq + 1))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def rows(self) -> List[Record]:
+        """Live rows in table order."""
+        if self._snapshot is None:
+            if self._reordered:
+                self._rows = {seq: self._rows[seq] for seq in sorted(self._rows)}
+                self._reordered = False
+            self._snapshot = list(self._rows.values())
+        return self._snapshot
+
+    def _primary_key(self, row: Record) -> Optional[KeyTuple]:
+        return row_key(row, self.key_fields)
+
+    def _index(self, row: Record) -> None:
+        if self._primary is not None:
+            key = self._primary_key(row)
+            if key is not None:
+                _bucket_add(self._primary, key, row)
+        for field, index in self._by_field.items():
+            value = row.get(field, _UNSET)
+            if value is not _UNSET:
+                _bucket_add(index, key_value(value), row)
+        for field_index in self._field_indexes.values():
+            field_index.add(row.seq, row)
+        for fields, join_index in self._join_indexes.items():
+            key = row_key(row, fields)
+            if key is not None:
+                _bucket_add(join_index, key, row)
+        for timeline in self._timelines.values():
+            timeline.add(row)
+        if self._search_index is not None:
+            self._search_index.add(row)
+
+    def _unindex(self, row: Record) -> None:
+        if self._primary is not None:
+            key = self._primary_key(row)
+            if key is not None:
+                _bucket_remove(self._primary, key, row)
+        for field, index in self._by_field.items():
+            value = row.get(field, _UNSET)
+            if value is not _UNSET:
+                _bucket_remove(index, key_value(value), row)
+        for field_index in self._field_indexes.values():
+            field_index.remove(row.seq, row)
+        for fields, join_index in self._join_indexes.items():
+            key = row_key(row, fields)
+            if key is not None:
+                _bucket_remove(join_index, key, row)
+        for timeline in self._timelines.values():
+            timeline.remove(row)
+        if self._search_index is not None:
+            self._search_index.remove(row)
+
+    def _add(self, row: Record) -> None:
+        seq = row.seq
+        if seq <= self._last_seq:
+            self._reordered = True
+        self._last_seq = max(self._last_seq, seq)
+        self._rows[seq] = row
+        self._index(row)
+
+    # Every write comes down to one of three changes addressed by sequence
+    # number: "add" a row, "set" properties of a row, "remove" a row. The same
+    # changes are what a shared change log records and replays.
+
+    def apply(self, op: str, seq: int, payload: Any = None) -> Optional[Record]:
+        """Apply one change to the table, returning the row it concerns."""
+        self.version += 1
+        row = self._apply(op, seq, payload)
+        self._changes.append((seq, self.tombstone(row) if op == "remove" and row is not None else None))
+        if len(self._changes) > self.CHANGE_LOG_SIZE:
+            dropped = len(self._changes) - self.CHANGE_LOG_SIZE // 2
+            del self._changes[:dropped]
+            self._changes_base += dropped
+        return row
+
+    def _apply(self, op: str, seq: int, payload: Any) -> Optional[Record]:
+        if op == "add":
+            self.schema.observe(payload)
+            if isinstance(payload, Record) and payload.seq == seq:
+                row = payload
+            else:
+                row = self.layout.record(payload, seq)
+            self._add(row)
+            self._row_versions[seq] = self.version
+            if self._snapshot is not None and not self._reordered:
+                self._snapshot.append(row)
+            else:
+                self._snapshot = None
+            return row
+        row = self._rows.get(seq)
+        if row is None:
+            return None
+        self._unindex(row)
+        if op == "set":
+            changes, removed = payload
+            self.schema.observe(changes)
+            self.layout.update(row, changes, removed)
+            self._index(row)
+            self._row_versions[seq] = self.version
+        elif op == "remove":
+            del self._rows[seq]
+            self._row_versions.pop(seq, None)
+            self._snapshot = None
+        return row
+
+    def _change(self, op: str, seq: Optional[int], payload: Any = None) -> Optional[Record]:
+        if self.replica is None:
+            return self.apply(op, self._last_seq + 1 if seq is None else seq, payload)
+        # Sequence numbers for new rows are only assigned once the log has been caught up under its lock
+        self.replica.check_writing()
+        seq = self._last_seq + 1 if seq is None else seq
+        row = self.apply(op, seq, payload)
+        self.replica.log(self.name, op, seq, as_dict(payload) if isinstance(payload, Record) else payload)
+        return row
+
+    def tombstone(self, row: Mapping[str, Any]) -> Dict[str, Any]:
+        """Key properties and server id of a row, identifying it once it has been removed."""
+        return {field: row[field] for field in self._by_field if field in row}
+
+    def changes_since(self, version: int) -> Optional[Tuple[List[Record], List[Dict[str, Any]]]]:
+        """Rows added or changed, and tombstones of rows removed, after a table version.
+
+        Returns None if the version is not one this table has been at, or if
+        its changes are no longer kept.
+        """
+        if not self._changes_base <= version <= self.version:
+            return None
+        latest: Dict[int, Optional[Dict[str, Any]]] = {}
+        for seq, tombstone in self._changes[version - self._changes_base:]:
+            latest[seq] = tombstone
+        changed = [self._rows[seq] for seq in sorted(latest) if latest[seq] is None and seq in self._rows]
+        removed = [tombstone for tombstone in latest.values() if tombstone is not None]
+        return changed, removed
+
+    def row_version(self, row: Record) -> int:
+        """Table version at which a stored row last changed, 0 if it has not changed since the table was built."""
+        return self._row_versions.get(row.seq, 0)
+
+    def insert(self, row: Mapping[str, Any]) -> Record:
+        """Append a row and index it, returning the stored record."""
+        record = self._change("add", None, row)
+        _record(lambda: self.delete([record]))
+        return record
+
+    def update(self, row: Record, changes: Dict[str, Any]) -> Record:
+        """Apply changes to a stored row, re-indexing it if key properties change."""
+        previous = {field: row[field] for field in changes if field in row}
+        added = [field for field in changes if field not in row]
+        seq = row.seq
+        self._change("set", seq, (dict(changes), []))
+        _record(lambda: self._change("set", seq, (previous, added)))
+        return row
+
+    def delete(self, rows: List[Record]) -> int:
+        """Remove the given stored rows and return how many were removed.
+
+        Each row is dropped by its sequence number; a purge of a large share
+        of the table discards the field indexes, which are rebuilt on next use.
+        """
+        if len(rows) > self.BULK_DELETE_RATIO * len(self._rows):
+            self._field_indexes.clear()
+        removed = []
+        for row in rows:
+            if self._rows.get(row.seq) is not row:
+                continue
+            self._change("remove", row.seq)
+            removed.append(row)
+        if removed:
+            _record(lambda: [self._change("add", row.seq, row) for row in removed])
+        return len(removed)
+
+    def lookup(self, fields: Sequence[str], alternatives: Sequence[Sequence[str]]) -> List[Record]:
+        """Rows whose properties `fields` match a key predicate, given the key strings each value may be stored as.
+
+        The properties are put in a fixed order, the key's own if they are
+        its key properties, so that each set of names is looked up through
+        one index, however the client ordered them.
+        """
+        order = self.key_fields if set(fields) == set(self.key_fields) else sorted(fields)
+        positions = [list(fields).index(field) for field in order]
+        for values in product(*(alternatives[position] for position in positions)):
+            rows = self.related(tuple(order), values)
+            if rows:
+                return rows
+        return []
+
+    def field_index(self, field: str) -> FieldIndex:
+        """Sorted index over a property, built on first use and maintained on every write."""
+        index = self._field_indexes.get(field)
+        if index is None:
+            index = FieldIndex(field, self._rows.items())
+            self._field_indexes[field] = index
+        return index
+
+    def related(self, fields: Tuple[str, ...], values: KeyTuple) -> List[Record]:
+        """Rows, in table order, whose properties `fields` hold the normalised `values`.
+
+        Key properties are looked up in the key indexes. Any other combination
+        of properties, such as a foreign key other entities navigate through,
+        gets a hash index of its own, built on first use and maintained on
+        every write.
+        """
+        if fields == self.key_fields and self._primary is not None:
+            held = self._primary.get(values)
+        elif len(fields) == 1 and fields[0] in self._by_field:
+            held = self._by_field[fields[0]].get(values[0])
+        else:
+            index = self._join_indexes.get(fields)
+            if index is None:
+                index = self._join_indexes[fields] = {}
+                for row in self._rows.values():
+                    key = row_key(row, fields)
+                    if key is not None:
+                        _bucket_add(index, key, row)
+            held = index.get(values)
+        if type(held) is dict:
+            return sorted(held.values(), key=lambda row: row.seq)
+        return [] if held is None else [held]
+
+    def timeline(self, dating: EffectiveDating) -> Timeline:
+        """Interval index over the rows' effective dates, built on first use and maintained on every write."""
+        timeline = self._timelines.get(dating)
+        if timeline is None:
+            timeline = self._timelines[dating] = Timeline(dating, self._rows.values())
+        return timeline
+
+    def search(self, query: SearchQuery) -> List[Record]:
+        """Rows, in table order, matching a `$search` query, from a word index built on first use and maintained on every write."""
+        if self._search_index is None:
+            self._search_index = SearchIndex(self._rows.values())
+        return self._search_index.search(query, self.rows)
+
+    def in_table_order(self, hits: Iterable[Tuple[int, Record]]) -> List[Record]:
+        """Order (insertion sequence, row) index hits the way the rows are stored."""
+        return [row for _, row in sorted(hits, key=lambda hit: hit[0])]
+
+    def find_by_value(self, value: str) -> List[Record]:
+        """Find rows whose key property or server id equals a bare key value."""
+        for field in self._by_field:
+            rows = _bucket_rows(self._by_field[field].get(value))
+            if rows:
+                return rows
+        return []
+
+
+# Index buckets: a single row, or a dict of the rows sharing a key keyed by sequence
+
+def _bucket_add(index: Dict[Any, Bucket], key: Any, row: Record) -> None:
+    held = index.get(key)
+    if held is None:
+        index[key] = row
+    elif type(held) is dict:
+        held[row.seq] = row
+    else:
+        index[key] = {held.seq: held, row.seq: row}
+
+
+def _bucket_remove(index: Dict[Any, Bucket], key: Any, row: Record) -> None:
+    held = index.get(key)
+    if held is None:
+        return
+    if type(held) is dict:
+        held.pop(row.seq, None)
+        if len(held) == 1:
+            index[key] = next(iter(held.values()))
+        elif not held:
+            del index[key]
+    elif held.seq == row.seq:
+        del index[key]
+
+
+def _bucket_rows(held: Optional[Bucket]) -> List[Record]:
+    if held is None:
+        return []
+    if type(held) is dict:
+        return list(held.values())
+    return [held]
+
+
+class EntityStore:
+    """Entity tables built lazily from the seed data dictionary.
+
+    A table is built the first time an entity is used, from its seed rows
+    plus whatever the loader supplies; from then on the table owns the rows.
+    """
+
+    def __init__(self, data: Mapping[str, Sequence[Dict[str, Any]]], entity_keys: Dict[str, Tuple[str, ...]],
+                 loader: Optional[Callable[[str], Iterable[Dict[str, Any]]]] = None):
+        self.data = data
+        self.entity_keys = entity_keys
+        # Supplies extra rows for an entity when its table is built
+        self.loader = loader
+        # Shared change log the tables write through, if any (see shared.py)
+        self.replica: Optional[Any] = None
+        # Distinguishes this store's table versions from those of an earlier process
+        self.epoch = uuid.uuid4().hex[:12]
+        self._tables: Dict[str, EntityTable] = {}
+
+    def key_fields(self, entity: str, first_row: Optional[Dict[str, Any]] = None) -> Tuple[str, ...]:
+        """Declared key properties of an entity, inferred from its first row when undeclared."""
+        if entity in self.entity_keys:
+            return self.entity_keys[entity]
+        if entity.startswith("Background_"):
+            return ("backgroundElementId", "userId")
+        for field in FALLBACK_KEY_FIELDS:
+            if field in (first_row or {}):
+                return (field,)
+        return (ID_FIELD,)
+
+    def table(self, entity: str) -> EntityTable:
+        """Return the table for an entity, creating it if needed."""
+        table = self._tables.get(entity)
+        if table is None:
+            # Rows are packed into the table one at a time, never held as a list of dicts
+            rows: Iterator[Dict[str, Any]] = iter(self.data.get(entity, []))
+            if self.loader is not None:
+                rows = chain(rows, self.loader(entity))
+            first = next(rows, None)
+            if first is not None:
+                rows = chain([first], rows)
+            table = EntityTable(entity, rows, self.key_fields(entity, first))
+            if self.replica is not None:
+                self.replica.replay(table)
+                table.replica = self.replica
+            self._tables[entity] = table
+        return table
+
+    def rows(self, entity: str) -> Sequence[Mapping[str, Any]]:
+        """Rows of an entity for reading, without building its table when the seed rows are all there is.
+
+        A seed such as a snapshot may decode rows lazily, so reading a page of
+        an untouched entity this way only decodes the rows on that page.
+        """
+        table = self._tables.get(entity)
+        if table is None and self.loader is None and self.replica is None and self.data.get(entity):
+            return self.data[entity]
+        return self.table(entity).rows
+
+    def export(self, entity: str) -> Iterable[Dict[str, Any]]:
+        """Current rows of an entity, for writing out, without building its table if unused."""
+        table = self._tables.get(entity)
+        if table is not None or self.replica is not None:
+            return map(as_dict, self.table(entity).rows)
+        rows: Iterable[Dict[str, Any]] = self.data.get(entity, [])
+        if self.loader is not None:
+            rows = chain(rows, self.loader(entity))
+        return rows
+
+    def version(self, entity: str) -> int:
+        """Version of an entity's rows, 0 while its table has not been built."""
+        table = self._tables.get(entity)
+        return 0 if table is None else table.version
+
+    def loaded(self, entity: str) -> Optional[EntityTable]:
+        """The entity's table if it has been built, without building it."""
+        return self._tables.get(entity)
+
+    def entities(self) -> List[str]:
+        """Names of the seeded entities and of every entity used since."""
+        return list(dict.fromkeys([*self.data, *self._tables]))
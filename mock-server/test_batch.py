@@ -0,0 +1,144 @@
+"""Tests for `$batch` parsing and execution."""
+
+import json
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from batch import BatchError, BatchResponse, format_batch, parse_batch
+
+ROOT = server.SERVICE_ROOT
+
+BATCH = "multipart/mixed; boundary=batch_1"
+
+
+def _body(*parts, newline="\r\n"):
+    """A batch body of request texts, and of lists of them for changesets."""
+    lines = []
+    for number, part in enumerate(parts):
+        lines.append("--batch_1")
+        if isinstance(part, list):
+            lines += [f"Content-Type: multipart/mixed; boundary=changeset_{number}", ""]
+            for request in part:
+                lines += [f"--changeset_{number}", "Content-Type: application/http", "", request]
+            lines.append(f"--changeset_{number}--")
+        else:
+            lines += ["Content-Type: application/http", "", part]
+    lines.append("--batch_1--")
+    return "\n".join(lines).replace("\n", newline).encode()
+
+
+def _request(method, url, body=None, **headers):
+    lines = [f"{method} {url} HTTP/1.1"]
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+    lines += [f"{name.replace('_', '-')}: {value}" for name, value in headers.items()]
+    return "\n".join(lines + ["", json.dumps(body) if body is not None else ""])
+
+
+# Parsing
+
+@pytest.mark.parametrize("newline", ["\r\n", "\n"])
+def test_parse_requests_and_changesets(newline):
+    body = _body(_request("GET", "EmpJob?$top=1"),
+                 [_request("POST", "EmpJob", {"userId": "EMP100"}), _request("DELETE", "EmpJob('EMP100')")],
+                 newline=newline)
+    read, changeset = parse_batch(body, BATCH)
+    assert (read.method, read.url, read.body) == ("GET", "EmpJob?$top=1", b"")
+    assert [(request.method, request.url) for request in changeset] == [("POST", "EmpJob"),
+                                                                        ("DELETE", "EmpJob('EMP100')")]
+    assert changeset[0].headers["content-type"] == "application/json"
+    assert json.loads(changeset[0].body) == {"userId": "EMP100"}
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"--batch_1--", "application/json"),
+    (b"--batch_1--", "multipart/mixed"),
+    (b"no delimiters here", BATCH),
+    (_body("GET"), BATCH),
+])
+def test_invalid_batches(body, content_type):
+    with pytest.raises(BatchError):
+        parse_batch(body, content_type)
+
+
+def test_format_nests_changeset_responses():
+    ok = BatchResponse(201, [("content-type", "application/json"), ("content-length", "99")], b"{}")
+    body, content_type = format_batch([BatchResponse(404, [], b""), [ok, ok]], boundary="out")
+    assert content_type == "multipart/mixed; boundary=out"
+    assert body.startswith(b"--out\r\n") and body.endswith(b"--out--\r\n")
+    assert _statuses(body) == [404, 201, 201]
+    assert body.count(b"Content-Length: 2\r\n") == 2 and b"99" not in body
+
+
+# Execution
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(server.app)
+
+
+def _statuses(body):
+    return [int(status) for status in re.findall(rb"^HTTP/1\.1 (\d{3}) ", body, re.M)]
+
+
+def _post(client, *parts):
+    response = client.post(f"{ROOT}/$batch", content=_body(*parts), headers={"Content-Type": BATCH})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("multipart/mixed; boundary=")
+    return response.content
+
+
+def _probes(client, name):
+    response = client.get(f"{ROOT}/BatchProbe", params={"$filter": f"name eq '{name}'"})
+    return response.json()["d"]["results"]
+
+
+def test_changeset_is_committed(client):
+    client.post(f"{ROOT}/BatchProbe", json={"probeId": 0, "name": "seed"})
+    body = _post(client, [_request("POST", "BatchProbe", {"probeId": 1, "name": "committed"}),
+                          _request("POST", f"{ROOT}/BatchProbe", {"probeId": 2, "name": "committed"})],
+                 _request("GET", "BatchProbe?$filter=name%20eq%20'committed'"))
+    assert _statuses(body) == [200, 200, 200]
+    assert sorted(row["probeId"] for row in _probes(client, "committed")) == [1, 2]
+
+
+def test_failing_changeset_rolls_back_its_earlier_requests(client):
+    client.post(f"{ROOT}/WfRequest", json={"wfRequestId": 8001, "status": "PENDING", "currentStepNum": 1,
+                                           "totalSteps": 2, "createdBy": "EMP001"})
+    client.post(f"{ROOT}/WfRequestParticipator", json={
+        "wfRequestParticipatorId": 80011, "wfRequestId": 8001, "ownerId": "EMP002", "participatorType": "APPROVER",
+        "processingOrder": 1, "status": "PENDING"})
+    body = _post(client, [_request("POST", "BatchProbe", {"probeId": 3, "name": "rolled back"}),
+                          # The workflow engine runs a transaction of its own inside the changeset's
+                          _request("POST", "approveWfRequest?wfRequestId=8001L"),
+                          _request("PUT", "BatchProbe(probeId=404)", {"name": "missing"})],
+                 _request("POST", "BatchProbe", {"probeId": 4, "name": "after"}))
+    # The failing request answers for the changeset; later parts still run
+    assert _statuses(body) == [404, 200]
+    assert _probes(client, "rolled back") == []
+    assert [row["probeId"] for row in _probes(client, "after")] == [4]
+    request = client.get(f"{ROOT}/WfRequest(8001)").json()["d"]
+    assert (request["status"], request["currentStepNum"]) == ("PENDING", 1)
+
+
+def test_changeset_may_not_read(client):
+    body = _post(client, [_request("POST", "BatchProbe", {"probeId": 5, "name": "read in changeset"}),
+                          _request("GET", "BatchProbe")])
+    assert _statuses(body) == [400]
+    assert b"Changesets may only contain modifying requests" in body
+    assert _probes(client, "read in changeset") == []
+
+
+def test_parts_are_not_compressed_inside_the_batch(client):
+    client.post(f"{ROOT}/BatchProbe", json={"probeId": 6, "name": "x" * 2000})
+    body = _post(client, _request("GET", "BatchProbe?$filter=probeId%20eq%206", Accept_Encoding="gzip"))
+    assert _statuses(body) == [200]
+    assert b"Content-Encoding" not in body and b"x" * 2000 in body
+
+
+def test_unparsable_batch(client):
+    response = client.post(f"{ROOT}/$batch", content=b"{}", headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
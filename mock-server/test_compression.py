@@ -0,0 +1,167 @@
+"""Tests for content-coding negotiation, compressed bodies and the response cache."""
+
+import gzip
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+
+import compression
+import responses
+import server
+from compression import compress, compress_chunks, negotiate
+from responses import ResponseCache, encode_body
+
+ROOT = server.SERVICE_ROOT
+
+
+# Negotiation
+
+@pytest.mark.parametrize("accept_encoding, coding", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("GZIP;q=0.5", "gzip"),
+    ("gzip;q=0", None),
+    ("deflate, gzip;q=0.1", "gzip"),
+    ("*", "gzip"),
+    ("*, gzip;q=0", None),
+    ("gzip;q=nope", None),
+])
+def test_negotiate(accept_encoding, coding):
+    assert negotiate(accept_encoding) == coding
+
+
+@pytest.mark.parametrize("accept_encoding, coding", [
+    ("gzip, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=0, *", "gzip"),
+    ("*", "br"),
+])
+def test_brotli_is_preferred_when_installed(monkeypatch, accept_encoding, coding):
+    monkeypatch.setattr(compression, "CODINGS", ("br", "gzip"))
+    assert negotiate(accept_encoding) == coding
+
+
+def test_brotli_is_not_offered_without_the_package():
+    if compression.brotli is None:
+        assert negotiate("br") is None
+    else:
+        assert negotiate("br") == "br"
+
+
+# Compressing
+
+BODY = b'{"d":{"results":[' + b",".join(b'{"userId":"EMP%03d"}' % number for number in range(200)) + b"]}}"
+
+
+def test_whole_and_chunked_bodies_decode_alike():
+    assert gzip.decompress(compress(BODY, "gzip")) == BODY
+    chunks = [BODY[start:start + 100] for start in range(0, len(BODY), 100)]
+    compressed = list(compress_chunks(chunks, "gzip"))
+    assert gzip.decompress(b"".join(compressed)) == BODY
+    # Each chunk is flushed, so what arrived so far decodes without the rest
+    partial = gzip.GzipFile(fileobj=io.BytesIO(b"".join(compressed[:3]))).read1(10 ** 6)
+    assert BODY.startswith(partial) and partial
+
+
+def test_small_bodies_are_not_compressed(monkeypatch):
+    monkeypatch.setattr(responses, "COMPRESS_MIN_BYTES", 100)
+    assert encode_body({"d": "small"}, "gzip") == (b'{"d":"small"}', None)
+    assert encode_body({"d": "x" * 100}, None) == (responses.dumps({"d": "x" * 100}), None)
+    body, coding = encode_body({"d": "x" * 100}, "gzip")
+    assert coding == "gzip" and gzip.decompress(body) == responses.dumps({"d": "x" * 100})
+
+
+# Response cache
+
+def test_cache_evicts_the_least_recently_used_bodies():
+    cache = ResponseCache(max_bytes=80)
+    for key in "abcdefgh":
+        cache.put(key, key.encode() * 10)
+    cache.put("a", b"a" * 10, "gzip")
+    assert cache.get("b") == (b"b" * 10, None)
+    cache.put("i", b"i" * 10)
+    cache.put("j", b"j" * 10)
+    assert (cache.get("c"), cache.get("d")) == (None, None)
+    assert cache.get("a") == (b"a" * 10, "gzip") and cache.get("b") is not None
+    assert cache.size == 80
+
+
+def test_cache_skips_bodies_over_an_eighth_of_the_budget():
+    cache = ResponseCache(max_bytes=80)
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None and cache.size == 0
+
+
+def test_cache_stores_streamed_bodies_once_they_are_sent_in_full():
+    cache = ResponseCache()
+    chunks = cache.tee("key", iter([b"a", b"b"]), "gzip")
+    assert next(chunks) == b"a" and cache.get("key") is None
+    assert list(chunks) == [b"b"]
+    assert cache.get("key") == (b"ab", "gzip")
+
+
+# Through the routes
+
+@pytest.fixture(scope="module")
+def client():
+    client = TestClient(server.app)
+    # Large enough to be compressed, small enough not to be streamed
+    for number in range(30):
+        client.post(f"{ROOT}/CodingProbe", json={"probeId": number, "note": f"Compressible note {number} " * 4})
+    return client
+
+
+def _get(client, accept_encoding, **params):
+    return client.get(f"{ROOT}/CodingProbe", params=params, headers={"Accept-Encoding": accept_encoding})
+
+
+def test_pages_are_sent_in_the_coding_asked_for(client):
+    plain = _get(client, "identity")
+    compressed = _get(client, "gzip, br;q=0")
+    assert "content-encoding" not in plain.headers
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == plain.headers["vary"] == "Accept-Encoding"
+    # The test client decodes the body, so both read alike
+    assert compressed.json() == plain.json()
+    assert int(compressed.headers["content-length"]) < int(plain.headers["content-length"])
+
+
+def test_small_pages_are_sent_as_they_are(client):
+    for _ in range(2):
+        response = _get(client, "gzip", **{"$top": "1", "$select": "probeId"})
+        assert "content-encoding" not in response.headers
+        assert response.json()["d"]["results"] == [{"probeId": 0}]
+
+
+def test_cached_pages_are_kept_per_coding(client):
+    params = {"$orderby": "probeId desc"}
+    first = _get(client, "gzip", **params)
+    # The plain read is not answered with the compressed body cached for gzip, nor the other way round
+    plain = _get(client, "identity", **params)
+    again = _get(client, "gzip", **params)
+    assert "content-encoding" not in plain.headers
+    assert again.headers["content-encoding"] == "gzip" and again.json() == first.json() == plain.json()
+    url = str(first.url)
+    assert server.RESPONSE_CACHE.get((url, first.headers["etag"], "gzip"))[1] == "gzip"
+    assert server.RESPONSE_CACHE.get((url, first.headers["etag"], None))[1] is None
+
+
+def test_a_write_invalidates_cached_pages(client):
+    params = {"$filter": "probeId ge 28", "$select": "probeId,note"}
+    before = _get(client, "gzip", **params)
+    client.put(f"{ROOT}/CodingProbe(probeId=29)", json={"note": "changed"})
+    after = _get(client, "gzip", **params)
+    assert after.headers["etag"] != before.headers["etag"]
+    assert [row["note"] for row in after.json()["d"]["results"]] == ["Compressible note 28 " * 4, "changed"]
+
+
+def test_other_responses_are_compressed_above_the_threshold(client, monkeypatch):
+    keyed = f"{ROOT}/CodingProbe(probeId=1)"
+    assert "content-encoding" not in client.get(keyed, headers={"Accept-Encoding": "gzip"}).headers
+    monkeypatch.setattr(server, "COMPRESS_MIN_BYTES", 10)
+    response = client.get(keyed, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["d"]["probeId"] == 1
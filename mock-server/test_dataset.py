@@ -0,0 +1,56 @@
+"""Tests for the synthetic dataset generator."""
+
+from dataset import ID_BASE, STEPS_PER_WORKFLOW, SyntheticDataset, user_id
+from store import EntityStore
+
+TEMPLATES = {"Background_Awards": [{"backgroundElementId": 1, "userId": "EMP001", "awardName": "Employee of the Month",
+                                    "awardDate": "2023-03-01", "points": 10}]}
+ENTITIES = ("EmpEmployment", "EmpJob", "Position", "WfRequest", "WfRequestParticipator", "Background_Awards")
+
+
+def _tenant(seed):
+    dataset = SyntheticDataset(40, seed, TEMPLATES)
+    return {entity: list(dataset.rows(entity)) for entity in ENTITIES}
+
+
+def test_the_same_seed_generates_the_same_rows():
+    assert _tenant(7) == _tenant(7)
+    assert _tenant(7) != _tenant(8)
+
+
+def test_rows_do_not_depend_on_what_was_generated_before():
+    dataset = SyntheticDataset(40, 7, TEMPLATES)
+    every = list(dataset.rows("EmpJob"))
+    assert list(dataset.rows("EmpJob", 30, 35)) == every[30:35]
+    assert dataset.row("EmpJob", 79) == every[-1]
+    assert list(dataset.rows("EmpJob", 78, 1000)) == every[78:]
+
+
+def test_counts_and_references():
+    tenant = _tenant(3)
+    assert [len(tenant[entity]) for entity in ENTITIES] == [40, 80, 8, 4, 4 * STEPS_PER_WORKFLOW, 40]
+    users = {row["userId"] for row in tenant["EmpEmployment"]}
+    assert {row["managerId"] for row in tenant["EmpJob"]} <= users
+    assert {row["ownerId"] for row in tenant["WfRequestParticipator"]} <= users
+    requests = {row["wfRequestId"] for row in tenant["WfRequest"]}
+    assert requests == {row["wfRequestId"] for row in tenant["WfRequestParticipator"]} == set(range(ID_BASE, ID_BASE + 4))
+    assert tenant["Background_Awards"][5]["userId"] == user_id(5)
+    assert SyntheticDataset(0).count("EmpJob") == 0
+    assert SyntheticDataset(40).count("Unknown") == 0
+
+
+def test_store_generates_an_entity_when_it_is_first_touched():
+    dataset = SyntheticDataset(40, 7, TEMPLATES)
+    generated = []
+
+    def loader(entity):
+        generated.append(entity)
+        return dataset.rows(entity)
+
+    store = EntityStore({"EmpJob": [{"seqNumber": 1, "startDate": "2020-01-01", "userId": "EMP001"}]},
+                        {"EmpJob": ("seqNumber", "startDate", "userId")}, loader=loader)
+    assert generated == []
+    table = store.table("EmpJob")
+    assert generated == ["EmpJob"]
+    assert len(table.rows) == 81
+    assert table.rows[1]["userId"] == user_id(0)
@@ -0,0 +1,118 @@
+"""Tests for $filter evaluation, checking the index-assisted paths against a plain scan."""
+
+import pytest
+
+from filters import apply_filter, compile_filter
+from odata import QueryOptionError
+from store import EntityTable
+
+ROWS = [
+    {"userId": "EMP001", "seqNumber": 1, "startDate": "2020-01-01", "jobTitle": "Engineer", "salary": 75000},
+    {"userId": "EMP002", "seqNumber": 1, "startDate": "2019-06-15", "jobTitle": "Manager", "salary": 98000.5},
+    {"userId": "EMP003", "seqNumber": 2, "startDate": "2021-03-01T00:00:00", "jobTitle": "Senior Engineer"},
+    {"userId": "EMP004", "seqNumber": 3, "startDate": "/Date(1609459200000)/", "jobTitle": None, "salary": 51000},
+    {"userId": "USR0000001", "seqNumber": 1, "startDate": "2022-12-31", "jobTitle": "engineer", "salary": 0},
+]
+
+
+@pytest.fixture
+def table():
+    return EntityTable("EmpJob", ROWS, ("seqNumber", "startDate", "userId"))
+
+
+def _scan(table, expression):
+    node = compile_filter(expression)
+    return [row for row in table.rows if node.evaluate(row)]
+
+
+def _users(rows):
+    return [row["userId"] for row in rows]
+
+
+# Each expression is answered from a sorted field index, and must agree with evaluating every row
+INDEXED = {
+    "userId eq 'EMP002'": ["EMP002"],
+    "'EMP002' eq userId": ["EMP002"],
+    "seqNumber eq 1": ["EMP001", "EMP002", "USR0000001"],
+    "seqNumber gt 1": ["EMP003", "EMP004"],
+    "seqNumber ge 2": ["EMP003", "EMP004"],
+    "seqNumber lt 2": ["EMP001", "EMP002", "USR0000001"],
+    "seqNumber le 1": ["EMP001", "EMP002", "USR0000001"],
+    "2 lt seqNumber": ["EMP004"],
+    "salary ge 75000": ["EMP001", "EMP002"],
+    "salary gt 75000.25": ["EMP002"],
+    "startDate ge datetime'2020-01-01T00:00:00'": ["EMP001", "EMP003", "EMP004", "USR0000001"],
+    "startDate eq datetime'2020-01-01T00:00:00'": ["EMP001"],
+    "startDate eq datetime'2021-01-01T00:00:00'": ["EMP004"],
+    "startDate lt datetime'2020-01-01T00:00:00'": ["EMP002"],
+    "startDate ge datetime'2020-06-01T00:00:00' and startDate lt datetime'2021-06-01T00:00:00'": ["EMP003", "EMP004"],
+    "userId eq 'EMP001' or userId eq 'EMP004'": ["EMP001", "EMP004"],
+    "seqNumber eq 1 and jobTitle eq 'Manager'": ["EMP002"],
+    "startswith(userId, 'USR')": ["USR0000001"],
+    "startswith(jobTitle, 'Eng')": ["EMP001"],
+}
+
+
+@pytest.mark.parametrize("expression, expected", INDEXED.items())
+def test_indexed_filters_match_a_scan(table, expression, expected):
+    assert compile_filter(expression).candidates(table) is not None
+    found = apply_filter(table, expression)
+    assert _users(found) == expected
+    assert found == _scan(table, expression)
+
+
+# These cannot be narrowed by an index and are evaluated on every row
+SCANNED = {
+    "userId ne 'EMP001'": ["EMP002", "EMP003", "EMP004", "USR0000001"],
+    "not (seqNumber eq 1)": ["EMP003", "EMP004"],
+    "jobTitle eq null": ["EMP004"],
+    "jobTitle ne null": ["EMP001", "EMP002", "EMP003", "USR0000001"],
+    "salary eq null": ["EMP003"],
+    "substringof('Engineer', jobTitle)": ["EMP001", "EMP003"],
+    "tolower(jobTitle) eq 'engineer'": ["EMP001", "USR0000001"],
+    "endswith(jobTitle, 'ger')": ["EMP002"],
+    "year(startDate) eq 2021": ["EMP003", "EMP004"],
+    "userId eq 'EMP001' or substringof('Senior', jobTitle)": ["EMP001", "EMP003"],
+}
+
+
+@pytest.mark.parametrize("expression, expected", SCANNED.items())
+def test_scanned_filters(table, expression, expected):
+    assert compile_filter(expression).candidates(table) is None
+    assert _users(apply_filter(table, expression)) == expected
+
+
+def test_and_narrows_with_its_indexable_side(table):
+    expression = "userId eq 'EMP003' and substringof('Senior', jobTitle)"
+    assert compile_filter(expression).candidates(table) is not None
+    assert _users(apply_filter(table, expression)) == ["EMP003"]
+
+
+def test_results_keep_table_order(table):
+    # The index yields rows in key order; the response must not
+    assert _users(apply_filter(table, "seqNumber ge 1")) == _users(table.rows)
+
+
+def test_indexes_follow_writes(table):
+    apply_filter(table, "seqNumber eq 1")
+    table.insert({"userId": "EMP005", "seqNumber": 1, "startDate": "2023-01-01"})
+    (emp002,) = apply_filter(table, "userId eq 'EMP002'")
+    table.update(emp002, {"seqNumber": 9})
+    (emp001,) = apply_filter(table, "userId eq 'EMP001'")
+    table.delete([emp001])
+    for expression in ("seqNumber eq 1", "seqNumber gt 5", "startDate ge datetime'2023-01-01T00:00:00'"):
+        assert apply_filter(table, expression) == _scan(table, expression)
+    assert _users(apply_filter(table, "seqNumber eq 1")) == ["USR0000001", "EMP005"]
+    assert _users(apply_filter(table, "seqNumber gt 5")) == ["EMP002"]
+
+
+def test_given_rows_are_filtered_instead_of_the_index(table):
+    rows = table.rows[:2]
+    assert _users(apply_filter(table, "seqNumber eq 1", rows)) == ["EMP001", "EMP002"]
+
+
+@pytest.mark.parametrize("expression", ["userId eq", "userId eq 'EMP001' and", "(userId eq 'EMP001'",
+                                        "nosuchfunction(userId)", "userId like 'EMP%'"])
+def test_invalid_filters(expression):
+    with pytest.raises(QueryOptionError):
+        compile_filter(expression)
@@ -0,0 +1,70 @@
+"""Tests for request metrics and their Prometheus text rendering."""
+
+import re
+
+from fastapi.testclient import TestClient
+
+import server
+from metrics import CONTENT_TYPE, LATENCY_BUCKETS, Metrics
+
+# A sample line of the text exposition format: name, optional labels, value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*"'
+                    r'(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*")*\})? -?[0-9.e+-]+$')
+
+
+def _samples(text):
+    """Samples of a rendered exposition, checking every line is a comment or a well-formed sample."""
+    assert text.endswith("\n")
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            assert re.match(r"^# (HELP|TYPE) [a-zA-Z_:][a-zA-Z0-9_:]* \S", line), line
+            continue
+        assert SAMPLE.match(line), line
+        name, _, value = line.rpartition(" ")
+        samples[name] = float(value)
+    return samples
+
+
+def test_histograms_are_cumulative():
+    metrics = Metrics()
+    for seconds in (0.0004, 0.003, 0.003, 20.0):
+        metrics.observe("GET", "/odata/{entity}", "EmpJob", 200, seconds, None, 1500)
+    samples = _samples(metrics.render())
+    labels = 'method="GET",route="/odata/{entity}",entity="EmpJob"'
+    assert samples[f'mock_http_requests_total{{{labels},status="200"}}'] == 4
+    buckets = [samples[f'mock_http_request_duration_seconds_bucket{{{labels},le="{bound}"}}']
+               for bound in (*LATENCY_BUCKETS, "+Inf")]
+    assert buckets[0] == 1 and buckets[LATENCY_BUCKETS.index(0.005)] == 3 and buckets[-1] == 4
+    assert buckets == sorted(buckets)
+    assert samples[f"mock_http_request_duration_seconds_count{{{labels}}}"] == 4
+    assert abs(samples[f"mock_http_request_duration_seconds_sum{{{labels}}}"] - 20.0064) < 1e-9
+    assert samples[f'mock_http_response_size_bytes_bucket{{{labels},le="1000"}}'] == 0
+    assert samples[f'mock_http_response_size_bytes_bucket{{{labels},le="10000"}}'] == 4
+    # No request had a Content-Length
+    assert not any(name.startswith("mock_http_request_size_bytes") for name in samples)
+
+
+def test_label_values_are_escaped_and_gauges_collected_on_scrape():
+    metrics = Metrics()
+    rows = {"count": 1}
+    metrics.gauge("mock_store_rows", "Rows", lambda: {(("entity", 'Odd"Name\\'),): rows["count"]})
+    rows["count"] = 7
+    text = metrics.render()
+    assert 'mock_store_rows{entity="Odd\\"Name\\\\"} 7' in text
+    assert "# TYPE mock_store_rows gauge" in text
+    _samples(text)
+
+
+def test_metrics_endpoint_labels_requests_by_route():
+    client = TestClient(server.app)
+    client.get(f"{server.SERVICE_ROOT}/MetricsProbe", params={"$top": "1"})
+    client.get(f"{server.SERVICE_ROOT}/MetricsProbe(id='none')")
+    response = client.get("/metrics")
+    assert response.headers["content-type"] == CONTENT_TYPE
+    samples = _samples(response.text)
+    route = f"{server.SERVICE_ROOT}/{{entity}}"
+    assert samples[f'mock_http_requests_total{{method="GET",route="{route}",entity="MetricsProbe",status="200"}}'] >= 1
+    assert samples[f'mock_http_requests_total{{method="GET",route="{route}({{key}})",entity="MetricsProbe",'
+                   'status="200"}'] >= 1
+    assert samples['mock_store_rows{entity="MetricsProbe"}'] == 1
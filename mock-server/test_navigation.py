@@ -0,0 +1,125 @@
+"""Tests for `$expand` over navigation properties."""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from navigation import Expander, Navigation, parse_expand
+from odata import QueryOptionError
+from snapshot import Snapshot, write_snapshot
+from store import EntityStore
+
+DATA = {
+    "EmpEmployment": [
+        {"userId": "EMP001", "startDate": "2020-01-01"},
+        {"userId": "EMP002", "startDate": "2019-06-15"},
+        {"userId": "EMP003", "startDate": "2021-03-01"},
+    ],
+    "EmpJob": [
+        {"seqNumber": 1, "startDate": "2020-01-01", "userId": "EMP001", "managerId": "EMP002"},
+        {"seqNumber": 2, "startDate": "2021-01-01", "userId": "EMP001", "managerId": "EMP003"},
+        {"seqNumber": 1, "startDate": "2019-06-15", "userId": "EMP002", "managerId": "EMP404"},
+    ],
+    "EmpBeneficiary": [{"beneficiaryId": "BEN001", "userId": "EMP001"}],
+}
+KEYS = {"EmpEmployment": ("userId",), "EmpJob": ("seqNumber", "startDate", "userId"),
+        "EmpBeneficiary": ("userId",)}
+NAVIGATIONS = {
+    "EmpEmployment": {
+        "jobInfoNav": Navigation("EmpJob", ("userId",), many=True),
+        "empBeneficiaryNav": Navigation("EmpBeneficiary", ("userId",)),
+    },
+    "EmpJob": {
+        "employmentNav": Navigation("EmpEmployment", ("userId",)),
+        "managerEmploymentNav": Navigation("EmpEmployment", ("managerId",), ("userId",)),
+    },
+}
+
+
+def test_parse_expand_nests_paths():
+    assert parse_expand("jobInfoNav/managerEmploymentNav, jobInfoNav/employmentNav,empBeneficiaryNav") == {
+        "jobInfoNav": {"managerEmploymentNav": {}, "employmentNav": {}}, "empBeneficiaryNav": {}}
+    assert parse_expand(None) == parse_expand("") == {}
+
+
+@pytest.mark.parametrize("raw", ["jobInfoNav//employmentNav", "a/b/c/d/e/f"])
+def test_invalid_expand_paths(raw):
+    with pytest.raises(QueryOptionError):
+        parse_expand(raw)
+
+
+@pytest.fixture(params=["dicts", "snapshot"])
+def store(request, tmp_path):
+    """A store seeded from plain rows, or from a snapshot whose rows are decoded as they are read."""
+    if request.param == "dicts":
+        return EntityStore(DATA, KEYS)
+    path = str(tmp_path / "tenant.snap")
+    write_snapshot(path, DATA.items())
+    return EntityStore(Snapshot(path), KEYS)
+
+
+def _expand(store, entity, raw):
+    rows = store.table(entity).rows
+    expansions = Expander(store, NAVIGATIONS).expand(entity, rows, parse_expand(raw))
+    return [expansions[row.seq] for row in rows]
+
+
+def test_to_many_and_to_one(store):
+    employments = _expand(store, "EmpEmployment", "jobInfoNav,empBeneficiaryNav,unknownNav")
+    assert [[job["seqNumber"] for job in row["jobInfoNav"]["results"]] for row in employments] == [[1, 2], [1], []]
+    assert [row["empBeneficiaryNav"] and row["empBeneficiaryNav"]["beneficiaryId"] for row in employments] == [
+        "BEN001", None, None]
+    # Navigations the mock does not model are left out rather than rejected
+    assert all(set(row) == {"jobInfoNav", "empBeneficiaryNav"} for row in employments)
+
+
+def test_nested_paths(store):
+    employments = _expand(store, "EmpEmployment", "jobInfoNav/managerEmploymentNav/jobInfoNav")
+    jobs = employments[0]["jobInfoNav"]["results"]
+    assert [job["managerEmploymentNav"]["userId"] for job in jobs] == ["EMP002", "EMP003"]
+    assert [len(job["managerEmploymentNav"]["jobInfoNav"]["results"]) for job in jobs] == [1, 0]
+    (unmanaged,) = employments[1]["jobInfoNav"]["results"]
+    assert unmanaged["managerEmploymentNav"] is None
+
+
+def test_star_expands_every_navigation(store):
+    (job, *_) = _expand(store, "EmpJob", "*")
+    assert set(job) == {"employmentNav", "managerEmploymentNav"}
+
+
+def test_expanded_entities():
+    expander = Expander(EntityStore(DATA, KEYS), NAVIGATIONS)
+    assert expander.entities("EmpEmployment", parse_expand("jobInfoNav/managerEmploymentNav,empBeneficiaryNav")) == [
+        "EmpJob", "EmpEmployment", "EmpBeneficiary"]
+
+
+# Through the routes
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+def test_nested_expand_of_a_collection(client):
+    rows = client.get(f"{server.SERVICE_ROOT}/EmpEmployment", params={
+        "$filter": "userId eq 'EMP001'", "$select": "userId", "$expand": "jobInfoNav/managerEmploymentNav"}).json()
+    (employment,) = rows["d"]["results"]
+    assert employment["userId"] == "EMP001" and "startDate" not in employment
+    (job, *_) = employment["jobInfoNav"]["results"]
+    assert job["managerEmploymentNav"]["userId"] == "EMP002"
+
+
+def test_expand_over_a_snapshot_backed_store(client, tmp_path, monkeypatch):
+    path = str(tmp_path / "tenant.snap")
+    write_snapshot(path, DATA.items())
+    store = EntityStore(Snapshot(path), server.ENTITY_KEYS)
+    monkeypatch.setattr(server, "STORE", store)
+    monkeypatch.setattr(server, "EXPANDER", Expander(store, server.NAVIGATIONS))
+    response = client.get(f"{server.SERVICE_ROOT}/EmpJob", params={"$expand": "employmentNav,managerEmploymentNav"})
+    assert response.status_code == 200
+    jobs = response.json()["d"]["results"]
+    assert [job["employmentNav"]["userId"] for job in jobs] == ["EMP001", "EMP001", "EMP002"]
+    assert [job["managerEmploymentNav"] and job["managerEmploymentNav"]["userId"] for job in jobs] == [
+        "EMP002", "EMP003", None]
+    keyed = client.get(f"{server.SERVICE_ROOT}/EmpEmployment('EMP001')", params={"$expand": "jobInfoNav"})
+    assert len(keyed.json()["d"]["jobInfoNav"]["results"]) == 2
@@ -0,0 +1,247 @@
+"""Tests for the OData query option and key predicate parsers."""
+
+import pytest
+
+from odata import (DeltaToken, EffectiveDates, OrderBy, Paging, QueryOptionError, SearchQuery, Selection,
+                   parse_key_predicate)
+
+
+# Paging
+
+@pytest.mark.parametrize("paging, total, page_size, window", [
+    (Paging(), 10, 1000, (0, 10, None)),
+    (Paging(top=3, skip=2), 10, 1000, (2, 5, None)),
+    (Paging(top=0), 10, 1000, (0, 0, None)),
+    (Paging(skip=15), 10, 1000, (10, 10, None)),
+    (Paging(top=20, skip=8), 10, 1000, (8, 10, None)),
+    # Pages are capped, the rest of the window is handed out as skip tokens
+    (Paging(), 10, 4, (0, 4, 4)),
+    (Paging(skiptoken=4), 10, 4, (4, 8, 8)),
+    (Paging(skiptoken=8), 10, 4, (8, 10, None)),
+    (Paging(top=5), 10, 2, (0, 2, 2)),
+    (Paging(top=5, skiptoken=4), 10, 2, (4, 5, None)),
+    (Paging(top=5, skip=3, skiptoken=5), 10, 2, (5, 7, 7)),
+    (Paging(skip=6, skiptoken=2), 10, 2, (6, 8, 8)),
+])
+def test_paging_window(paging, total, page_size, window):
+    assert paging.window(total, page_size) == window
+
+
+def test_paging_options():
+    paging = Paging.from_params({"$top": "20", "$skip": "40", "$skiptoken": "45", "$inlinecount": "allpages"})
+    assert (paging.top, paging.skip, paging.skiptoken, paging.count) == (20, 40, 45, True)
+    assert Paging.from_params({"$count": "true"}).count
+    assert not Paging.from_params({"$inlinecount": "none"}).count
+    assert Paging.from_params({"$top": ""}).top is None
+
+
+@pytest.mark.parametrize("name, raw", [("$top", "-1"), ("$skip", "ten"), ("$skiptoken", "1.5")])
+def test_invalid_paging_options(name, raw):
+    with pytest.raises(QueryOptionError):
+        Paging.from_params({name: raw})
+
+
+# $orderby and $select
+
+ROWS = [
+    {"userId": "EMP003", "seqNumber": 2, "startDate": "2021-03-01", "salary": 51000},
+    {"userId": "EMP001", "seqNumber": 1, "startDate": "2020-01-01", "salary": 75000},
+    {"userId": "EMP004", "seqNumber": 1, "startDate": "/Date(1546300800000)/"},
+    {"userId": "EMP002", "seqNumber": 2, "startDate": "2019-06-15T00:00:00", "salary": 75000},
+]
+
+
+def _order(text, limit=None):
+    return [row["userId"] for row in OrderBy.from_params({"$orderby": text}).sort(ROWS, limit)]
+
+
+@pytest.mark.parametrize("limit", [None, 1, 2, 3, 10])
+def test_order_by(limit):
+    expected = {
+        "userId": ["EMP001", "EMP002", "EMP003", "EMP004"],
+        "userId desc": ["EMP004", "EMP003", "EMP002", "EMP001"],
+        # Ties keep their original order, in either direction
+        "seqNumber": ["EMP001", "EMP004", "EMP003", "EMP002"],
+        "seqNumber desc": ["EMP003", "EMP002", "EMP001", "EMP004"],
+        "seqNumber desc, userId asc": ["EMP002", "EMP003", "EMP001", "EMP004"],
+        # Date strings of any form order as dates; missing values first
+        "startDate": ["EMP004", "EMP002", "EMP001", "EMP003"],
+        "salary desc,userId": ["EMP001", "EMP002", "EMP003", "EMP004"],
+    }
+    for text, users in expected.items():
+        assert _order(text, limit)[:limit] == users[:limit], text
+
+
+def test_order_by_nothing_keeps_the_rows():
+    assert OrderBy.from_params({}).sort(ROWS) is ROWS
+    assert OrderBy.from_params({}).sort(iter(ROWS), 2) == ROWS
+
+
+@pytest.mark.parametrize("text", ["userId up", "userId desc extra"])
+def test_invalid_order_by(text):
+    with pytest.raises(QueryOptionError):
+        OrderBy.from_params({"$orderby": text})
+
+
+def test_select():
+    selection = Selection.from_params({"$select": "salary, userId,salary,missing"})
+    assert selection.fields == ("salary", "userId", "missing")
+    assert selection.project(ROWS[0]) == {"salary": 51000, "userId": "EMP003"}
+    assert list(selection.project(ROWS[0])) == ["salary", "userId"]
+
+
+def test_select_everything():
+    assert Selection.from_params({}).project(ROWS[0]) == ROWS[0]
+    assert Selection.from_params({"$select": "userId,*"}).fields is None
+    assert Selection.from_params({"$select": "empInfo/jobInfoNav,userId"}).fields == ("empInfo", "userId")
+
+
+# Delta tokens
+
+def test_delta_token_round_trip():
+    token = DeltaToken.from_params({"!deltatoken": str(DeltaToken("3f2a9c1e04b7", 12))})
+    assert (token.epoch, token.version) == ("3f2a9c1e04b7", 12)
+
+
+def test_delta_token_may_be_quoted():
+    token = DeltaToken.from_params({"!deltatoken": "'3f2a9c1e04b7.15'"})
+    assert (token.epoch, token.version) == ("3f2a9c1e04b7", 15)
+
+
+def test_no_delta_token():
+    assert DeltaToken.from_params({}) is None
+
+
+@pytest.mark.parametrize("raw", ["3f2a9c1e04b7", "3f2a9c1e04b7.x", ".5", "3f2a9c1e04b7.-1", ""])
+def test_invalid_delta_tokens(raw):
+    with pytest.raises(QueryOptionError):
+        DeltaToken.from_params({"!deltatoken": raw})
+
+
+# Key predicates
+
+def test_single_string_key_is_positional():
+    predicate = parse_key_predicate("'EMP001'")
+    assert predicate.parts == ((None, "EMP001"),)
+    assert not predicate.named
+    assert predicate.alternatives == (("EMP001",),)
+
+
+def test_composite_key_with_datetime_literal():
+    predicate = parse_key_predicate("seqNumber=1,startDate=datetime'2020-01-01T00:00:00',userId='EMP001'")
+    assert predicate.named
+    assert predicate.names == ("seqNumber", "startDate", "userId")
+    assert dict(predicate.parts) == {"seqNumber": 1, "startDate": "2020-01-01T00:00:00", "userId": "EMP001"}
+    # A midnight datetime also matches a row stored with the date alone
+    assert set(predicate.alternatives[1]) == {"2020-01-01T00:00:00", "2020-01-01"}
+
+
+@pytest.mark.parametrize("text, value", [
+    ("123L", 123),
+    ("-7", -7),
+    ("1.5M", 1.5),
+    ("2d", 2.0),
+    ("true", True),
+    ("false", False),
+    ("null", None),
+    ("'O''Brien'", "O'Brien"),
+    ("'a,b'", "a,b"),
+    ("2020-01-01", "2020-01-01"),
+    ("guid'0f8fad5b-d9cb-469f-a165-70867728950e'", "0f8fad5b-d9cb-469f-a165-70867728950e"),
+])
+def test_literal_types(text, value):
+    ((name, parsed),) = parse_key_predicate(text).parts
+    assert name is None
+    assert parsed == value and type(parsed) is type(value)
+
+
+def test_whitespace_around_parts():
+    predicate = parse_key_predicate(" userId = 'EMP001' , seqNumber = 2 ")
+    assert dict(predicate.parts) == {"userId": "EMP001", "seqNumber": 2}
+
+
+def test_bind_positional_values_to_key_fields():
+    predicate = parse_key_predicate("1,'EMP001'")
+    assert predicate.bind(("seqNumber", "userId")) == {"seqNumber": 1, "userId": "EMP001"}
+    assert predicate.bind(("userId",)) is None
+
+
+def test_bind_rejects_mixed_named_and_positional():
+    assert parse_key_predicate("seqNumber=1,'EMP001'").bind(("seqNumber", "userId")) is None
+
+
+@pytest.mark.parametrize("text", ["'EMP001", "userId='EMP001'x", "a='1',", "", "a='1' b='2'"])
+def test_invalid_key_predicates(text):
+    with pytest.raises(QueryOptionError):
+        parse_key_predicate(text)
+
+
+def test_repeated_predicates_are_parsed_once():
+    assert parse_key_predicate("userId='EMP042'") is parse_key_predicate("userId='EMP042'")
+
+
+# Effective dates
+
+@pytest.mark.parametrize("params, window", [
+    ({}, None),
+    ({"asOfDate": "2022-06-01"}, ("2022-06-01", "2022-06-01")),
+    ({"asOfDate": "datetime'2022-06-01T12:00:00'"}, ("2022-06-01", "2022-06-01")),
+    ({"fromDate": "'2022-01-01'"}, ("2022-01-01", EffectiveDates.LAST)),
+    ({"toDate": "2022-12-31"}, (EffectiveDates.FIRST, "2022-12-31")),
+    ({"fromDate": "2022-01-01", "toDate": "2022-01-01"}, ("2022-01-01", "2022-01-01")),
+])
+def test_effective_dates(params, window):
+    dates = EffectiveDates.from_params(params)
+    assert (dates and (dates.low, dates.high)) == window
+
+
+@pytest.mark.parametrize("params", [
+    {"asOfDate": "yesterday"},
+    {"asOfDate": "2022-06-01", "toDate": "2022-12-31"},
+    {"fromDate": "2022-02-01", "toDate": "2022-01-01"},
+])
+def test_invalid_effective_dates(params):
+    with pytest.raises(QueryOptionError):
+        EffectiveDates.from_params(params)
+
+
+# $search
+
+def _search(text):
+    return SearchQuery.from_params({"$search": text})
+
+
+def _clauses(query):
+    return [[(term.words, term.prefix, term.negated) for term in clause] for clause in query.clauses]
+
+
+def test_no_search():
+    assert SearchQuery.from_params({}) is None
+    assert _search("   ") is None
+
+
+def test_adjacent_terms_must_all_match():
+    assert _clauses(_search("senior engineer")) == [[(("senior",), False, False), (("engineer",), False, False)]]
+    assert _clauses(_search("senior AND engineer")) == _clauses(_search("senior engineer"))
+
+
+def test_or_separates_alternatives():
+    assert _clauses(_search("Lead OR manager")) == [[(("lead",), False, False)], [(("manager",), False, False)]]
+
+
+def test_not_excludes_the_next_term():
+    assert _clauses(_search("engineer NOT senior")) == [[(("engineer",), False, False), (("senior",), False, True)]]
+    assert _clauses(_search("NOT senior")) == [[(("senior",), False, True)]]
+
+
+def test_phrases_prefixes_and_punctuation():
+    assert _clauses(_search('"computer science" math*')) == [
+        [(("computer", "science"), False, False), (("math",), True, False)]]
+    assert _clauses(_search("O'Brien")) == [[(("o", "brien"), False, False)]]
+
+
+@pytest.mark.parametrize("text", ["a AND", "a OR", "AND a", "OR a", "NOT", "a NOT", "a AND OR b", "NOT NOT a",
+                                  "a OR OR b"])
+def test_invalid_search_expressions(text):
+    with pytest.raises(QueryOptionError):
+        _search(text)
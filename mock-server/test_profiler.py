@@ -0,0 +1,90 @@
+"""Tests for the sampling profiler and the endpoint that runs it."""
+
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from profiler import UNROUTED, SamplingProfiler, collapse, sample_stack
+
+
+def test_stacks_are_tagged_with_the_endpoint_serving_them():
+    def list_entities():
+        return handler({"endpoint": list_entities})
+
+    def handler(scope):
+        return sample_stack(sys._getframe())
+
+    stack = list_entities()
+    assert stack[0] == "list_entities"
+    assert stack[-1].endswith("handler") and stack[-2].endswith("list_entities")
+    assert sample_stack(sys._getframe())[0] == UNROUTED
+
+
+def test_profiler_samples_busy_threads():
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            sum(range(100))
+
+    worker = threading.Thread(target=spin)
+    worker.start()
+    profiler = SamplingProfiler()
+    profiler.start(0.001)
+    time.sleep(0.05)
+    samples = profiler.stop()
+    stop.set()
+    worker.join()
+    assert not profiler.running
+    assert any(stack[-1].endswith("spin") for stack in samples)
+
+
+def test_collapse_puts_the_heaviest_stacks_first():
+    samples = Counter({("a", "b"): 2, ("a", "c", "d"): 5})
+    assert collapse(samples) == "a;c;d 5\na;b 2\n"
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+def test_profile_is_cut_short_at_the_longest_allowed(client, monkeypatch):
+    monkeypatch.setattr(server, "MAX_PROFILE_SECONDS", 0.1)
+    started = time.perf_counter()
+    for params in ({"seconds": "3600"}, {"requests": "1000000"}):
+        response = client.post("/admin/profile", params=params)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+    assert time.perf_counter() - started < 5
+    assert not server.PROFILER.running
+
+
+@pytest.mark.parametrize("params", [{}, {"seconds": "0"}, {"requests": "-1"}, {"seconds": "1", "interval_ms": "0"}])
+def test_invalid_profiles(client, params):
+    assert client.post("/admin/profile", params=params).status_code == 400
+
+
+def test_profile_ends_after_the_requests_asked_for():
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            profile = asyncio.create_task(client.post("/admin/profile", params={"requests": "3", "interval_ms": "1"}))
+            while not server.PROFILER.running:
+                await asyncio.sleep(0.001)
+            # A second profile cannot start while one runs; refused, it still counts as a request served
+            assert (await client.post("/admin/profile", params={"seconds": "1"})).status_code == 409
+            for _ in range(2):
+                await client.get("/health")
+            return await asyncio.wait_for(profile, 5)
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert not server.PROFILER.running
@@ -0,0 +1,45 @@
+"""Tests for response encoding, streaming and caching."""
+
+import json
+
+import pytest
+
+from responses import dumps, entity_tag, etag_matches, iter_collection
+
+ROWS = [{"userId": f"EMP{number:03}", "name": "Zoë", "seqNumber": number} for number in range(7)]
+
+
+@pytest.mark.parametrize("count, chunk_rows", [(0, 3), (1, 3), (3, 3), (7, 3), (7, 1), (7, 100)])
+def test_streamed_body_matches_the_encoded_one(count, chunk_rows):
+    extra = {"__count": str(count), "__next": "https://host/EmpJob?$skiptoken=3"}
+    chunks = list(iter_collection(ROWS[:count], extra, chunk_rows=chunk_rows))
+    body = b"".join(chunks)
+    assert body == dumps({"d": {"results": ROWS[:count], **extra}})
+    assert json.loads(body)["d"]["results"] == ROWS[:count]
+    # The envelope, one chunk per `chunk_rows` rows, the closing bracket and each extra member
+    assert len(chunks) == 1 + -(-count // chunk_rows) + 1 + len(extra) + 1
+
+
+def test_rows_are_projected_as_they_are_streamed():
+    body = b"".join(iter_collection(ROWS[:2], {}, lambda row: {"userId": row["userId"]}))
+    assert json.loads(body) == {"d": {"results": [{"userId": "EMP000"}, {"userId": "EMP001"}]}}
+
+
+# Conditional requests
+
+def test_entity_tags_are_weak():
+    assert entity_tag("3f2a9c1e04b7", 12, 0) == 'W/"3f2a9c1e04b7-12-0"'
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('W/"abc-1"', True),
+    ('"abc-1"', True),
+    ('W/"abc-2", W/"abc-1"', True),
+    ("*", True),
+    ('W/"abc-2"', False),
+    ('W/"abc-10"', False),
+    ("", False),
+    (None, False),
+])
+def test_if_none_match_compares_weakly(header, matches):
+    assert etag_matches(header, 'W/"abc-1"') is matches
@@ -1,83 +1,315 @@
-#!/usr/bin/env python3
-"""
-Test script for SAP SuccessFactors Employee Central Mock Server
+"""End-to-end tests of the OData routes through FastAPI's test client.
+
+The server keeps one store for the whole module, so each test works on
+rows of its own rather than relying on the order tests run in.
 """
 
-import requests
+import base64
 import json
-from typing import Dict, Any
-
-BASE_URL = "http://localhost:8000/successfactors/odata/v2"
-
-def test_endpoint(method: str, url: str, data: Dict[Any, Any] = None) -> None:
-    """Test an API endpoint and print the results."""
-    print(f"\n🔍 Testing {method} {url}")
-    
-    try:
-        if method == "GET":
-            response = requests.get(url)
-        elif method == "POST":
-            response = requests.post(url, json=data, headers={"Content-Type": "application/json"})
-        elif method == "PUT":
-            response = requests.put(url, json=data, headers={"Content-Type": "application/json"})
-        elif method == "DELETE":
-            response = requests.delete(url)
-        
-        print(f"✅ Status: {response.status_code}")
-        
-        if response.headers.get('content-type', '').startswith('application/json'):
-            result = response.json()
-            print(f"📄 Response: {json.dumps(result, indent=2)}")
-        else:
-            print(f"📄 Response: {response.text}")
-            
-    except Exception as e:
-        print(f"❌ Error: {e}")
-
-def main():
-    """Run comprehensive tests of the mock server."""
-    print("🚀 Starting SAP SuccessFactors Mock Server Tests")
-    
-    # Test health check
-    test_endpoint("GET", "http://localhost:8000/health")
-    
-    # Test basic entity listing
-    test_endpoint("GET", f"{BASE_URL}/EmpEmployment")
-    
-    # Test entity by single key
-    test_endpoint("GET", f"{BASE_URL}/EmpEmployment('EMP001')")
-    
-    # Test background entity with dual keys
-    test_endpoint("GET", f"{BASE_URL}/Background_Education(backgroundElementId=1,userId='EMP001')")
-    
-    # Test creating a new entity
-    test_endpoint("POST", f"{BASE_URL}/NewTestEntity", {
-        "name": "Test Employee",
-        "department": "Engineering",
-        "active": True
-    })
-    
-    # Test listing the new entity
-    test_endpoint("GET", f"{BASE_URL}/NewTestEntity")
-    
-    # Test updating an entity
-    test_endpoint("PUT", f"{BASE_URL}/EmpEmployment('EMP001')", {
-        "employmentStatus": "Updated"
-    })
-    
-    # Test workflow entities
-    test_endpoint("GET", f"{BASE_URL}/MyPendingWorkflow")
-    
-    # Test skills management entities
-    test_endpoint("GET", f"{BASE_URL}/SkillEntity")
-    
-    # Test payroll entities
-    test_endpoint("GET", f"{BASE_URL}/EmployeeTimeSheet")
-    
-    # Test position management
-    test_endpoint("GET", f"{BASE_URL}/Position")
-    
-    print("\n✅ All tests completed!")
-
-if __name__ == "__main__":
-    main()
+from itertools import count
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+ROOT = server.SERVICE_ROOT
+
+# Ids of the workflow requests tests create, clear of the seeded ones
+WF_REQUEST_IDS = count(9001)
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(server.app)
+
+
+def _auth(user):
+    return {"Authorization": "Basic " + base64.b64encode(f"{user}@ACME:secret".encode()).decode()}
+
+
+def _results(response):
+    assert response.status_code == 200, response.text
+    return response.json()["d"]["results"]
+
+
+def _follow(client, link):
+    response = client.get(link)
+    assert response.status_code == 200, response.text
+    return response.json()["d"]
+
+
+def _create(client, entity, *rows):
+    for row in rows:
+        assert client.post(f"{ROOT}/{entity}", json=row).status_code == 200
+
+
+# Paging
+
+def test_pages_follow_next_links_to_the_end_of_the_window(client, monkeypatch):
+    _create(client, "PagingProbe", *({"probeId": number} for number in range(7)))
+    monkeypatch.setattr(server, "MAX_PAGE_SIZE", 2)
+    page = client.get(f"{ROOT}/PagingProbe", params={"$top": "5", "$skip": "1", "$inlinecount": "allpages"}).json()["d"]
+    seen = []
+    while True:
+        seen += [row["probeId"] for row in page["results"]]
+        assert page["__count"] == "7"
+        if "__next" not in page:
+            break
+        assert "__delta" not in page
+        page = _follow(client, page["__next"])
+    assert seen == [1, 2, 3, 4, 5]
+    assert "__delta" in page
+
+
+def test_invalid_paging_options_are_rejected(client):
+    assert client.get(f"{ROOT}/EmpJob", params={"$top": "-1"}).status_code == 400
+
+
+# $select and $orderby
+
+def test_select_and_order_apply_before_paging(client):
+    _create(client, "OrderProbe", *({"probeId": number, "rank": number % 3, "note": "x"} for number in range(6)))
+    rows = _results(client.get(f"{ROOT}/OrderProbe", params={"$orderby": "rank desc,probeId", "$select": "probeId,rank",
+                                                              "$top": "3"}))
+    assert rows == [{"probeId": 2, "rank": 2}, {"probeId": 5, "rank": 2}, {"probeId": 1, "rank": 1}]
+
+
+def test_invalid_order_by_is_rejected(client):
+    assert client.get(f"{ROOT}/EmpJob", params={"$orderby": "userId sideways"}).status_code == 400
+
+
+# Streaming
+
+def test_streamed_pages_match_encoded_pages(client, monkeypatch):
+    _create(client, "StreamProbe", *({"probeId": number, "name": f"Probe {number}"} for number in range(5)))
+    params = {"$orderby": "probeId desc", "$inlinecount": "allpages"}
+    encoded = client.get(f"{ROOT}/StreamProbe", params=params)
+    monkeypatch.setattr(server, "STREAM_MIN_ROWS", 2)
+    # A new query string, so the page is not answered from the response cache
+    streamed = client.get(f"{ROOT}/StreamProbe", params={**params, "$skip": "0"})
+    assert "content-length" not in streamed.headers
+    assert streamed.json()["d"]["results"] == encoded.json()["d"]["results"]
+    assert streamed.json()["d"]["__count"] == "5"
+
+
+# Conditional requests
+
+def _tagged(client, url, etag=None):
+    response = client.get(url, headers={"If-None-Match": etag} if etag else {})
+    assert response.status_code in (200, 304)
+    return response.status_code, response.headers["etag"]
+
+
+def test_unchanged_collections_are_not_modified(client, monkeypatch):
+    _create(client, "EtagProbe", {"probeId": 1})
+    url = f"{ROOT}/EtagProbe?$orderby=probeId"
+    status, etag = _tagged(client, url)
+    assert status == 200 and etag.startswith('W/"')
+    assert _tagged(client, url, etag) == (304, etag)
+    assert client.get(url, headers={"If-None-Match": etag}).content == b""
+
+    _create(client, "EtagProbe", {"probeId": 2})
+    status, changed = _tagged(client, url, etag)
+    assert status == 200 and changed != etag
+    assert _tagged(client, url, changed) == (304, changed)
+
+    # Tags of another store, such as one from before a restart, never match
+    monkeypatch.setattr(server.STORE, "epoch", "0123456789ab")
+    status, restarted = _tagged(client, url, changed)
+    assert status == 200 and restarted not in (etag, changed)
+
+
+def test_an_entity_keeps_its_tag_until_it_changes(client):
+    _create(client, "EtagProbe", {"probeId": 10, "note": "first"}, {"probeId": 11, "note": "second"})
+    first = f"{ROOT}/EtagProbe(probeId=10)"
+    status, etag = _tagged(client, first)
+    assert status == 200
+    client.put(f"{ROOT}/EtagProbe(probeId=11)", json={"note": "changed"})
+    assert _tagged(client, first, etag) == (304, etag)
+    client.put(first, json={"note": "changed"})
+    status, changed = _tagged(client, first, etag)
+    assert status == 200 and changed != etag
+
+
+# Delta tokens
+
+def test_delta_reports_changes_and_deletions(client):
+    query = {"$filter": "startswith(userId, 'DLT')"}
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2022-01-01", "userId": "DLT001"})
+    read = client.get(f"{ROOT}/EmpJob", params=query).json()["d"]
+    assert [row["userId"] for row in read["results"]] == ["DLT001"]
+
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2022-01-01", "userId": "DLT002"})
+    client.put(f"{ROOT}/EmpJob(seqNumber=1,startDate='2022-01-01',userId='DLT001')", json={"jobTitle": "Tester"})
+    delta = _follow(client, read["__delta"])
+    assert sorted(row["userId"] for row in delta["results"]) == ["DLT001", "DLT002"]
+    assert delta["__deleted"] == []
+
+    client.delete(f"{ROOT}/EmpJob(seqNumber=1,startDate='2022-01-01',userId='DLT002')")
+    after = _follow(client, delta["__delta"])
+    assert after["results"] == []
+    assert [row["userId"] for row in after["__deleted"]] == ["DLT002"]
+    assert _follow(client, after["__delta"]) == {"results": [], "__deleted": [], "__delta": after["__delta"]}
+
+
+def test_delta_reports_rows_leaving_a_filter_as_deleted(client):
+    query = {"$filter": "startswith(userId, 'FLT') and jobTitle eq 'Pilot'"}
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2022-01-01", "userId": "FLT001", "jobTitle": "Pilot"})
+    read = client.get(f"{ROOT}/EmpJob", params=query).json()["d"]
+    client.put(f"{ROOT}/EmpJob(seqNumber=1,startDate='2022-01-01',userId='FLT001')", json={"jobTitle": "Captain"})
+    delta = _follow(client, read["__delta"])
+    assert delta["results"] == []
+    assert [row["userId"] for row in delta["__deleted"]] == ["FLT001"]
+
+
+def test_delta_reports_rows_leaving_a_search_as_deleted(client):
+    query = {"$search": "zebrafish", "$filter": "startswith(userId, 'SRC')"}
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2022-01-01", "userId": "SRC001",
+                                        "jobTitle": "Zebrafish Keeper"})
+    read = client.get(f"{ROOT}/EmpJob", params=query).json()["d"]
+    assert [row["userId"] for row in read["results"]] == ["SRC001"]
+
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2022-01-01", "userId": "SRC002",
+                                        "jobTitle": "Janitor"})
+    client.put(f"{ROOT}/EmpJob(seqNumber=1,startDate='2022-01-01',userId='SRC001')", json={"jobTitle": "Janitor"})
+    delta = _follow(client, read["__delta"])
+    assert delta["results"] == []
+    assert [row["userId"] for row in delta["__deleted"]] == ["SRC001", "SRC002"]
+
+
+def test_delta_keeps_the_effective_date_window(client):
+    query = {"asOfDate": "2022-06-01", "$filter": "startswith(userId, 'WIN')"}
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2022-01-01", "userId": "WIN001"})
+    read = client.get(f"{ROOT}/EmpJob", params=query).json()["d"]
+    assert [row["startDate"] for row in read["results"]] == ["2022-01-01"]
+
+    # The new record takes effect before the date asked for, ending the first one's period ahead of it
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2022-03-01", "userId": "WIN001"})
+    delta = _follow(client, read["__delta"])
+    assert [row["startDate"] for row in delta["results"]] == ["2022-03-01"]
+    assert [row["startDate"] for row in delta["__deleted"]] == ["2022-01-01"]
+
+
+def test_date_range_reads_every_record_in_effect_during_it(client):
+    _create(client, "EmpJob", *({"seqNumber": 1, "startDate": start, "userId": "WIN002"}
+                                for start in ("2022-01-01", "2022-03-01", "2022-09-01")))
+    query = {"fromDate": "2022-02-01", "toDate": "2022-04-01", "$filter": "userId eq 'WIN002'"}
+    assert [row["startDate"] for row in _results(client.get(f"{ROOT}/EmpJob", params=query))] == [
+        "2022-01-01", "2022-03-01"]
+    query = {"asOfDate": "2022-02-28", "$filter": "userId eq 'WIN002'"}
+    assert [row["startDate"] for row in _results(client.get(f"{ROOT}/EmpJob", params=query))] == ["2022-01-01"]
+
+
+@pytest.mark.parametrize("token", ["000000000000.0", "{epoch}.999999999"])
+def test_delta_tokens_this_store_cannot_answer_have_expired(client, token):
+    response = client.get(f"{ROOT}/EmpJob", params={"!deltatoken": token.format(epoch=server.STORE.epoch)})
+    assert response.status_code == 410
+
+
+def test_invalid_delta_token(client):
+    assert client.get(f"{ROOT}/EmpJob", params={"!deltatoken": "not-a-token"}).status_code == 400
+
+
+# $search
+
+def test_search_matches_words_phrases_and_prefixes(client):
+    _create(client, "SearchProbe", {"probeId": 1, "title": "Senior Software Engineer"},
+            {"probeId": 2, "title": "Software Architect"}, {"probeId": 3, "title": "Engineering Manager"})
+
+    def search(text):
+        return [row["probeId"] for row in _results(client.get(f"{ROOT}/SearchProbe", params={"$search": text}))]
+
+    assert search("software") == [1, 2]
+    assert search('"senior software"') == [1]
+    assert search("engineer*") == [1, 3]
+    assert search("software NOT senior") == [2]
+    assert search("architect OR manager") == [2, 3]
+    assert client.get(f"{ROOT}/SearchProbe", params={"$search": "software AND"}).status_code == 400
+
+
+# Keyed reads
+
+def test_get_by_datetime_key_finds_a_date_only_row(client):
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2020-01-01", "userId": "KEY001", "jobTitle": "Keeper"})
+    response = client.get(f"{ROOT}/EmpJob(seqNumber=1,startDate=datetime'2020-01-01T00:00:00',userId='KEY001')")
+    assert response.status_code == 200
+    assert response.json()["d"]["jobTitle"] == "Keeper"
+    assert client.get(f"{ROOT}/EmpJob(1,datetime'2020-01-01T00:00:00','KEY001')").status_code == 200
+
+
+def test_get_with_an_invalid_key_predicate(client):
+    assert client.get(f"{ROOT}/EmpJob(userId='EMP001)").status_code == 400
+
+
+# Upserts
+
+def test_upsert_by_datetime_key_updates_the_stored_row(client):
+    _create(client, "EmpJob", {"seqNumber": 1, "startDate": "2021-02-01", "userId": "UPS001", "jobTitle": "Analyst"})
+    uri = f"{ROOT}/EmpJob(seqNumber=1,startDate=datetime'2021-02-01T00:00:00',userId='UPS001')"
+    response = client.post(f"{ROOT}/upsert", json={"__metadata": {"uri": uri}, "jobTitle": "Lead Analyst"})
+    (result,) = response.json()["d"]
+    assert (result["status"], result["editStatus"]) == ("OK", "UPDATED")
+    rows = _results(client.get(f"{ROOT}/EmpJob", params={"$filter": "userId eq 'UPS001'"}))
+    # The row keeps the key value it was stored with
+    assert [(row["startDate"], row["jobTitle"]) for row in rows] == [("2021-02-01", "Lead Analyst")]
+
+
+def test_import_reports_each_line(client):
+    lines = [{"id": 1, "name": "first"}, {"id": 1, "name": "first"}, {"id": 1, "name": "again"}, {"name": "no key"}]
+    body = "\n".join(map(json.dumps, lines)) + "\n{not json\n"
+    response = client.post("/admin/import/ImportProbe", content=body.encode())
+    statuses = [json.loads(line) for line in response.text.splitlines()]
+    assert [(status["index"], status["editStatus"], status["httpCode"]) for status in statuses] == [
+        (0, "INSERTED", 201), (1, "UNCHANGED", 200), (2, "UPDATED", 200), (3, None, 400), (4, None, 400)]
+    assert statuses[0]["key"] == "ImportProbe(id=1)"
+    assert [row["name"] for row in _results(client.get(f"{ROOT}/ImportProbe"))] == ["again"]
+
+
+# Workflow function imports
+
+@pytest.fixture
+def wf_request(client):
+    """A new two-step request from EMP001, approved by EMP002 and then EMP003."""
+    number = next(WF_REQUEST_IDS)
+    client.post(f"{ROOT}/WfRequest", json={"wfRequestId": number, "status": "PENDING", "currentStepNum": 1,
+                                           "totalSteps": 2, "createdBy": "EMP001"})
+    for step, owner, status in ((1, "EMP002", "PENDING"), (2, "EMP003", "WAITING")):
+        client.post(f"{ROOT}/WfRequestParticipator", json={
+            "wfRequestParticipatorId": number * 10 + step, "wfRequestId": number, "ownerId": owner,
+            "participatorType": "APPROVER", "processingOrder": step, "status": status})
+    return number
+
+
+def _action(client, action, number, user, **params):
+    return client.post(f"{ROOT}/{action}", params={"wfRequestId": f"{number}L", **params}, headers=_auth(user))
+
+
+def test_workflow_actions_read_the_query_string(client, wf_request):
+    assert client.post(f"{ROOT}/approveWfRequest", headers=_auth("EMP002")).status_code == 400
+
+    response = _action(client, "approveWfRequest", wf_request, "EMP002", comment="'Fine by me'")
+    assert response.status_code == 200
+    comments = _results(client.get(f"{ROOT}/WfRequestComments", params={"$filter": f"wfRequestId eq {wf_request}"}))
+    assert [row["comment"] for row in comments] == ["Fine by me"]
+
+    assert client.get(f"{ROOT}/MyPendingWorkflow({wf_request}L)", headers=_auth("EMP002")).status_code == 404
+    assert client.get(f"{ROOT}/MyPendingWorkflow({wf_request}L)", headers=_auth("EMP003")).status_code == 200
+    assert _action(client, "approveWfRequest", wf_request, "EMP003").status_code == 200
+    request = client.get(f"{ROOT}/WfRequest({wf_request})").json()["d"]
+    assert request["status"] == "COMPLETED"
+
+
+def test_workflow_action_errors(client, wf_request):
+    assert _action(client, "approveWfRequest", wf_request, "EMP003").status_code == 403
+    assert _action(client, "withdrawWfRequest", wf_request, "EMP002").status_code == 403
+    assert _action(client, "rejectWfRequest", wf_request, "EMP002").status_code == 200
+    assert _action(client, "approveWfRequest", wf_request, "EMP002").status_code == 409
+    assert _action(client, "approveWfRequest", 404, "EMP002").status_code == 404
+
+
+def test_seeded_workflow_rows_join_to_their_request(client):
+    response = client.get(f"{ROOT}/WfRequest(1)", params={"$expand": "wfRequestParticipatorNav,wfRequestCommentsNav"})
+    request = response.json()["d"]
+    assert [row["ownerId"] for row in request["wfRequestParticipatorNav"]["results"]] == ["EMP002", "EMP003"]
+    assert [row["comment"] for row in request["wfRequestCommentsNav"]["results"]][:1] == ["Please review"]
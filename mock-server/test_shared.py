@@ -0,0 +1,128 @@
+"""Tests for keeping stores of several processes in step through a shared SQLite log."""
+
+import asyncio
+
+import pytest
+
+from shared import SharedLog
+from store import EntityStore, transaction
+
+KEYS = {"EmpJob": ("seqNumber", "startDate", "userId")}
+
+
+def _store():
+    return EntityStore({"EmpJob": [{"seqNumber": 1, "startDate": "2020-01-01", "userId": "EMP001",
+                                    "jobTitle": "Engineer"}]}, KEYS)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two stores sharing one log, as two uvicorn workers would."""
+    path = str(tmp_path / "store.db")
+    first, second = _store(), _store()
+    return SharedLog(path, first), SharedLog(path, second)
+
+
+def _titles(log):
+    log.catch_up()
+    return sorted((row["userId"], row.get("jobTitle")) for row in log.store.table("EmpJob").rows)
+
+
+def test_workers_share_one_epoch(workers):
+    first, second = workers
+    assert first.store.epoch == second.store.epoch
+
+
+def test_writes_reach_the_other_worker(workers):
+    first, second = workers
+    second.store.table("EmpJob")
+
+    async def write():
+        table = first.store.table("EmpJob")
+        async with first.writing():
+            table.insert({"seqNumber": 1, "startDate": "2021-01-01", "userId": "EMP002", "jobTitle": "Analyst"})
+            (row,) = table.lookup(("userId",), (("EMP001",),))
+            table.update(row, {"jobTitle": "Lead"})
+        async with first.writing():
+            table.delete(table.lookup(("userId",), (("EMP002",),)))
+        async with first.writing():
+            table.insert({"seqNumber": 1, "startDate": "2022-01-01", "userId": "EMP003"})
+
+    asyncio.run(write())
+    assert _titles(second) == [("EMP001", "Lead"), ("EMP003", None)]
+    assert second.store.table("EmpJob").version == first.store.table("EmpJob").version
+
+
+def test_tables_built_later_replay_the_log(workers):
+    first, second = workers
+
+    async def write():
+        async with first.writing():
+            first.store.table("EmpJob").insert({"seqNumber": 1, "startDate": "2021-01-01", "userId": "EMP002"})
+
+    asyncio.run(write())
+    second.catch_up()
+    assert _titles(second) == [("EMP001", "Engineer"), ("EMP002", None)]
+
+
+def test_a_rolled_back_write_is_undone_on_the_other_worker(workers):
+    first, second = workers
+    second.store.table("EmpJob")
+
+    async def write():
+        table = first.store.table("EmpJob")
+        async with first.writing():
+            with pytest.raises(RuntimeError):
+                with transaction():
+                    table.insert({"seqNumber": 1, "startDate": "2021-01-01", "userId": "EMP002"})
+                    table.update(table.rows[0], {"jobTitle": "Lead"})
+                    raise RuntimeError
+
+    asyncio.run(write())
+    assert _titles(first) == _titles(second) == [("EMP001", "Engineer")]
+
+
+def test_writers_take_turns_and_catch_up_first(workers):
+    first, second = workers
+    events = []
+
+    async def hold():
+        async with first.writing():
+            events.append("first in")
+            first.store.table("EmpJob").insert({"seqNumber": 1, "startDate": "2021-01-01", "userId": "EMP002"})
+            await asyncio.sleep(0.05)
+            events.append("first out")
+
+    async def wait():
+        await asyncio.sleep(0.01)
+        async with second.writing():
+            events.append("second in")
+            # The other worker's write was applied before this block began
+            assert len(second.store.table("EmpJob").rows) == 2
+
+    async def both():
+        await asyncio.gather(hold(), wait())
+
+    asyncio.run(both())
+    assert events == ["first in", "first out", "second in"]
+
+
+def test_writes_outside_a_writing_block_are_refused(workers):
+    first, _ = workers
+    with pytest.raises(RuntimeError):
+        first.store.table("EmpJob").insert({"seqNumber": 1, "startDate": "2021-01-01", "userId": "EMP002"})
+
+
+def test_nested_blocks_join_the_outer_one(workers):
+    first, second = workers
+
+    async def write():
+        async with first.writing():
+            async with first.writing():
+                first.store.table("EmpJob").insert({"seqNumber": 1, "startDate": "2021-01-01", "userId": "EMP002"})
+            # Still holding the lock: the other worker cannot write yet
+            with pytest.raises(Exception, match="locked"):
+                second.writer.execute("BEGIN IMMEDIATE")
+
+    asyncio.run(write())
+    assert len(_titles(second)) == 2
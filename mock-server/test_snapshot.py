@@ -0,0 +1,157 @@
+"""Tests for store snapshots: writing, lazy reading, checkpoints and restoring a server from one."""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+import snapshot
+from snapshot import Snapshot, SnapshotError, write_snapshot
+from store import EntityStore
+
+ROOT = server.SERVICE_ROOT
+
+ENTITIES = {
+    "EmpJob": [{"seqNumber": 1, "startDate": "2020-01-01", "userId": f"EMP{number:03}", "jobTitle": "Zoë",
+                "salary": 75000.5, "active": True, "managerId": None} for number in range(50)],
+    "Empty": [],
+    "Position": [{"positionId": "POS001", "tags": ["a", "b"], "detail": {"level": 3}}],
+}
+KEYS = {"EmpJob": ("seqNumber", "startDate", "userId"), "Position": ("positionId",)}
+
+
+@pytest.fixture
+def path(tmp_path):
+    target = str(tmp_path / "tenant.snap")
+    assert write_snapshot(target, ENTITIES.items()) == {"EmpJob": 50, "Empty": 0, "Position": 1}
+    return target
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    """Count the records decoded from snapshots."""
+    calls = []
+    loads = snapshot._loads
+    monkeypatch.setattr(snapshot, "_loads", lambda data: calls.append(1) or loads(data))
+    return calls
+
+
+def test_round_trip(path):
+    restored = Snapshot(path)
+    assert list(restored) == list(ENTITIES)
+    assert {name: list(rows) for name, rows in restored.items()} == ENTITIES
+    rows = restored["EmpJob"]
+    assert (len(rows), rows[-1], rows[3:5]) == (50, ENTITIES["EmpJob"][-1], ENTITIES["EmpJob"][3:5])
+    with pytest.raises(IndexError):
+        rows[50]
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_rows_are_decoded_as_they_are_read(path, decoded):
+    rows = Snapshot(path)["EmpJob"]
+    assert decoded == []
+    assert rows[10]["userId"] == "EMP010"
+    assert rows[20:23][0]["userId"] == "EMP020"
+    assert len(decoded) == 4
+
+
+def test_store_reads_an_untouched_entity_without_building_it(path, decoded):
+    store = EntityStore(Snapshot(path), KEYS)
+    page = store.rows("EmpJob")[:5]
+    assert [row["userId"] for row in page] == ["EMP000", "EMP001", "EMP002", "EMP003", "EMP004"]
+    assert store.loaded("EmpJob") is None and len(decoded) == 5
+    (row,) = store.table("EmpJob").lookup(("userId",), (("EMP042",),))
+    assert row["jobTitle"] == "Zoë"
+
+
+def test_rewriting_replaces_the_file(path):
+    write_snapshot(path, [("EmpJob", ENTITIES["EmpJob"][:2])])
+    assert {name: len(rows) for name, rows in Snapshot(path).items()} == {"EmpJob": 2}
+
+
+@pytest.mark.parametrize("content", [b"", b"ECSNAP", b"NOTASNAP" + bytes(16)])
+def test_other_files_are_not_snapshots(tmp_path, content):
+    other = tmp_path / "other"
+    other.write_bytes(content)
+    with pytest.raises(SnapshotError):
+        Snapshot(str(other))
+
+
+# Checkpoints
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def snapshots(tmp_path, monkeypatch):
+    directory = tmp_path / "snapshots"
+    directory.mkdir()
+    monkeypatch.setattr(server, "SNAPSHOT_DIR", str(directory))
+    monkeypatch.setattr(server, "SNAPSHOT_PATH", str(tmp_path / "default.snap"))
+    return directory
+
+
+def test_checkpoint_writes_to_mock_snapshot_by_default(client, snapshots):
+    response = client.post("/admin/checkpoint")
+    assert response.status_code == 200
+    assert response.json()["path"] == server.SNAPSHOT_PATH
+    assert response.json()["rows"] == sum(len(rows) for rows in Snapshot(server.SNAPSHOT_PATH).values())
+
+
+def test_checkpoint_writes_into_the_snapshot_directory(client, snapshots):
+    response = client.post("/admin/checkpoint", params={"path": "nightly.snap"})
+    assert response.status_code == 200
+    assert response.json()["path"] == str(snapshots / "nightly.snap")
+    assert "EmpJob" in Snapshot(str(snapshots / "nightly.snap"))
+
+
+@pytest.mark.parametrize("target", ["../escaped.snap", "/tmp/elsewhere.snap", "sub/dir.snap", "."])
+def test_checkpoint_refuses_other_targets(client, snapshots, target):
+    assert client.post("/admin/checkpoint", params={"path": target}).status_code == 403
+    assert not os.path.exists(snapshots.parent / "escaped.snap")
+
+
+def test_checkpoint_refuses_links_out_of_the_snapshot_directory(client, snapshots):
+    (snapshots / "link.snap").symlink_to(snapshots.parent / "escaped.snap")
+    assert client.post("/admin/checkpoint", params={"path": "link.snap"}).status_code == 403
+    assert not os.path.exists(snapshots.parent / "escaped.snap")
+
+
+def test_checkpoint_without_a_directory_only_writes_mock_snapshot(client, snapshots, monkeypatch):
+    monkeypatch.setattr(server, "SNAPSHOT_DIR", None)
+    assert client.post("/admin/checkpoint", params={"path": str(snapshots / "x.snap")}).status_code == 403
+    assert client.post("/admin/checkpoint", params={"path": server.SNAPSHOT_PATH}).status_code == 200
+    monkeypatch.setattr(server, "SNAPSHOT_PATH", None)
+    assert client.post("/admin/checkpoint").status_code == 400
+
+
+# A server started on the checkpoint, in a process of its own since the store is set up at import
+RESTORE = f"""
+import json
+from fastapi.testclient import TestClient
+import server
+client = TestClient(server.app)
+print(json.dumps({{
+    "lazy": type(server.STORE.data).__name__,
+    "probe": client.get("{ROOT}/SnapshotProbe('probe-1')").json()["d"],
+    "jobs": len(client.get("{ROOT}/EmpJob").json()["d"]["results"]),
+}}))
+"""
+
+
+def test_server_restores_from_a_checkpoint(client, snapshots):
+    client.post(f"{ROOT}/SnapshotProbe", json={"id": "probe-1", "note": "written before the checkpoint"})
+    assert client.post("/admin/checkpoint").status_code == 200
+    env = dict(os.environ, MOCK_SNAPSHOT=server.SNAPSHOT_PATH)
+    result = subprocess.run([sys.executable, "-c", RESTORE], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(server.__file__)), check=True)
+    restored = json.loads(result.stdout.splitlines()[-1])
+    assert restored["lazy"] == "Snapshot"
+    assert restored["probe"]["note"] == "written before the checkpoint"
+    assert restored["jobs"] == len(server.STORE.rows("EmpJob"))
@@ -0,0 +1,193 @@
+"""Tests for throttling profiles: token buckets, concurrency caps, latency and the routes they guard."""
+
+import asyncio
+import json
+import random
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from throttling import PROFILES, Latency, Rule, Throttle, ThrottleError, TokenBucket, rules_of
+
+ROOT = server.SERVICE_ROOT
+
+
+class Clock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# Token buckets and rules
+
+def test_bucket_allows_a_burst_then_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, capacity=3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(0.0) == pytest.approx(0.5)
+    assert bucket.take(0.25) == pytest.approx(0.25)
+    assert bucket.take(0.5) == 0.0
+    # Idle time refills no more than the capacity
+    assert [bucket.take(100.0) for _ in range(4)][-1] == pytest.approx(0.5)
+
+
+def test_requests_follow_the_first_rule_that_selects_them():
+    throttle = Throttle([{"method": "get", "route": "*/$batch"}, {"entity": "Background_*"}, {"method": "POST"}])
+    assert throttle.select("GET", "/odata/$batch", "") == 0
+    assert throttle.select("GET", "/odata/{entity}", "Background_Awards") == 1
+    assert throttle.select("POST", "/odata/{entity}", "Background_Awards") == 1
+    assert throttle.select("POST", "/odata/{entity}", "EmpJob") == 2
+    assert throttle.select("GET", "/odata/{entity}", "EmpJob") is None
+
+
+def test_rate_limits_are_counted_per_rule_and_entity():
+    clock = Clock()
+    throttle = Throttle([{"entity": "*", "rate": 4, "burst": 2}], clock=clock)
+    assert [throttle.admit(0, "EmpJob") for _ in range(2)] == [None, None]
+    assert throttle.admit(0, "EmpJob") == pytest.approx(0.25)
+    assert throttle.admit(0, "EmpEmployment") is None
+    clock.now += 0.25
+    assert throttle.admit(0, "EmpJob") is None
+    assert throttle.in_flight() == {(0, "EmpJob"): 3, (0, "EmpEmployment"): 1}
+
+
+def test_concurrency_caps_requests_in_flight():
+    throttle = Throttle([{"concurrency": 2}])
+    assert [throttle.admit(0, "EmpJob") for _ in range(2)] == [None, None]
+    assert throttle.admit(0, "EmpJob") == 1.0
+    throttle.release(0, "EmpJob")
+    assert throttle.admit(0, "EmpJob") is None
+    for _ in range(2):
+        throttle.release(0, "EmpJob")
+    assert throttle.in_flight() == {}
+
+
+def test_a_rejected_request_does_not_use_up_the_rate():
+    clock = Clock()
+    throttle = Throttle([{"rate": 1, "burst": 1, "concurrency": 1}], clock=clock)
+    assert throttle.admit(0, "") is None
+    assert throttle.admit(0, "") == 1.0
+    throttle.release(0, "")
+    clock.now += 1
+    assert throttle.admit(0, "") is None
+
+
+@pytest.mark.parametrize("spec, low, high", [
+    ({"ms": 50}, 0.05, 0.05),
+    ({"distribution": "uniform", "min_ms": 10, "max_ms": 20}, 0.01, 0.02),
+    ({"distribution": "normal", "mean_ms": 10, "stddev_ms": 100}, 0.0, 1.0),
+    ({"distribution": "lognormal", "median_ms": 100, "sigma": 0.5}, 0.0, 10.0),
+    ({"distribution": "exponential", "mean_ms": 0}, 0.0, 0.0),
+])
+def test_latency_samples(spec, low, high):
+    latency = Latency(spec)
+    rng = random.Random(7)
+    samples = [latency.sample(rng) for _ in range(200)]
+    assert all(low <= sample <= high for sample in samples)
+
+
+def test_delays_are_reproducible_from_the_seed():
+    rules = [{"latency": {"distribution": "lognormal", "median_ms": 100, "sigma": 0.5}}]
+    first, second = Throttle(rules, seed=3), Throttle(rules, seed=3)
+    assert [first.delay(0) for _ in range(5)] == [second.delay(0) for _ in range(5)]
+
+
+@pytest.mark.parametrize("spec", [
+    [],
+    {"speed": 1},
+    {"rate": 0},
+    {"rate": "fast"},
+    {"burst": 0},
+    {"concurrency": 0},
+    {"latency": {"distribution": "gamma"}},
+    {"latency": {"distribution": "uniform", "min_ms": 10}},
+    {"latency": {"ms": -1}},
+])
+def test_invalid_rules(spec):
+    with pytest.raises(ThrottleError):
+        Rule(spec)
+
+
+def test_profiles(tmp_path):
+    assert Throttle.load(None).rules == []
+    assert Throttle.load("successfactors").spec == PROFILES["successfactors"]
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps({"rules": [{"rate": 5}]}))
+    assert Throttle.load(str(path)).spec == [{"rate": 5}]
+    path.write_text("{")
+    with pytest.raises(ThrottleError):
+        Throttle.load(str(path))
+    with pytest.raises(ThrottleError):
+        Throttle.load(str(tmp_path / "missing.json"))
+    with pytest.raises(ThrottleError):
+        rules_of({"rate": 5})
+
+
+# Through the routes
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def throttle(monkeypatch):
+    """Install rules on the server with a clock of the test's own; the rules in force come back afterwards."""
+    clock = Clock()
+    monkeypatch.setattr(server, "THROTTLE", server.THROTTLE)
+
+    def install(*rules):
+        server.THROTTLE = Throttle(rules, clock=clock)
+        return clock
+    return install
+
+
+def test_empty_buckets_answer_429_with_retry_after(client, throttle):
+    clock = throttle({"entity": "ThrottleProbe", "rate": 0.25, "burst": 2})
+    url = f"{ROOT}/ThrottleProbe"
+    assert [client.get(url).status_code for _ in range(2)] == [200, 200]
+    rejected = client.get(url)
+    assert rejected.status_code == 429
+    assert rejected.headers["retry-after"] == "4"
+    # Other entities, and routes outside the service, are not throttled
+    assert client.get(f"{ROOT}/EmpJob", params={"$top": "1"}).status_code == 200
+    assert client.get("/health").status_code == 200
+    clock.now += 3.5
+    assert client.get(url).headers["retry-after"] == "1"
+    clock.now += 0.5
+    assert client.get(url).status_code == 200
+
+
+def test_requests_beyond_the_concurrency_cap_are_rejected(throttle):
+    throttle({"entity": "ThrottleProbe", "concurrency": 1, "latency": {"ms": 200}})
+
+    async def both():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://mock") as client:
+            first = asyncio.ensure_future(client.get(f"{ROOT}/ThrottleProbe"))
+            await asyncio.sleep(0.05)
+            second = await client.get(f"{ROOT}/ThrottleProbe")
+            third = await client.get(f"{ROOT}/EmpJob", params={"$top": "1"})
+            return (await first).status_code, second.status_code, third.status_code, server.THROTTLE.in_flight()
+
+    assert asyncio.run(both()) == (200, 429, 200, {})
+
+
+def test_profiles_are_replaced_through_the_admin_route(client, throttle):
+    throttle()
+    rules = [{"entity": "ThrottleProbe", "rate": 1}]
+    assert client.post("/admin/throttle", json={"rules": rules}).json() == {"rules": rules}
+    assert client.get("/admin/throttle").json() == {"rules": rules}
+    response = client.post("/admin/throttle", params={"profile": "slow-network"})
+    assert response.json() == {"rules": PROFILES["slow-network"]}
+    assert client.post("/admin/throttle", json=[{"rate": -1}]).status_code == 400
+    assert client.post("/admin/throttle", params={"profile": "no-such-profile"}).status_code == 400
+    assert client.post("/admin/throttle", content=b"{", headers={"Content-Type": "application/json"}).status_code == 400
+    # The rejected profiles left the last good one in force; an empty body lifts throttling
+    assert client.get("/admin/throttle").json() == {"rules": PROFILES["slow-network"]}
+    assert client.post("/admin/throttle").json() == {"rules": []}
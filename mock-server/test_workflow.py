@@ -0,0 +1,150 @@
+"""Tests for the workflow state machine, run against a store of its own."""
+
+import pytest
+
+from store import EntityStore, transaction
+from workflow import (APPROVED, CANCELLED, COMPLETED, PENDING, REJECTED, SENTBACK, WAITING, WorkflowEngine,
+                      WorkflowError)
+
+NOW = "2024-01-01T00:00:00"
+
+
+def _participator(number, request, owner, step, status):
+    return {"wfRequestParticipatorId": number, "wfRequestId": request, "ownerId": owner,
+            "participatorType": "APPROVER", "processingOrder": step, "status": status}
+
+
+@pytest.fixture
+def engine():
+    data = {
+        "WfRequest": [
+            {"wfRequestId": 1, "status": PENDING, "currentStepNum": 1, "totalSteps": 3, "createdBy": "EMP001"},
+            {"wfRequestId": 2, "status": PENDING, "currentStepNum": 1, "totalSteps": 1, "createdBy": "EMP004"},
+        ],
+        "WfRequestParticipator": [
+            _participator(1, 1, "EMP002", 1, PENDING),
+            _participator(2, 1, "EMP003", 2, WAITING),
+            # No one holds step 3 of request 1, so approving step 2 completes it
+            _participator(3, 2, "EMP002", 1, PENDING),
+        ],
+        "WfRequestComments": [],
+    }
+    keys = {"WfRequest": ("wfRequestId",), "WfRequestParticipator": ("wfRequestParticipatorId",),
+            "WfRequestComments": ("wfRequestCommentId",)}
+    return WorkflowEngine(EntityStore(data, keys))
+
+
+def _act(engine, action, request_id, user=None, comment=None):
+    request = engine.request((str(request_id),))
+    return engine.act(action, request, user, comment, NOW)
+
+
+def _statuses(engine, request_id):
+    rows = engine.participators.related(("wfRequestId",), (str(request_id),))
+    return {row["ownerId"]: row["status"] for row in rows}
+
+
+def test_approve_opens_the_next_step(engine):
+    request = _act(engine, "approve", 1, "EMP002")
+    assert (request["status"], request["currentStepNum"]) == (PENDING, 2)
+    assert _statuses(engine, 1) == {"EMP002": APPROVED, "EMP003": PENDING}
+    assert request["lastModifiedBy"] == "EMP002"
+
+
+def test_approving_the_last_held_step_completes_the_request(engine):
+    _act(engine, "approve", 1, "EMP002")
+    request = _act(engine, "approve", 1, "EMP003")
+    assert request["status"] == COMPLETED
+    assert _statuses(engine, 1) == {"EMP002": APPROVED, "EMP003": APPROVED}
+
+
+def test_reject_ends_the_request(engine):
+    request = _act(engine, "reject", 1, "EMP002")
+    assert request["status"] == REJECTED
+    with pytest.raises(WorkflowError) as raised:
+        _act(engine, "approve", 1, "EMP002")
+    assert raised.value.status_code == 409
+
+
+def test_sendback_reopens_the_previous_step(engine):
+    _act(engine, "approve", 1, "EMP002")
+    request = _act(engine, "sendback", 1, "EMP003")
+    assert (request["status"], request["currentStepNum"]) == (PENDING, 1)
+    assert _statuses(engine, 1) == {"EMP002": PENDING, "EMP003": WAITING}
+
+
+def test_sendback_from_the_first_step_returns_the_request_to_its_submitter(engine):
+    request = _act(engine, "sendback", 1, "EMP002")
+    assert (request["status"], request["currentStepNum"]) == (SENTBACK, 1)
+    # A sent back request can still be withdrawn, but not approved
+    with pytest.raises(WorkflowError):
+        _act(engine, "approve", 1, "EMP002")
+    assert _act(engine, "withdraw", 1, "EMP001")["status"] == CANCELLED
+
+
+def test_only_a_pending_approver_may_decide(engine):
+    for user in ("EMP003", "EMP001"):
+        with pytest.raises(WorkflowError) as raised:
+            _act(engine, "approve", 1, user)
+        assert raised.value.status_code == 403
+    assert engine.request(("1",))["currentStepNum"] == 1
+
+
+def test_only_the_submitter_may_withdraw(engine):
+    with pytest.raises(WorkflowError) as raised:
+        _act(engine, "withdraw", 1, "EMP002")
+    assert raised.value.status_code == 403
+    assert _act(engine, "withdraw", 1, "EMP001")["status"] == CANCELLED
+    assert _statuses(engine, 1) == {"EMP002": CANCELLED, "EMP003": WAITING}
+
+
+def test_anonymous_actions_act_for_whoever_holds_the_step(engine):
+    assert _act(engine, "approve", 2)["status"] == COMPLETED
+
+
+def test_participators_without_an_owner_are_skipped(engine):
+    engine.participators.insert({"wfRequestParticipatorId": 9, "wfRequestId": 1, "processingOrder": 1,
+                                 "status": PENDING})
+    with pytest.raises(WorkflowError) as raised:
+        _act(engine, "approve", 1, "EMP009")
+    assert raised.value.status_code == 403
+    assert _act(engine, "approve", 1, "EMP002")["currentStepNum"] == 2
+
+
+def test_comments_are_numbered_per_request(engine):
+    _act(engine, "comment", 1, "EMP002", "Looks fine")
+    _act(engine, "approve", 1, "EMP002", "Approved")
+    comments = engine.comments.related(("wfRequestId",), ("1",))
+    assert [(row["wfRequestCommentId"], row["comment"]) for row in comments] == [
+        ("1-1", "Looks fine"), ("1-2", "Approved")]
+
+
+def test_unknown_request(engine):
+    with pytest.raises(WorkflowError) as raised:
+        engine.request(("404",))
+    assert raised.value.status_code == 404
+
+
+def test_pending_queues_follow_transitions(engine):
+    assert [row["wfRequestId"] for row in engine.pending("EMP002")] == [1, 2]
+    assert engine.pending("EMP003") == []
+    _act(engine, "approve", 1, "EMP002")
+    assert [row["wfRequestId"] for row in engine.pending("EMP002")] == [2]
+    assert [row["wfRequestId"] for row in engine.pending("EMP003")] == [1]
+    request = engine.request(("1",))
+    assert engine.waits_on(request, "EMP003") and not engine.waits_on(request, "EMP002")
+    assert engine.waits_on(request)
+    _act(engine, "reject", 1, "EMP003")
+    assert not engine.waits_on(request)
+    assert [row["wfRequestId"] for row in engine.pending()] == [2]
+
+
+def test_an_action_is_rolled_back_with_the_transaction_around_it(engine):
+    with pytest.raises(RuntimeError):
+        with transaction():
+            _act(engine, "approve", 1, "EMP002", "Approved")
+            raise RuntimeError
+    request = engine.request(("1",))
+    assert (request["status"], request["currentStepNum"]) == (PENDING, 1)
+    assert _statuses(engine, 1) == {"EMP002": PENDING, "EMP003": WAITING}
+    assert engine.comments.related(("wfRequestId",), ("1",)) == []
@@ -0,0 +1,222 @@
+"""
+Rate limit, latency and concurrency simulation for the mock server.
+
+A throttling profile is a list of rules. A rule selects requests by method,
+route template and entity, each a glob such as `Background_*` that defaults
+to `*`, and applies any of:
+
+- `rate` and `burst`: a token bucket refilled with `rate` requests per second
+  that holds at most `burst` of them. A request that finds it empty is
+  answered 429 with a `Retry-After` header.
+- `concurrency`: the most requests served at once. Requests beyond it are
+  answered 429 as well.
+- `latency`: a delay drawn for every admitted request before it is served,
+  such as `{"distribution": "lognormal", "median_ms": 120, "sigma": 0.5}`.
+
+A request follows the first rule that selects it. Buckets and concurrency
+are counted per rule and entity, so `{"entity": "*", "rate": 10}` gives each
+entity a budget of its own. Nothing blocks the event loop: rejections are
+immediate and delays are awaited.
+"""
+
+import fnmatch
+import json
+import math
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Parameters each latency distribution takes, in milliseconds except `sigma`
+DISTRIBUTIONS: Dict[str, Tuple[str, ...]] = {
+    "fixed": ("ms",),
+    "uniform": ("min_ms", "max_ms"),
+    "normal": ("mean_ms", "stddev_ms"),
+    "lognormal": ("median_ms", "sigma"),
+    "exponential": ("mean_ms",),
+}
+
+# Built-in profiles, chosen by name instead of a file. Their figures are rough
+# stand-ins for a busy production tenant, not measurements of one.
+PROFILES: Dict[str, List[Dict[str, Any]]] = {
+    "successfactors": [
+        {"route": "*/$batch", "concurrency": 4, "latency": {"distribution": "lognormal", "median_ms": 400, "sigma": 0.6}},
+        {"method": "GET", "entity": "*", "rate": 50, "burst": 100,
+         "latency": {"distribution": "lognormal", "median_ms": 120, "sigma": 0.5}},
+        {"entity": "*", "rate": 10, "burst": 20, "concurrency": 8,
+         "latency": {"distribution": "lognormal", "median_ms": 250, "sigma": 0.5}},
+    ],
+    "slow-network": [
+        {"latency": {"distribution": "lognormal", "median_ms": 400, "sigma": 0.8}},
+    ],
+}
+
+_RULE_FIELDS = {"method", "route", "entity", "rate", "burst", "concurrency", "latency"}
+
+
+class ThrottleError(ValueError):
+    """Raised when a throttling profile cannot be interpreted."""
+
+
+class Latency:
+    """Delay distribution of a rule."""
+
+    def __init__(self, spec: Mapping[str, Any]):
+        self.spec = dict(spec)
+        self.distribution = self.spec.get("distribution", "fixed")
+        parameters = DISTRIBUTIONS.get(self.distribution)
+        if parameters is None:
+            raise ThrottleError(f"Unknown latency distribution: {self.distribution}")
+        try:
+            self.parameters = [float(self.spec[name]) for name in parameters]
+        except (KeyError, TypeError, ValueError):
+            raise ThrottleError(f"A {self.distribution} latency takes {', '.join(parameters)}")
+        if any(value < 0 for value in self.parameters):
+            raise ThrottleError("Latency parameters must not be negative")
+
+    def sample(self, rng: random.Random) -> float:
+        """A delay in seconds."""
+        kind, values = self.distribution, self.parameters
+        if kind == "fixed":
+            ms = values[0]
+        elif kind == "uniform":
+            ms = rng.uniform(values[0], values[1])
+        elif kind == "normal":
+            ms = rng.gauss(values[0], values[1])
+        elif kind == "lognormal":
+            ms = values[0] * math.exp(rng.gauss(0.0, values[1]))
+        else:
+            ms = rng.expovariate(1.0 / values[0]) if values[0] else 0.0
+        return max(ms, 0.0) / 1000
+
+
+class TokenBucket:
+    """Requests allowed through: `rate` per second on average, `capacity` in a burst."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take a token, returning 0, or return the seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Rule:
+    """One rule of a throttling profile."""
+
+    def __init__(self, spec: Mapping[str, Any]):
+        if not isinstance(spec, Mapping):
+            raise ThrottleError("Each throttling rule must be a JSON object")
+        unknown = set(spec) - _RULE_FIELDS
+        if unknown:
+            raise ThrottleError(f"Unknown throttling rule properties: {', '.join(sorted(unknown))}")
+        self.spec = dict(spec)
+        self.method = str(spec.get("method", "*")).upper()
+        self.route = str(spec.get("route", "*"))
+        self.entity = str(spec.get("entity", "*"))
+        try:
+            self.rate = float(spec["rate"]) if "rate" in spec else None
+            self.burst = float(spec.get("burst", max(1.0, self.rate or 1.0)))
+            self.concurrency = int(spec["concurrency"]) if "concurrency" in spec else None
+        except (TypeError, ValueError):
+            raise ThrottleError("rate, burst and concurrency must be numbers")
+        if (self.rate is not None and self.rate <= 0) or self.burst < 1 or (
+                self.concurrency is not None and self.concurrency < 1):
+            raise ThrottleError("rate must be positive, and burst and concurrency at least 1")
+        self.latency = Latency(spec["latency"]) if spec.get("latency") else None
+
+    def selects(self, method: str, route: str, entity: str) -> bool:
+        return (fnmatch.fnmatchcase(method, self.method) and fnmatch.fnmatchcase(route, self.route)
+                and fnmatch.fnmatchcase(entity, self.entity))
+
+
+class Throttle:
+    """The rules in force, with the buckets and in-flight counts of the requests they select."""
+
+    def __init__(self, rules: Iterable[Mapping[str, Any]] = (), seed: int = 0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rules = [Rule(spec) for spec in rules]
+        self.clock = clock
+        self._rng = random.Random(seed)
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._in_flight: Dict[Tuple[int, str], int] = {}
+        self._selected: Dict[Tuple[str, str, str], Optional[int]] = {}
+
+    @classmethod
+    def load(cls, source: Optional[str], seed: int = 0) -> "Throttle":
+        """The profile named by `source`: a built-in profile, a JSON file, or nothing for no throttling."""
+        if not source:
+            return cls(seed=seed)
+        if source in PROFILES:
+            return cls(PROFILES[source], seed)
+        if not os.path.exists(source):
+            raise ThrottleError(f"No built-in throttling profile or file named {source}")
+        with open(source, encoding="utf-8") as f:
+            try:
+                return cls(rules_of(json.load(f)), seed)
+            except ValueError as e:
+                raise ThrottleError(f"Invalid throttling profile {source}: {e}")
+
+    @property
+    def spec(self) -> List[Dict[str, Any]]:
+        return [rule.spec for rule in self.rules]
+
+    def select(self, method: str, route: str, entity: str) -> Optional[int]:
+        """Index of the rule a request follows, None if no rule selects it."""
+        key = (method, route, entity)
+        if key not in self._selected:
+            self._selected[key] = next(
+                (index for index, rule in enumerate(self.rules) if rule.selects(method, route, entity)), None)
+        return self._selected[key]
+
+    def admit(self, index: int, entity: str) -> Optional[float]:
+        """Count a request in under a rule, or return the seconds the client should wait before retrying."""
+        rule = self.rules[index]
+        key = (index, entity)
+        if rule.concurrency is not None and self._in_flight.get(key, 0) >= rule.concurrency:
+            return 1.0
+        if rule.rate is not None:
+            now = self.clock()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rule.rate, rule.burst, now)
+            wait = bucket.take(now)
+            if wait:
+                return wait
+        self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        return None
+
+    def release(self, index: int, entity: str) -> None:
+        """Count out a request admitted under a rule."""
+        key = (index, entity)
+        self._in_flight[key] -= 1
+        if not self._in_flight[key]:
+            del self._in_flight[key]
+
+    def in_flight(self) -> Dict[Tuple[int, str], int]:
+        """Requests being served, by rule index and entity."""
+        return dict(self._in_flight)
+
+    def delay(self, index: int) -> float:
+        """Seconds to hold an admitted request before serving it."""
+        latency = self.rules[index].latency
+        return latency.sample(self._rng) if latency is not None else 0.0
+
+
+def rules_of(profile: Any) -> List[Mapping[str, Any]]:
+    """Rules of a profile given as a list of rules or as `{"rules": [...]}`."""
+    if isinstance(profile, Mapping):
+        profile = profile.get("rules")
+    if not isinstance(profile, list):
+        raise ThrottleError('A throttling profile is a list of rules or {"rules": [...]}')
+    return profile
@@ -0,0 +1,142 @@
+"""
+Key-based upserts for the mock server.
+
+Each record is inserted, or merged into the stored row with the same key, through
+the entity's key index, and gets a status of its own, so a bad record does
+not fail the rest. Two routes feed it:
+
+- The OData `upsert` function import. It takes a JSON object or array
+  whose records name their entity in `__metadata`, as in
+  `{"__metadata": {"uri": "EmpJob(seqNumber=1,startDate='2020-01-01',userId='EMP001')"}, ...}`
+  or `{"__metadata": {"type": "SFOData.EmpJob"}, ...}`.
+- An NDJSON import of one entity, whose records are applied as the lines
+  of the body arrive.
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from odata import KeyPredicate, QueryOptionError, parse_key_predicate
+from records import Record
+from store import EntityStore, EntityTable
+
+INSERTED = "INSERTED"
+UPDATED = "UPDATED"
+UNCHANGED = "UNCHANGED"
+
+_HTTP_CODES = {INSERTED: 201, UPDATED: 200, UNCHANGED: 200}
+
+# Stands in for a property a stored row does not have
+_UNSET = object()
+
+
+class UpsertError(ValueError):
+    """Raised when a record cannot be upserted; reported as that record's status."""
+
+
+def _target(record: Any, entity: Optional[str]) -> Tuple[str, Dict[str, Any], Optional[str]]:
+    """Entity a record belongs to, its properties, and the key predicate of its metadata URI, if any."""
+    if isinstance(record, UpsertError):
+        raise record
+    if not isinstance(record, dict):
+        raise UpsertError("Expected a JSON object")
+    row = dict(record)
+    metadata = row.pop("__metadata", None) or {}
+    if not isinstance(metadata, dict):
+        raise UpsertError("__metadata must be an object")
+    uri = metadata.get("uri")
+    predicate = None
+    if uri:
+        # Absolute or relative, the URI ends in EntitySet or EntitySet(key predicate)
+        segment = uri.rstrip("/").rsplit("/", 1)[-1]
+        name, _, predicate = segment.partition("(")
+        predicate = predicate[:-1] if predicate.endswith(")") else None
+        entity = entity or name
+    elif metadata.get("type"):
+        entity = entity or metadata["type"].rsplit(".", 1)[-1]
+    if not entity:
+        raise UpsertError("No entity given; set __metadata.uri or __metadata.type")
+    return entity, row, predicate
+
+
+def _fill_key(table: EntityTable, row: Dict[str, Any], predicate: Optional[str]) -> None:
+    """Take the key properties a record leaves out from its metadata URI's key predicate."""
+    if predicate:
+        try:
+            key_values = parse_key_predicate(predicate).bind(table.key_fields)
+        except QueryOptionError as e:
+            raise UpsertError(str(e))
+        for name, value in (key_values or {}).items():
+            row.setdefault(name, value)
+    missing = [field for field in table.key_fields if field not in row]
+    if missing:
+        raise UpsertError(f"Missing key properties: {', '.join(missing)}")
+
+
+def upsert_row(table: EntityTable, row: Dict[str, Any], now: str) -> Tuple[str, Record]:
+    """Insert a row, or merge it into the stored row with the same key, returning the edit status.
+
+    Key values are matched the way keyed requests match them, so a `datetime'2020-01-01T00:00:00'`
+    key finds a row stored with `2020-01-01`.
+    """
+    key = KeyPredicate([(field, row[field]) for field in table.key_fields])
+    matches = table.lookup(table.key_fields, key.alternatives)
+    if not matches:
+        row.setdefault("createdDate", now)
+        return INSERTED, table.insert(row)
+    stored = matches[0]
+    # The stored row keeps its own key values; a literal from a URI predicate must not reformat or retype them
+    changes = {field: value for field, value in row.items()
+               if field not in table.key_fields and stored.get(field, _UNSET) != value}
+    if not changes:
+        return UNCHANGED, stored
+    changes["lastModifiedDate"] = now
+    return UPDATED, table.update(stored, changes)
+
+
+def _key_text(entity: str, table: EntityTable, row: Any) -> Optional[str]:
+    """The row's key predicate in URI form, such as `EmpJob(seqNumber=1,userId='EMP001')`."""
+    if not isinstance(row, (dict, Record)) or any(field not in row for field in table.key_fields):
+        return None
+    return "%s(%s)" % (entity, ",".join(
+        f"{field}='{row[field]}'" if isinstance(row[field], str) else f"{field}={row[field]}"
+        for field in table.key_fields))
+
+
+def upsert_record(store: EntityStore, record: Any, index: int, now: str,
+                  entity: Optional[str] = None) -> Dict[str, Any]:
+    """Upsert one record, returning its status in the shape of an OData upsert response entry."""
+    key = None
+    try:
+        target, row, predicate = _target(record, entity)
+        table = store.table(target)
+        _fill_key(table, row, predicate)
+        key = _key_text(target, table, row)
+        status, stored = upsert_row(table, row, now)
+        key = _key_text(target, table, stored)
+    except UpsertError as e:
+        return {"key": key, "status": "ERROR", "editStatus": None, "message": str(e),
+                "index": index, "httpCode": 400, "inlineResults": None}
+    return {"key": key, "status": "OK", "editStatus": status, "message": None,
+            "index": index, "httpCode": _HTTP_CODES[status], "inlineResults": None}
+
+
+async def read_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Decode an NDJSON body line by line as it arrives; undecodable lines come out as UpsertErrors."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield _decode(line)
+    if pending.strip():
+        yield _decode(pending)
+
+
+def _decode(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return UpsertError(f"Invalid JSON: {e}")
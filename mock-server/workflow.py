@@ -0,0 +1,208 @@
+"""
+Workflow requests as a state machine for the mock server.
+
+A workflow request (`WfRequest`) is approved in numbered steps, from 1 to
+its `totalSteps`; `currentStepNum` is the step it waits on. The approvers of
+a step are its `WfRequestParticipator` rows, whose `processingOrder` is the
+step number. Each participator carries a status of its own: WAITING until
+its step is reached, PENDING while the step is open, and then the outcome
+of the step.
+
+The actions move a request along:
+
+- approve closes the current step and opens the next one, or completes the
+  request after the last step;
+- reject ends the request;
+- sendback reopens the previous step, or hands the request back to its
+  submitter from the first step;
+- withdraw lets the submitter cancel a request that has not been decided;
+- comment leaves the request where it is.
+
+Every lookup goes through the tables' hash indexes: a request by its id,
+the approvers of a step by (step, request), and an approver's pending queue
+by (owner, status), which the tables keep current on every write. Acting on
+a request touches only the rows of the steps involved, and listing a queue
+costs only the length of the queue.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from records import Record
+from store import EntityStore, EntityTable, key_value, transaction
+
+# Request statuses
+PENDING = "PENDING"
+COMPLETED = "COMPLETED"
+REJECTED = "REJECTED"
+SENTBACK = "SENTBACK"
+CANCELLED = "CANCELLED"
+
+# Participator statuses besides PENDING and the step outcomes
+WAITING = "WAITING"
+APPROVED = "APPROVED"
+
+# Request statuses each action may be taken from
+ACTIONS = {
+    "approve": (PENDING,),
+    "reject": (PENDING,),
+    "sendback": (PENDING,),
+    "withdraw": (PENDING, SENTBACK),
+    "comment": (PENDING, SENTBACK, COMPLETED, REJECTED, CANCELLED),
+}
+
+# Indexed property combinations, in the order the lookups use them
+_STEP_FIELDS = ("processingOrder", "wfRequestId")
+_QUEUE_FIELDS = ("ownerId", "status")
+
+
+class WorkflowError(ValueError):
+    """Raised when an action cannot be taken; carries the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class WorkflowEngine:
+    """Runs the workflow actions against the store's request, participator and comment tables."""
+
+    def __init__(self, store: EntityStore):
+        self.store = store
+
+    @property
+    def requests(self) -> EntityTable:
+        return self.store.table("WfRequest")
+
+    @property
+    def participators(self) -> EntityTable:
+        return self.store.table("WfRequestParticipator")
+
+    @property
+    def comments(self) -> EntityTable:
+        return self.store.table("WfRequestComments")
+
+    def request(self, alternatives: Sequence[str]) -> Record:
+        """The request whose id is one of the given key strings."""
+        rows = self.requests.lookup(("wfRequestId",), [alternatives])
+        if not rows:
+            raise WorkflowError(f"Workflow request not found: {alternatives[0]}", 404)
+        return rows[0]
+
+    def approvers(self, request: Record, step: int) -> List[Record]:
+        """Participators holding a step of a request."""
+        return self.participators.related(_STEP_FIELDS, (key_value(step), key_value(request["wfRequestId"])))
+
+    def pending(self, user: Optional[str] = None) -> List[Record]:
+        """Requests waiting on a user, or every request waiting on an approver if no user is given."""
+        if user is None:
+            return self.requests.related(("status",), (PENDING,))
+        found: Dict[int, Record] = {}
+        for participator in self.participators.related(_QUEUE_FIELDS, (key_value(user), PENDING)):
+            for request in self.requests.related(("wfRequestId",), (key_value(participator["wfRequestId"]),)):
+                found[request.seq] = request
+        return [found[seq] for seq in sorted(found)]
+
+    def waits_on(self, request: Record, user: Optional[str] = None) -> bool:
+        """Whether a request is waiting on a user, or on any approver if no user is given."""
+        if request.get("status", PENDING) != PENDING:
+            return False
+        return user is None or self._holds(request, request.get("currentStepNum", 1), user)
+
+    def _holds(self, request: Record, step: int, user: str) -> bool:
+        """Whether a user is a pending approver of a step of a request."""
+        return any(row.get("ownerId") == user and row.get("status") == PENDING
+                   for row in self.approvers(request, step))
+
+    def act(self, action: str, request: Record, user: Optional[str], comment: Optional[str], now: str) -> Record:
+        """Take an action on a request as a user, or as whoever it is up to if no user is given.
+
+        The request and participator changes and the comment are applied
+        together or not at all.
+        """
+        status = request.get("status", PENDING)
+        if status not in ACTIONS[action]:
+            raise WorkflowError(f"Cannot {action} a workflow request with status {status}")
+        step = request.get("currentStepNum", 1)
+        if action in ("approve", "reject", "sendback") and user is not None and not self._holds(request, step, user):
+            raise WorkflowError(f"Workflow request is not pending for {user}", 403)
+        if action == "withdraw" and user is not None and request.get("createdBy", user) != user:
+            raise WorkflowError("Only the submitter may withdraw a workflow request", 403)
+
+        changes: Dict[str, Any] = {"lastModifiedDateTime": now}
+        if user is not None:
+            changes["lastModifiedBy"] = user
+        with transaction():
+            if action == "approve":
+                self._set_status(self.approvers(request, step), APPROVED)
+                changes.update(self._advance(request, step))
+            elif action == "reject":
+                self._set_status(self.approvers(request, step), REJECTED)
+                changes["status"] = REJECTED
+            elif action == "sendback":
+                self._set_status(self.approvers(request, step), WAITING)
+                if step > 1 and self._open(request, step - 1):
+                    changes["currentStepNum"] = step - 1
+                else:
+                    changes["status"] = SENTBACK
+            elif action == "withdraw":
+                self._set_status(self.approvers(request, step), CANCELLED)
+                changes["status"] = CANCELLED
+            if comment:
+                self._comment(request, user, comment, now)
+            if action != "comment":
+                self.requests.update(request, changes)
+        return request
+
+    def _advance(self, request: Record, step: int) -> Dict[str, Any]:
+        """Changes that move a request past an approved step; steps nobody holds are skipped."""
+        for following in range(step + 1, request.get("totalSteps", step) + 1):
+            if self._open(request, following):
+                return {"currentStepNum": following}
+        return {"status": COMPLETED}
+
+    def _open(self, request: Record, step: int) -> bool:
+        approvers = self.approvers(request, step)
+        self._set_status(approvers, PENDING)
+        return bool(approvers)
+
+    def _set_status(self, participators: Iterable[Record], status: str) -> None:
+        for participator in participators:
+            if participator.get("status") != status:
+                self.participators.update(participator, {"status": status})
+
+    def _comment(self, request: Record, user: Optional[str], comment: str, now: str) -> None:
+        request_id = request["wfRequestId"]
+        count = len(self.comments.related(("wfRequestId",), (key_value(request_id),)))
+        self.comments.insert({"wfRequestCommentId": f"{request_id}-{count + 1}", "wfRequestId": request_id,
+                              "comment": comment, "commentBy": user, "createdDate": now})
+
+    # Response shapes
+
+    @staticmethod
+    def action_result(request: Record) -> Dict[str, Any]:
+        """Entry of an action's `WfRequestActionResponse` collection."""
+        return {field: request[field] for field in ("wfRequestId", "status", "currentStepNum", "totalSteps")
+                if field in request}
+
+    @staticmethod
+    def pending_item(request: Record) -> Dict[str, Any]:
+        """A request as a `MyPendingWorkflow` entry."""
+        request_id = request["wfRequestId"]
+        return {
+            "wfRequestId": request_id,
+            "subject": f"{request.get('requestType', 'Workflow')} request",
+            "desc": f"Step {request.get('currentStepNum', 1)} of {request.get('totalSteps', 1)}",
+            "url": f"/sf/approval?wfRequestId={request_id}",
+        }
+
+    @staticmethod
+    def pending_data(request: Record) -> Dict[str, Any]:
+        """A request as a `WfRequestPendingDataResponse`, its properties forming one attribute group."""
+        return {
+            "wfRequestId": request["wfRequestId"],
+            "workflowAttributeGroups": [{
+                "title": request.get("requestType", "Workflow"),
+                "changeSet": [{"fieldId": field, "label": field, "newValue": str(value)}
+                              for field, value in request.items()],
+            }],
+        }